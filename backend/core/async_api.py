@@ -0,0 +1,58 @@
+"""
+Helpers for the native async (ASGI) views.
+
+DRF's `@api_view` only runs synchronously, so the async views are plain
+Django coroutines. These helpers give them the same authentication,
+method handling and JSON output as the DRF views they mirror.
+"""
+import os
+import json
+import asyncio
+import contextvars
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django_axor_auth.users.permissions import IsAuthenticated
+from .renderers import dumps
+
+# Bounded pool for CPU-bound work such as note encryption, keeps the
+# event loop free and limits how many requests compete for the CPU
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'ASYNC_CPU_WORKERS', None) or min(4, os.cpu_count() or 1),
+    thread_name_prefix='async_cpu'
+)
+
+
+async def run_cpu(func, *args):
+    # In the caller's context, so request timings see the work
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_executor, context.run, func, *args)
+
+
+def json_response(data, status=200, headers=None):
+    # Same output as the DRF views' renderer
+    return HttpResponse(dumps(data), status=status, headers=headers, content_type='application/json')
+
+
+def request_data(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        return {}
+
+
+def async_api_view(methods, authenticated=True):
+    """Async counterpart of `@api_view(methods)` plus `IsAuthenticated`."""
+    def decorator(view):
+        @csrf_exempt
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return json_response({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+            if authenticated and not IsAuthenticated().has_permission(request, None):
+                return json_response({"detail": "Authentication credentials were not provided."}, status=403)
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
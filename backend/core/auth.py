@@ -0,0 +1,169 @@
+"""
+Authentication with a short-lived cache of who holds a token or session.
+
+ActiveUserMiddleware replaces axor's and attaches `request.active_token` and
+`request.active_session` the same way, so `get_request_user()` and the
+permission classes work unchanged. The app token or session row it finds,
+with its user, is kept for AUTH_CACHE['TTL'] seconds under the hash the
+database stores, and the client's next requests skip the lookup.
+
+Entries of a user are dropped when one of their tokens or sessions is
+saved or deleted (logout) and when the user is saved or deleted
+(deactivation). axor revokes the sessions and tokens of a user in bulk too,
+which sends no signals, so a write to its account endpoints drops the
+entries of the user making it. Writes to CLEARING_PATHS clear the whole
+cache. The cache is per process, the other processes keep their entries up
+to TTL seconds.
+"""
+import copy
+import time
+import threading
+from collections import OrderedDict
+import jwt
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.utils.encoding import force_str
+from django.utils.http import urlsafe_base64_decode
+from django.utils.timezone import now
+from django_axor_auth.configurator import config
+from django_axor_auth.users.models import User
+from django_axor_auth.users.users_app_tokens.models import AppToken
+from django_axor_auth.users.users_sessions.models import Session
+from django_axor_auth.users.users_sessions.utils import hash_this, getClientIP, getUserAgent
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def get_setting(name, default=None):
+    return getattr(settings, 'AUTH_CACHE', {}).get(name, default)
+
+
+class CredentialCache:
+    """Bounded LRU from (model, hashed key) to an AppToken or Session row."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._users = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._drop(key)
+            self.misses += 1
+        return None
+
+    def set(self, key, row, ttl):
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (time.monotonic() + ttl, row)
+            self._users.setdefault(row.user_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in list(self._users.get(user_id, ())):
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._users.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, entries=len(self._entries))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._users.get(entry[1].user_id)
+        keys.discard(key)
+        if not keys:
+            del self._users[entry[1].user_id]
+
+
+credential_cache = CredentialCache(max_entries=get_setting('MAX_ENTRIES', 10000))
+
+
+def _invalidate_user(sender, instance, **kwargs):
+    credential_cache.invalidate_user(instance.pk if sender is User else instance.user_id)
+
+
+for _model in (User, AppToken, Session):
+    post_save.connect(_invalidate_user, sender=_model, dispatch_uid=f'auth_cache_{_model.__name__}_save')
+    post_delete.connect(_invalidate_user, sender=_model, dispatch_uid=f'auth_cache_{_model.__name__}_delete')
+
+
+def _copy(row):
+    # Views may change what they get, the cached row stays as it was read
+    row = copy.copy(row)
+    row.user = copy.copy(row.user)
+    return row
+
+
+def _authenticate(model, key, ip, ua):
+    """axor's authenticate_app_token/authenticate_session, through the cache."""
+    try:
+        hashed = hash_this(urlsafe_base64_decode(key).decode('ascii'))
+    except Exception:
+        return None
+    ttl = get_setting('TTL', 30)
+    row = credential_cache.get((model, hashed)) if ttl > 0 else None
+    # A client moving to another address or agent is recorded by axor
+    if row is not None and row.ip == ip and row.ua == ua and (model is AppToken or row.expire_at >= now()):
+        return _copy(row)
+    if model is AppToken:
+        row = AppToken.objects.authenticate_app_token(key, ip, ua)
+    else:
+        row = Session.objects.authenticate_session(key, ip, ua)
+    if row is not None and ttl > 0:
+        credential_cache.set((model, hashed), _copy(row), ttl)
+    return row
+
+
+def _jwt_claim(token, claim):
+    try:
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256']).get(claim)
+    except jwt.InvalidTokenError:
+        return None
+
+
+class ActiveUserMiddleware:
+    """axor's ActiveUserMiddleware, with the rows it finds cached."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        ip, ua = getClientIP(request), getUserAgent(request)
+        app_token = session = None
+        if 'Authorization' in request.headers:
+            key = _jwt_claim(force_str(request.headers['Authorization']).split(' ')[-1], 'app_token')
+            app_token = _authenticate(AppToken, key, ip, ua) if key else None
+        cookie = request.COOKIES.get(config.AUTH_COOKIE_NAME)
+        if cookie:
+            key = _jwt_claim(cookie, 'session_key')
+            session = _authenticate(Session, key, ip, ua) if key else None
+        request.active_token = app_token
+        request.active_session = session
+        user_id = (app_token or session).user_id if app_token or session else None
+        response = self.get_response(request)
+        if request.method in SAFE_METHODS:
+            return response
+        if request.path.startswith(tuple(get_setting('CLEARING_PATHS', ()))):
+            credential_cache.clear()
+        # Password changes and closing sessions revoke the user's others in bulk
+        elif user_id is not None and request.path.startswith(tuple(get_setting('REVOKING_PATHS', ()))):
+            credential_cache.invalidate_user(user_id)
+        return response
@@ -0,0 +1,98 @@
+import time
+import uuid
+import threading
+import jwt
+from django.conf import settings
+from django.db import connections
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
+from django.core.management.base import BaseCommand
+from django_axor_auth.users.models import User
+from django_axor_auth.logs.models import ApiCallLog
+from django_axor_auth.users.users_app_tokens.models import AppToken
+from core.middleware import writer
+
+MIDDLEWARES = dict(
+    inline='django_axor_auth.logs.middlewares.APILogMiddleware',
+    buffered='core.middleware.APILogMiddleware',
+)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ("Compare request latency with axor's APILogMiddleware, one insert per request, against the "
+            "buffered core.middleware.APILogMiddleware. Seeds a temporary user and removes it and its "
+            "log rows afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help="Requests per run.")
+        parser.add_argument('--concurrency', type=int, default=8, help="Requests in flight.")
+
+    def handle(self, *args, **options):
+        user, key, headers = self.seed()
+        paths = ['/api/expense_tracker/get_expense_tags/'] * options['requests']
+        try:
+            for name, middleware in MIDDLEWARES.items():
+                stack = [middleware if m == MIDDLEWARES['buffered'] else m for m in settings.MIDDLEWARE]
+                with override_settings(MIDDLEWARE=stack):
+                    elapsed, latencies, errors = self.run(paths, headers, options['concurrency'])
+                # Rows still queued count against the buffered run
+                began = time.perf_counter()
+                writer.flush()
+                self.report(name, elapsed + time.perf_counter() - began, latencies, errors)
+        finally:
+            writer.flush()
+            ApiCallLog.objects.filter(app_token_id=key).delete()
+            user.delete()
+
+    def seed(self):
+        user = User.objects.create_user(
+            email=f'benchmark-{uuid.uuid4().hex}@example.com',
+            password=uuid.uuid4().hex, first_name='Benchmark', last_name='User'
+        )
+        request = RequestFactory().get('/', HTTP_USER_AGENT='benchmark', REMOTE_ADDR='127.0.0.1')
+        key, token = AppToken.objects.create_app_token(user, request)
+        headers = {
+            'X-Requested-By': 'mobile',
+            'Authorization': 'Bearer ' + jwt.encode({'app_token': key}, settings.SECRET_KEY, algorithm='HS256'),
+            'User-Agent': 'benchmark',
+        }
+        return user, token.id, headers
+
+    def run(self, paths, headers, concurrency):
+        # Thread per connection, as a threaded WSGI server would run
+        latencies, errors, lock = [], [], threading.Lock()
+
+        def worker(share):
+            client = Client()
+            for path in share:
+                start = time.perf_counter()
+                response = client.get(path, headers=headers)
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+            connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(paths[i::concurrency],)) for i in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, latencies, errors
+
+    def report(self, name, elapsed, latencies, errors):
+        self.stdout.write(
+            f"{name:>8}: {len(latencies) / elapsed:8.1f} req/s  "
+            f"p50 {percentile(latencies, 0.50) * 1000:7.2f} ms  "
+            f"p95 {percentile(latencies, 0.95) * 1000:7.2f} ms  "
+            f"p99 {percentile(latencies, 0.99) * 1000:7.2f} ms  "
+            f"errors {len(errors)}"
+        )
+        if not errors:
+            self.stdout.write(self.style.SUCCESS(f"{name} run completed."))
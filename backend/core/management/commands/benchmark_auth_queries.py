@@ -0,0 +1,105 @@
+import json
+import uuid
+import jwt
+from django.conf import settings
+from django.db import connection
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings, CaptureQueriesContext
+from django.core.management.base import BaseCommand
+from django_axor_auth.users.models import User
+from django_axor_auth.users.users_app_tokens.models import AppToken
+from core.auth import credential_cache
+from core.middleware import writer
+
+RANGE = '2024-01-01/2024-12-31/'
+EXPENSE = dict(amount=12.5, date='2024-03-01', repeat=False, repeat_interval='monthly', tags=['food'])
+
+
+class Command(BaseCommand):
+    help = ("Count the queries of each expense_tracker and rich_notes endpoint with the authentication "
+            "cache off and on. Seeds a temporary user and removes it afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3, help="Requests per endpoint and run.")
+
+    def handle(self, *args, **options):
+        user, client = self.seed()
+        try:
+            endpoints = self.endpoints(client)
+            counts = {}
+            for name, ttl in (('off', 0), ('on', settings.AUTH_CACHE.get('TTL', 30) or 30)):
+                credential_cache.clear()
+                with override_settings(AUTH_CACHE=dict(settings.AUTH_CACHE, TTL=ttl)):
+                    # Fills the cache, the runs measure a client's following requests
+                    client.get('/api/expense_tracker/get_expense_tags/')
+                    for endpoint, request in endpoints:
+                        queries = 0
+                        for _ in range(options['repeat']):
+                            with CaptureQueriesContext(connection) as captured:
+                                response = request()
+                            if response.status_code >= 400:
+                                self.stderr.write(f"{endpoint}: {response.status_code}")
+                            queries += len(captured)
+                        counts.setdefault(endpoint, {})[name] = queries / options['repeat']
+            self.stdout.write(f"{'endpoint':<58} {'off':>6} {'on':>6}")
+            for endpoint, runs in counts.items():
+                self.stdout.write(f"{endpoint:<58} {runs['off']:6.1f} {runs['on']:6.1f}")
+            off = sum(runs['off'] for runs in counts.values()) / len(counts)
+            on = sum(runs['on'] for runs in counts.values()) / len(counts)
+            self.stdout.write(self.style.SUCCESS(
+                f"Queries per request: {off:.2f} -> {on:.2f} ({(off - on) / off * 100:.0f}% fewer)"))
+        finally:
+            writer.flush()
+            user.delete()
+
+    def seed(self):
+        user = User.objects.create_user(
+            email=f'benchmark-{uuid.uuid4().hex}@example.com',
+            password=uuid.uuid4().hex, first_name='Benchmark', last_name='User'
+        )
+        request = RequestFactory().get('/', HTTP_USER_AGENT='benchmark', REMOTE_ADDR='127.0.0.1')
+        key, _ = AppToken.objects.create_app_token(user, request)
+        client = Client(headers={
+            'X-Requested-By': 'mobile',
+            'Authorization': 'Bearer ' + jwt.encode({'app_token': key}, settings.SECRET_KEY, algorithm='HS256'),
+            'User-Agent': 'benchmark',
+        })
+        return user, client
+
+    def endpoints(self, client):
+        def post(path, data):
+            return lambda: client.post(path, json.dumps(data), content_type='application/json')
+
+        def put(path, data):
+            return lambda: client.put(path, json.dumps(data), content_type='application/json')
+
+        def get(path):
+            return lambda: client.get(path)
+
+        expense = post('/api/expense_tracker/add_expense/', dict(
+            **EXPENSE, name='Lunch'))().json()
+        post('/api/expense_tracker/add_income/', dict(amount=100, date='2024-03-01', name='Pay'))()
+        note = post('/api/rich_notes/create/', dict(
+            title='Benchmark', content=[{"type": "paragraph", "children": [{"text": "Benchmark note"}]}]))().json()
+        paths = [
+            ('POST add_income/', post('/api/expense_tracker/add_income/', dict(
+                amount=1, date='2024-03-02', name='Gift'))),
+            ('POST add_expense/', post('/api/expense_tracker/add_expense/', dict(
+                **EXPENSE, name='Coffee'))),
+            ('GET get_incomes/<range>/', get(f'/api/expense_tracker/get_incomes/{RANGE}')),
+            ('GET get_expenses/<range>/', get(f'/api/expense_tracker/get_expenses/{RANGE}')),
+            ('GET get_expense_tags/', get('/api/expense_tracker/get_expense_tags/')),
+            ('GET changes/', get('/api/expense_tracker/changes/')),
+            ('GET export/<range>/', get(f'/api/expense_tracker/export/{RANGE}')),
+            ('GET get_summary/<range>/', get(f'/api/expense_tracker/get_summary/{RANGE}')),
+            ('GET get_analytics/<range>/', get(f'/api/expense_tracker/get_analytics/{RANGE}')),
+            ('PUT expenses/<id>/change/', put(f'/api/expense_tracker/expenses/{expense["id"]}/change/', dict(
+                **EXPENSE, name='Dinner'))),
+            ('GET rich_notes all/', get('/api/rich_notes/all/')),
+            ('GET rich_notes all/?limit=', get('/api/rich_notes/all/?limit=20')),
+            ('GET rich_notes search/', get('/api/rich_notes/search/?q=benchmark')),
+            ('GET rich_notes <note_id>/', get(f'/api/rich_notes/{note["id"]}/')),
+            ('GET rich_notes <note_id>/revisions/', get(f'/api/rich_notes/{note["id"]}/revisions/')),
+            ('GET rich_notes share/links/<note_id>/', get(f'/api/rich_notes/share/links/{note["id"]}/')),
+        ]
+        return paths
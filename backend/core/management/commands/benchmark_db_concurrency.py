@@ -0,0 +1,135 @@
+import time
+import uuid
+import random
+import shutil
+import tempfile
+import threading
+from datetime import date, datetime
+import pytz
+from django.db import connections, transaction, OperationalError
+from django.db.models import Sum
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django_axor_auth.users.models import User
+from core import settings as project_settings
+from expense_tracker.models import Expense
+from rich_notes.models import Note
+
+PROFILES = ('plain', 'tuned')
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ("Run concurrent expense adds, note autosaves and reads against the 'plain' and 'tuned' "
+            "database profiles of core.settings.get_database(). SQLite runs on temporary database "
+            "files, Postgres on the configured database with a temporary user removed afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=4000, help="Requests per run.")
+        parser.add_argument('--concurrency', type=int, default=16, help="Requests in flight.")
+        parser.add_argument('--writes', type=float, default=0.4, help="Share of requests that write.")
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='benchmark_db_')
+        try:
+            for profile in PROFILES:
+                alias = f'benchmark_{profile}'
+                database = project_settings.get_database(profile)['default']
+                sqlite = database['ENGINE'].endswith('sqlite3')
+                if sqlite:
+                    database = dict(database, NAME=f'{directory}/{profile}.sqlite3')
+                connections.settings[alias] = connections.configure_settings({'default': database})['default']
+                try:
+                    if sqlite:
+                        call_command('migrate', database=alias, verbosity=0)
+                    user, notes = self.seed(alias)
+                    try:
+                        elapsed, latencies, errors = self.run(alias, user, notes, options)
+                    finally:
+                        user.delete(using=alias)
+                    self.report(profile, elapsed, latencies, errors)
+                finally:
+                    connections[alias].close()
+                    del connections.settings[alias]
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def seed(self, alias):
+        user = User.objects.using(alias).create(email=f'benchmark-{uuid.uuid4().hex}@example.com', password='!',
+                                                first_name='Benchmark', last_name='Concurrency')
+        now = datetime.now(pytz.utc)
+        notes = Note.objects.using(alias).bulk_create([
+            Note(id=uuid.uuid4(), user=user, title=f'Benchmark {i}', content=b'', created=now, updated=now)
+            for i in range(20)
+        ])
+        return user, [note.id for note in notes]
+
+    def run(self, alias, user, notes, options):
+        def add_expense():
+            # Reads before it writes, like the add endpoints
+            with transaction.atomic(using=alias):
+                Expense.objects.using(alias).filter(user=user, date=date(2024, 3, 1)).count()
+                Expense.objects.using(alias).create(user=user, name='Lunch', amount=12.5, date=date(2024, 3, 1))
+
+        def autosave():
+            with transaction.atomic(using=alias):
+                note = Note.objects.using(alias).get(id=random.choice(notes))
+                Note.objects.using(alias).filter(id=note.id).update(
+                    content=uuid.uuid4().bytes * 64, updated=datetime.now(pytz.utc))
+
+        def read():
+            Expense.objects.using(alias).filter(user=user).aggregate(total=Sum('amount'))
+            list(Note.objects.using(alias).filter(user=user).values('id', 'title')[:50])
+
+        operations = []
+        for _ in range(options['requests']):
+            if random.random() < options['writes']:
+                operations.append(random.choice((add_expense, autosave)))
+            else:
+                operations.append(read)
+        latencies, errors, lock = [], [], threading.Lock()
+
+        def worker(share):
+            connection = connections[alias]
+            for operation in share:
+                start = time.perf_counter()
+                # What request_started and request_finished do for a request
+                connection.close_if_unusable_or_obsolete()
+                try:
+                    operation()
+                    failed = None
+                except OperationalError as e:
+                    failed = e
+                finally:
+                    connection.close_if_unusable_or_obsolete()
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+                    if failed is not None:
+                        errors.append(str(failed))
+            connection.close()
+
+        concurrency = options['concurrency']
+        threads = [threading.Thread(target=worker, args=(operations[i::concurrency],)) for i in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, latencies, errors
+
+    def report(self, name, elapsed, latencies, errors):
+        self.stdout.write(
+            f"{name:>5}: {(len(latencies) - len(errors)) / elapsed:8.1f} ok req/s  "
+            f"p50 {percentile(latencies, 0.50) * 1000:7.2f} ms  "
+            f"p95 {percentile(latencies, 0.95) * 1000:7.2f} ms  "
+            f"p99 {percentile(latencies, 0.99) * 1000:7.2f} ms  "
+            f"errors {len(errors)}"
+        )
+        if errors:
+            self.stdout.write(f"       first error: {errors[0]}")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{name} run completed."))
@@ -0,0 +1,181 @@
+"""
+Latency histograms per route, method and status, in Prometheus text format.
+
+Histograms are HDR-style: values in microseconds fall into log-linear
+buckets, 2**SUB_BITS buckets per power of two, so every bucket is at most
+12.5% wide and finding one is a few bit operations. Each thread counts into
+its own shard, the hot path takes no lock, shards are summed when read.
+
+With METRICS['DIRECTORY'] set, every worker process writes its totals to
+`metrics-<pid>.json` there every FLUSH_SECONDS and on exit, and /metrics/
+adds up the files of all processes. Clear the directory when deploying, a
+new process reusing a pid overwrites the old totals.
+"""
+import os
+import glob
+import json
+import atexit
+import threading
+from django.conf import settings
+from django.http import HttpResponse, Http404
+
+SUB_BITS = 3
+SUB_BUCKETS = 1 << SUB_BITS
+# Up to about 2**30 microseconds, longer requests land in the last bucket
+BUCKETS = (30 - SUB_BITS + 1) * SUB_BUCKETS
+HISTOGRAMS = dict(
+    request=('http_request_duration_seconds', 'Time to respond, by route, method and status.'),
+    db=('http_request_db_seconds', 'Time spent in database queries per request.'),
+    crypto=('http_request_crypto_seconds', 'Time spent encrypting and decrypting per request.'),
+)
+
+
+def get_setting(name, default=None):
+    return getattr(settings, 'METRICS', {}).get(name, default)
+
+
+def bucket_index(microseconds):
+    if microseconds < 2 * SUB_BUCKETS:
+        return microseconds
+    shift = microseconds.bit_length() - SUB_BITS - 1
+    return min((shift + 1) * SUB_BUCKETS + ((microseconds >> shift) & (SUB_BUCKETS - 1)), BUCKETS - 1)
+
+
+def bucket_upper(index):
+    # Exclusive upper bound of a bucket, in seconds
+    if index < 2 * SUB_BUCKETS:
+        return (index + 1) / 1e6
+    shift = index // SUB_BUCKETS - 1
+    return (((index % SUB_BUCKETS) + SUB_BUCKETS + 1) << shift) / 1e6
+
+
+class Registry:
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _shard(self):
+        if self._pid != os.getpid():
+            self._start()
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _start(self):
+        # Once per process, counts inherited through fork belong to the parent
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._shards = []
+            self._local = threading.local()
+            if get_setting('DIRECTORY'):
+                threading.Thread(target=self._flush_loop, name='metrics_flush', daemon=True).start()
+                atexit.register(self.flush)
+
+    def observe(self, route, method, status, seconds):
+        """Count one request, `seconds` maps histogram names to durations."""
+        series = self._shard().setdefault((route, method, str(status)), {})
+        for name, value in seconds.items():
+            histogram = series.get(name)
+            if histogram is None:
+                histogram = series[name] = [0.0, 0, {}]
+            index = bucket_index(int(value * 1e6))
+            histogram[0] += value
+            histogram[1] += 1
+            histogram[2][index] = histogram[2].get(index, 0) + 1
+
+    def snapshot(self):
+        # [route, method, status, histogram, sum, count, {bucket: count}]
+        totals = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for labels, series in list(shard.items()):
+                for name, (total, count, buckets) in list(series.items()):
+                    merged = totals.setdefault((*labels, name), [0.0, 0, {}])
+                    merged[0] += total
+                    merged[1] += count
+                    for index, hits in list(buckets.items()):
+                        merged[2][index] = merged[2].get(index, 0) + hits
+        return [[*key, total, count, buckets] for key, (total, count, buckets) in totals.items()]
+
+    def _path(self):
+        return os.path.join(get_setting('DIRECTORY'), f'metrics-{os.getpid()}.json')
+
+    def flush(self):
+        path = self._path()
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def _flush_loop(self):
+        stop = threading.Event()
+        while not stop.wait(get_setting('FLUSH_SECONDS', 5)):
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def collect(self):
+        """Totals of this process plus the files of the other processes."""
+        rows = self.snapshot()
+        directory = get_setting('DIRECTORY')
+        if directory:
+            own = self._path()
+            for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+                if path == own:
+                    continue
+                try:
+                    with open(path) as f:
+                        rows.extend(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        totals = {}
+        for *key, total, count, buckets in rows:
+            merged = totals.setdefault(tuple(key), [0.0, 0, {}])
+            merged[0] += total
+            merged[1] += count
+            for index, hits in buckets.items():
+                merged[2][int(index)] = merged[2].get(int(index), 0) + hits
+        return totals
+
+
+registry = Registry()
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def exposition(totals):
+    lines = []
+    for name, (metric, help_text) in HISTOGRAMS.items():
+        series = sorted((key[:3], value) for key, value in totals.items() if key[3] == name)
+        if not series:
+            continue
+        # Every series lists the same bounds, so they can be summed by `le`
+        bounds = sorted(set().union(*(buckets for _, (_, _, buckets) in series)))
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+        for (route, method, status), (total, count, buckets) in series:
+            labels = f'route="{_label(route)}",method="{_label(method)}",status="{_label(status)}"'
+            cumulative = 0
+            for index in bounds:
+                cumulative += buckets.get(index, 0)
+                lines.append(f'{metric}_bucket{{{labels},le="{bucket_upper(index):.6g}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{metric}_sum{{{labels}}} {total:.6f}')
+            lines.append(f'{metric}_count{{{labels}}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    # Not for the public, scrape from an allowed address
+    if not get_setting('ENABLED', False) or request.META.get('REMOTE_ADDR') not in get_setting('ALLOWED_IPS', []):
+        raise Http404
+    return HttpResponse(exposition(registry.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
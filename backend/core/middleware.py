@@ -0,0 +1,240 @@
+"""
+API call logging off the request path.
+
+APILogMiddleware writes the rows axor's APILogMiddleware writes, under the
+same AXOR_AUTH switches, but only builds them: the row goes on a bounded
+queue and a writer thread saves the queue with bulk_create once
+API_LOG['BATCH_SIZE'] rows are waiting or FLUSH_SECONDS passed. axor's
+retention limits are applied by the writer every PRUNE_SECONDS instead of
+with every insert. When the queue is full, POLICY 'drop' discards the row
+and 'block' first waits up to BLOCK_SECONDS for room. The queue is written
+out at exit, rows still queued when a process is killed are lost. When the
+database refuses a batch, its rows are written one by one and only the
+failing ones are lost.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction, close_old_connections
+from django.utils.timezone import now
+from django_axor_auth.configurator import config
+from django_axor_auth.logs.models import ApiCallLog
+from django_axor_auth.logs.managers import getClientIP
+from django_axor_auth.users.api import get_request_user
+from django_axor_auth.users.users_sessions.utils import get_active_session
+from django_axor_auth.users.users_app_tokens.utils import get_active_token
+
+logger = logging.getLogger(__name__)
+
+
+def get_setting(name, default=None):
+    return getattr(settings, 'API_LOG', {}).get(name, default)
+
+
+def _content(response):
+    # Streaming responses have no content to look at
+    if response.streaming:
+        return {}
+    try:
+        return json.loads(response.content.decode('utf8'))
+    except ValueError:
+        return {}
+
+
+def build_log(request, response):
+    """The ApiCallLog row axor would save for this request, or None."""
+    if get_request_user(request) is None and config.LOG_ONLY_AUTHENTICATED:
+        return None
+    status_code = response.status_code
+    if status_code > 399 and config.LOG_4XX:
+        content = _content(response)
+        if isinstance(content, dict):
+            # The URL and the status have their own columns
+            content.pop('instance', None)
+            content.pop('status', None)
+        message = dict(log_message=content) if content else {}
+    elif status_code > 199 and config.LOG_2XX:
+        # Don't log login and signup requests
+        if 'login' in request.path or 'signup' in request.path:
+            return None
+        message = {}
+    else:
+        return None
+    session = get_active_session(request)
+    app_token = get_active_token(request)
+    return ApiCallLog(
+        url=request.get_full_path(),
+        status_code=status_code,
+        message=json.dumps(message),
+        session_id=session.id if session is not None else None,
+        app_token_id=app_token.id if app_token is not None else None,
+        source_ip=getClientIP(request),
+        created_at=now(),
+    )
+
+
+def prune(status_code):
+    """axor's limits on the number and the age of the rows of a status code."""
+    if status_code > 399:
+        max_num, max_age = config.LOG_4XX_MAX_NUM, config.LOG_4XX_MAX_AGE
+    else:
+        max_num, max_age = config.LOG_2XX_MAX_NUM, config.LOG_2XX_MAX_AGE
+    logs = ApiCallLog.objects.filter(status_code=status_code).order_by('created_at')
+    count = logs.count()
+    if count > max_num:
+        # Delete the diff and 10% more for breathing space
+        num_to_delete = count - max_num + int(max_num * 0.1)
+        if num_to_delete < count:
+            logs.filter(created_at__lt=logs[num_to_delete].created_at).delete()
+    logs.filter(created_at__lt=now() - timedelta(seconds=max_age)).delete()
+
+
+class LogWriter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self.queue = None
+        self.dropped = 0
+
+    def _start(self):
+        # Once per process, a forked worker gets its own queue and thread
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.queue = queue.Queue(get_setting('QUEUE_SIZE', 10000))
+            self._stop = threading.Event()
+            self._pending = set()
+            self._thread = threading.Thread(target=self._run, name='api_log_writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def put(self, log):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            if get_setting('POLICY', 'drop') == 'block':
+                self.queue.put(log, timeout=get_setting('BLOCK_SECONDS', 0.05))
+            else:
+                self.queue.put_nowait(log)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning("API log queue is full, %s row(s) dropped so far", self.dropped)
+
+    def _take(self):
+        # Waits for a first row, then until the batch is full or its time is up
+        flush_seconds = get_setting('FLUSH_SECONDS', 1.0)
+        batch_size = get_setting('BATCH_SIZE', 500)
+        try:
+            batch = [self.queue.get(timeout=flush_seconds)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + flush_seconds
+        while len(batch) < batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _write(self, batch):
+        try:
+            try:
+                with transaction.atomic():
+                    ApiCallLog.objects.bulk_create(batch, batch_size=get_setting('BATCH_SIZE', 500))
+                written = batch
+            except DatabaseError:
+                # One bad row fails the whole insert, keep the others
+                written = [log for log in batch if self._write_one(log)]
+                logger.warning("Could not write %s of %s API log row(s)", len(batch) - len(written), len(batch))
+            self._pending.update(log.status_code for log in written)
+        except Exception:
+            logger.exception("Could not write %s API log row(s)", len(batch))
+        finally:
+            close_old_connections()
+            for _ in batch:
+                self.queue.task_done()
+
+    def _write_one(self, log):
+        try:
+            with transaction.atomic():
+                log.save(force_insert=True)
+            return True
+        except DatabaseError:
+            return False
+
+    def _prune(self):
+        pending, self._pending = self._pending, set()
+        try:
+            for status_code in pending:
+                prune(status_code)
+        except Exception:
+            logger.exception("Could not prune the API log")
+        finally:
+            close_old_connections()
+
+    def _run(self):
+        pruned = time.monotonic()
+        while not self._stop.is_set():
+            batch = self._take()
+            if batch:
+                self._write(batch)
+            if self._pending and time.monotonic() - pruned >= get_setting('PRUNE_SECONDS', 60):
+                self._prune()
+                pruned = time.monotonic()
+        connections.close_all()
+
+    def flush(self, wait=True):
+        """Write the queued rows now, and wait for the batch being written."""
+        if self._pid != os.getpid():
+            return
+        batch = self._drain()
+        if batch:
+            self._write(batch)
+        if wait:
+            self.queue.join()
+
+    def stop(self):
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._thread.join(get_setting('FLUSH_SECONDS', 1.0) + 5)
+        self.flush(wait=False)
+        self._prune()
+
+
+writer = LogWriter()
+
+
+class APILogMiddleware:
+    """Logs API calls like axor's APILogMiddleware, through `writer`."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not request.path.startswith(config.URI_PREFIX) or not config.ENABLE_LOGGING:
+            return response
+        log = build_log(request, response)
+        if log is not None:
+            writer.put(log)
+        return response
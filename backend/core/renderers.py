@@ -0,0 +1,47 @@
+import math
+import orjson
+from decimal import Decimal
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+from .timing import timed
+
+# Datetimes, decimals, lazy strings and the like go through DRF's encoder,
+# so they come out as with JSONRenderer. Floats are the same numbers but
+# small exponents are written without padding (1e-7, not 1e-07).
+OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+_default = JSONEncoder().default
+
+
+def _check_finite(data):
+    # orjson writes NaN and Infinity as null, JSONRenderer refuses them
+    if isinstance(data, dict):
+        for value in data.values():
+            _check_finite(value)
+    elif isinstance(data, (list, tuple)):
+        for value in data:
+            _check_finite(value)
+    elif isinstance(data, float) and not math.isfinite(data) or isinstance(data, Decimal) and not data.is_finite():
+        raise ValueError(f"Out of range float values are not JSON compliant: {data!r}")
+
+
+def dumps(data):
+    with timed('render'):
+        ret = orjson.dumps(data, default=_default, option=OPTIONS)
+        # Only output with a null can hide a non-finite number
+        if b'null' in ret:
+            _check_finite(data)
+    # Same escaping as JSONRenderer, keeps the output a strict javascript subset
+    if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+        ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return ret
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer on orjson, indented output is left to JSONRenderer."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
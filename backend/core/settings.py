@@ -1,5 +1,7 @@
-from decouple import config
+from decouple import config, Csv
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -28,11 +30,14 @@ INSTALLED_APPS = [
     'django_axor_auth.web_auth',
 
     'rest_framework',
+    'core',
     'expense_tracker',
     'rich_notes'
 ]
 
 MIDDLEWARE = [
+    # Outermost, see REQUEST_TIMING
+    'core.timing.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -45,17 +50,28 @@ MIDDLEWARE = [
     # Apply on request
     # # required
     "django_axor_auth.middlewares.HeaderRequestedByMiddleware",
-    "django_axor_auth.users.middlewares.ActiveUserMiddleware",
+    "core.auth.ActiveUserMiddleware",
     # # optional
     "django_axor_auth.extras.middlewares.VerifyRequestOriginMiddleware",
     "django_axor_auth.extras.middlewares.ValidateJsonMiddleware",
 
     # Apply on response
-    "django_axor_auth.logs.middlewares.APILogMiddleware",
+    "core.middleware.APILogMiddleware",
+
+    # Innermost, times the view
+    'core.timing.ViewTimingMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
 
+REST_FRAMEWORK = {
+    # DRF's JSONRenderer on orjson, same values, see core/renderers.py
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -73,6 +89,49 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'core.wsgi.application'
+ASGI_APPLICATION = 'core.asgi.application'
+
+# Route the hot endpoints to their native async views, for ASGI servers
+ASYNC_VIEWS = config('DJANGO_ASYNC_VIEWS', default=False, cast=bool)
+# Threads for encryption in async views, defaults to min(4, CPUs)
+ASYNC_CPU_WORKERS = config('DJANGO_ASYNC_CPU_WORKERS', default=0, cast=int)
+
+# Per-request timings of SQL, crypto, serialization and middlewares. Sampled
+# requests get a Server-Timing header and a JSON line on the 'core.timing'
+# logger (INFO)
+REQUEST_TIMING = dict(
+    # Share of requests measured, 0 turns it off and 1 measures all
+    SAMPLE_RATE=config('DJANGO_TIMING_SAMPLE_RATE', default=0.0, cast=float),
+    SERVER_TIMING_HEADER=True,
+    LOG=True,
+)
+
+# Latency histograms per route, method and status at /metrics/, in the
+# Prometheus text format
+METRICS = dict(
+    ENABLED=config('DJANGO_METRICS', default=False, cast=bool),
+    # Directory shared by the worker processes, each writes its totals there.
+    # Empty keeps the totals of the process answering the scrape only
+    DIRECTORY=config('DJANGO_METRICS_DIR', default=''),
+    FLUSH_SECONDS=5,
+    # Who may scrape, by REMOTE_ADDR
+    ALLOWED_IPS=config('DJANGO_METRICS_ALLOWED_IPS', default='127.0.0.1,::1', cast=Csv()),
+)
+
+# API call log (core.middleware.APILogMiddleware), written in batches by a
+# background thread. What gets logged is set by the LOG_* keys of AXOR_AUTH
+API_LOG = dict(
+    # Rows waiting to be written, then POLICY applies: 'drop' the new row or
+    # 'block' the request up to BLOCK_SECONDS for room
+    QUEUE_SIZE=10000,
+    POLICY='drop',
+    BLOCK_SECONDS=0.05,
+    # Write when a batch is full or the oldest queued row is this old
+    BATCH_SIZE=500,
+    FLUSH_SECONDS=1.0,
+    # How often the retention limits of the log are applied
+    PRUNE_SECONDS=60,
+)
 
 # Axor
 AXOR_AUTH = dict(
@@ -97,6 +156,65 @@ AXOR_AUTH = dict(
     SMTP_PASSWORD=config('SMTP_PASSWORD', default=None),
     SMTP_DEFAULT_SEND_FROM=config('SMTP_DEFAULT_SEND_FROM', default=None),
 )
+# App tokens and sessions found by core.auth.ActiveUserMiddleware, cached
+# per process
+AUTH_CACHE = dict(
+    # Seconds a token or session is trusted without a lookup, 0 turns it off.
+    # Revocations reach the other processes within this time
+    TTL=30,
+    MAX_ENTRIES=10000,
+    # Writes here drop the requesting user's entries, axor revokes their
+    # sessions and tokens in bulk there
+    REVOKING_PATHS=['/api/user/', '/auth/'],
+    # Writes here clear the whole cache, for endpoints revoking other users'
+    CLEARING_PATHS=[],
+)
+# Rich Notes
+RICH_NOTES = dict(
+    # Pending editor operations before a note is compacted in the background
+    OPERATIONS_COMPACT_THRESHOLD=50,
+    # Decrypted note content cache, per process
+    CONTENT_CACHE_MAX_BYTES=32 * 1024 * 1024,
+    # Optional alias from CACHES to share decrypted content across processes
+    CONTENT_CACHE_BACKEND=None,
+    CONTENT_CACHE_TIMEOUT=300,
+    # Compression for stored note content: 'zlib' or 'zstd' (needs zstandard)
+    CONTENT_COMPRESSION='zlib',
+    # Share link resolution cache, per process unless a backend alias is set
+    SHARE_CACHE_MAX_ENTRIES=10000,
+    SHARE_CACHE_TTL=60,
+    SHARE_CACHE_NEGATIVE_TTL=10,
+    SHARE_CACHE_BACKEND=None,
+    # Page size for the paginated note list (?limit=&cursor=)
+    NOTES_PAGE_SIZE=50,
+    NOTES_MAX_PAGE_SIZE=200,
+    # Most operations accepted by one bulk request
+    BULK_MAX_OPERATIONS=500,
+    # Note history: seconds between revisions and diffs per snapshot
+    REVISION_MIN_INTERVAL=300,
+    REVISION_MAX_CHAIN=20,
+)
+
+# Expense Tracker
+EXPENSE_TRACKER = dict(
+    # Most projected occurrences listed by one get_expenses request
+    PROJECTION_MAX_OCCURRENCES=20000,
+    # Recurring expenses and expanded windows, cached per user and process
+    PROJECTION_CACHE_USERS=1000,
+    PROJECTION_CACHE_WINDOWS=16,
+    PROJECTION_CACHE_TTL=60,
+    # Longest range of one analytics request, its series have a value per day
+    ANALYTICS_MAX_DAYS=3660,
+    # Most incomes or expenses accepted by one batch request
+    BATCH_MAX_ITEMS=500,
+    # Change feed: page sizes, how long deletions are kept and how old a
+    # change has to be before it is listed
+    CHANGES_PAGE_SIZE=500,
+    CHANGES_MAX_PAGE_SIZE=2000,
+    TOMBSTONE_RETENTION_DAYS=90,
+    CHANGES_SETTLE_SECONDS=2,
+)
+
 # Set the origins that Axor API will respond to.
 # To set all origins, use value ['*']
 ALLOW_ORIGINS = [config('FRONTEND_URL')]
@@ -149,27 +267,76 @@ CORS_ALLOW_CREDENTIALS = True
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-def get_database():
+# DB_PROFILE=tuned (default) keeps Postgres connections open, or pools them
+# with DB_POOL=True, and runs SQLite in WAL mode. DB_PROFILE=plain is
+# Django's defaults, a new connection per request.
+DB_PROFILE = config('DB_PROFILE', default='tuned')
+
+# Run on every new SQLite connection. WAL lets readers and a writer work at
+# the same time, NORMAL sync is safe under WAL (a power loss can only drop
+# the last commits)
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA mmap_size=268435456',  # 256 MB
+    'PRAGMA cache_size=-32000',  # 32 MB
+    'PRAGMA temp_store=MEMORY',
+]
+
+
+def get_database(profile=DB_PROFILE):
+    if profile not in ('tuned', 'plain'):
+        raise ImproperlyConfigured("DB_PROFILE should be 'tuned' or 'plain'")
+    tuned = profile == 'tuned'
     host = config('DB_HOST', default=None)
     if host is None or len(host) == 0:
         Path(str(BASE_DIR) + "/db").mkdir(parents=True, exist_ok=True)
-        return {
-            'default': {
-                'ENGINE': 'django.db.backends.sqlite3',
-                'NAME': BASE_DIR / 'db' / 'db.sqlite3',
-            }
+        database = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db' / 'db.sqlite3',
         }
-    else:
-        return {
-            'default': {
-                'ENGINE': 'django.db.backends.postgresql',
-                'NAME': config('DB_NAME'),
-                'USER': config('DB_USERNAME'),
-                'PASSWORD': config('DB_PASSWORD'),
-                'HOST': config('DB_HOST'),
-                'PORT': config('DB_PORT'),
+        if tuned:
+            database['OPTIONS'] = {
+                'init_command': '; '.join(SQLITE_PRAGMAS),
+                # Seconds a writer waits for the lock (busy_timeout)
+                'timeout': config('DB_SQLITE_TIMEOUT', default=20, cast=int),
+                # Take the write lock when the transaction starts, a deferred
+                # transaction that has to upgrade fails without waiting
+                'transaction_mode': 'IMMEDIATE',
             }
+        return {'default': database}
+    else:
+        database = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME'),
+            'USER': config('DB_USERNAME'),
+            'PASSWORD': config('DB_PASSWORD'),
+            'HOST': config('DB_HOST'),
+            'PORT': config('DB_PORT'),
         }
+        if tuned and config('DB_POOL', default=False, cast=bool):
+            # Needs psycopg 3 with its pool, which requirements.txt does not pin
+            # (it has psycopg2-binary): pip install "psycopg[binary,pool]".
+            # Connections are checked when taken from the pool
+            try:
+                import_string('psycopg.connect')
+                check = import_string('psycopg_pool.ConnectionPool.check_connection')
+            except ImportError:
+                raise ImproperlyConfigured(
+                    'DB_POOL=True needs psycopg 3 and psycopg_pool, which requirements.txt does not install. '
+                    'Run pip install "psycopg[binary,pool]" or set DB_POOL=False'
+                )
+            database['OPTIONS'] = {'pool': {
+                'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+                'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+                'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+                'check': check,
+            }}
+        elif tuned:
+            # Reused by the requests of a worker thread, checked before reuse
+            database['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=600, cast=int)
+            database['CONN_HEALTH_CHECKS'] = True
+        return {'default': database}
 
 
 DATABASES = get_database()
@@ -0,0 +1,39 @@
+import json
+import math
+import uuid
+from decimal import Decimal
+from datetime import date, datetime, timedelta
+import pytz
+from django.test import SimpleTestCase
+from rest_framework.renderers import JSONRenderer
+
+from .renderers import ORJSONRenderer
+
+
+class ORJSONRendererTests(SimpleTestCase):
+    def render(self, data):
+        return JSONRenderer().render(data), ORJSONRenderer().render(data)
+
+    def test_same_bytes(self):
+        data = dict(
+            amount=12.5, ratio=1 / 3, large=123456789.125, negative=-0.0, whole=3.0,
+            decimal=Decimal('19.90'), exact=Decimal('0.1'),
+            created=datetime(2024, 3, 1, 12, 30, 15, 250000, tzinfo=pytz.utc),
+            naive=datetime(2024, 3, 1, 12, 30), day=date(2024, 2, 29), duration=timedelta(hours=1),
+            id=uuid.UUID('12345678-1234-5678-1234-567812345678'), text='a b', empty=None,
+        )
+        expected, rendered = self.render(data)
+        self.assertEqual(rendered, expected)
+
+    def test_exponents_differ_in_bytes_only(self):
+        for value in (1e-7, 1e16, 5e-324, 1.7976931348623157e308, Decimal('1E-7')):
+            expected, rendered = self.render([value])
+            with self.subTest(value=value):
+                self.assertEqual(json.loads(rendered), json.loads(expected))
+        self.assertEqual(self.render([1e-7]), (b'[1e-07]', b'[1e-7]'))
+
+    def test_non_finite_numbers_are_rejected(self):
+        for value in (math.nan, math.inf, -math.inf, Decimal('NaN'), Decimal('-Infinity')):
+            for renderer in (JSONRenderer(), ORJSONRenderer()):
+                with self.subTest(value=value, renderer=renderer), self.assertRaises(ValueError):
+                    renderer.render({'rows': [{'amount': value, 'note': None}]})
@@ -14,14 +14,25 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
+from core.metrics import metrics_view
+from expense_tracker import urls as expense_tracker_urls
+from rich_notes import urls as rich_notes_urls
 
-urlpatterns = [
-    path('admin/', admin.site.urls),
-	path('api/user/', include('django_axor_auth.users.urls')),
-	path('auth/', include('django_axor_auth.web_auth.urls')),
 
-	path('api/expense_tracker/', include('expense_tracker.urls')),
-	path('api/rich_notes/', include('rich_notes.urls')),
-]
+def get_urlpatterns(use_async=False):
+    return [
+        path('admin/', admin.site.urls),
+        path('api/user/', include('django_axor_auth.users.urls')),
+        path('auth/', include('django_axor_auth.web_auth.urls')),
+
+        path('api/expense_tracker/', include(expense_tracker_urls.get_urlpatterns(use_async))),
+        path('api/rich_notes/', include(rich_notes_urls.get_urlpatterns(use_async))),
+
+        path('metrics/', metrics_view),
+    ]
+
+
+urlpatterns = get_urlpatterns(settings.ASYNC_VIEWS)
@@ -0,0 +1,101 @@
+from django.db.models import Sum, Count
+import numpy as np
+
+from .models import Income, Expense, TaggedExpense
+from core.timing import timed
+from .utils import get_setting
+
+# Breakdowns are computed over column arrays instead of row objects. The
+# database sums amounts per day and per tag, numpy bins the days into one
+# slot per day of the range, groups weeks and months from that daily series
+# and computes the rolling windows and percentiles. Only expense amounts are
+# loaded row by row, as a flat column for the percentiles.
+PERCENTILES = (50, 75, 90, 95, 99)
+
+
+class RangeTooLargeException(Exception):
+    pass
+
+
+def _per_day(model, user, start, end):
+    rows = model.objects.filter(user=user, date__range=(start, end)).order_by() \
+        .values_list('date').annotate(total=Sum('amount'))
+    return list(rows)
+
+
+def fetch(user, start, end):
+    """Columns the breakdown is computed from, (date, total) per day of incomes
+    and expenses, expense amounts, and (tag, total, count) of tagged expenses."""
+    return dict(
+        incomes=_per_day(Income, user, start, end),
+        expenses=_per_day(Expense, user, start, end),
+        amounts=list(Expense.objects.filter(user=user, date__range=(start, end)).values_list('amount', flat=True)),
+        tags=list(TaggedExpense.objects.filter(user=user, expense__date__range=(start, end)).order_by()
+                  .values_list('tag__name').annotate(total=Sum('expense__amount'), count=Count('id'))),
+    )
+
+
+def _daily(rows, start, length):
+    # One slot per day of the range
+    if not rows:
+        return np.zeros(length)
+    days = np.array([day.toordinal() for day, _ in rows], dtype=np.int64) - start.toordinal()
+    return np.bincount(days, weights=[total for _, total in rows], minlength=length)
+
+
+def _grouped(keys, series):
+    # Sums of each series per distinct key, keys are sorted
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return keys, [np.bincount(inverse, weights=values, minlength=len(keys)) for values in series]
+
+
+def _rolling_mean(values, window):
+    # Trailing mean, shorter windows at the start of the range
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    upper = np.arange(1, len(values) + 1)
+    lower = np.maximum(upper - window, 0)
+    return (sums[upper] - sums[lower]) / (upper - lower)
+
+
+def _series(values):
+    return np.round(values, 2).tolist()
+
+
+@timed('analytics')
+def breakdown(rows, start, end, window=7):
+    """Daily, weekly and monthly income, expense and net, per-tag totals and
+    percentiles of expense amounts over `rows` as returned by fetch()."""
+    first, last = np.datetime64(start, 'D'), np.datetime64(end, 'D')
+    if (last - first).astype(np.int64) >= get_setting('ANALYTICS_MAX_DAYS', 3660):
+        raise RangeTooLargeException
+    days = np.arange(first, last + 1)
+    income = _daily(rows['incomes'], start, len(days))
+    expense = _daily(rows['expenses'], start, len(days))
+    net = income - expense
+    # Weeks start on Monday, 1970-01-01 was a Thursday
+    mondays = days - (days.astype(np.int64) + 3) % 7
+    weeks, weekly = _grouped(mondays, (income, expense, net))
+    months, monthly = _grouped(days.astype('datetime64[M]'), (income, expense, net))
+    tags = sorted(rows['tags'], key=lambda tag: (-tag[1], tag[0]))
+    tags = dict(name=[name for name, _, _ in tags], total=[round(total, 2) for _, total, _ in tags],
+                count=[count for _, _, count in tags])
+    amounts = np.array(rows['amounts'], dtype=np.float64)
+    percentiles = dict.fromkeys((f'p{p}' for p in PERCENTILES))
+    if len(amounts):
+        percentiles = dict(zip(percentiles, _series(np.percentile(amounts, PERCENTILES))))
+    return dict(
+        start=str(first),
+        end=str(last),
+        window=window,
+        totals=dict(income=round(float(income.sum()), 2), expense=round(float(expense.sum()), 2),
+                    net=round(float(net.sum()), 2)),
+        daily=dict(income=_series(income), expense=_series(expense), net=_series(net),
+                   rolling_expense=_series(_rolling_mean(expense, window)),
+                   rolling_net=_series(_rolling_mean(net, window))),
+        weekly=dict(start=[str(week) for week in weeks], income=_series(weekly[0]),
+                    expense=_series(weekly[1]), net=_series(weekly[2])),
+        monthly=dict(month=[str(month) for month in months], income=_series(monthly[0]),
+                     expense=_series(monthly[1]), net=_series(monthly[2])),
+        tags=tags,
+        expense_percentiles=percentiles,
+    )
@@ -0,0 +1,52 @@
+from datetime import datetime
+from asgiref.sync import sync_to_async
+from django_axor_auth.users.api import get_request_user
+from django_axor_auth.utils.error_handling.error_message import ErrorMessage
+from core.async_api import async_api_view, json_response
+
+from .models import Income, Expense
+from .serializers import INCOME_ROWS, aexpense_rows
+from . import views
+
+# Async versions of the date range queries, routed instead of the views in
+# views.py when settings.ASYNC_VIEWS is on.
+
+
+def parse_range(date_start, date_end):
+    try:
+        return datetime.strptime(date_start, '%Y-%m-%d').date(), datetime.strptime(date_end, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def invalid_date(request):
+    return ErrorMessage(
+        title='Invalid Date',
+        detail='Date should be in the format YYYY-MM-DD',
+        status=400,
+        code='invalid_date',
+        instance=request.build_absolute_uri()
+    ).to_response()
+
+
+@async_api_view(['GET'])
+async def get_incomes(request, date_start=None, date_end=None):
+    user = get_request_user(request)
+    date_range = parse_range(date_start, date_end)
+    if date_range is None:
+        return invalid_date(request)
+    income = Income.objects.filter(user=user, date__range=date_range).order_by('-date')
+    return json_response(INCOME_ROWS([row async for row in income.values(*INCOME_ROWS.sources)]))
+
+
+@async_api_view(['GET'])
+async def get_expenses(request, date_start=None, date_end=None):
+    if 'projection' in request.GET:
+        # Projections read through the per-user cache, which is sync
+        return await sync_to_async(views.get_expenses)(request, date_start, date_end)
+    user = get_request_user(request)
+    date_range = parse_range(date_start, date_end)
+    if date_range is None:
+        return invalid_date(request)
+    expense = Expense.objects.filter(user=user, date__range=date_range).order_by('-date')
+    return json_response(await aexpense_rows(expense))
@@ -0,0 +1,110 @@
+import math
+from datetime import datetime
+from django.db import transaction
+from django.utils.timezone import now
+
+from .models import Income, Expense, TaggedExpense
+from .rollups import record_bulk
+from .changes import stamp
+from .tags import clean_tag_names, resolve_tags
+from .recurrence import projection_cache
+from .serializers import INCOME_ROWS, expense_rows
+
+# Batches are validated item by item before anything is written, valid
+# items are then inserted with one bulk_create per table in one transaction.
+NAME_LENGTH = 255
+INTERVALS = [interval for interval, _ in Expense.repeat_choices]
+
+
+class InvalidItemException(Exception):
+    def __init__(self, code, detail):
+        super().__init__(detail)
+        self.code = code
+        self.detail = detail
+
+
+def _parse_common(item):
+    if not isinstance(item, dict):
+        raise InvalidItemException('invalid_item', 'Each item should be an object')
+    name = item.get('name')
+    if not isinstance(name, str) or len(name) > NAME_LENGTH:
+        raise InvalidItemException('invalid_name', f'Name should be text of at most {NAME_LENGTH} characters')
+    try:
+        amount = float(item.get('amount'))
+    except (TypeError, ValueError):
+        amount = math.nan
+    if not math.isfinite(amount):
+        raise InvalidItemException('invalid_amount', 'Amount should be a number')
+    try:
+        day = datetime.strptime(item.get('date'), '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise InvalidItemException('invalid_date', 'Date should be in the format YYYY-MM-DD')
+    return name, amount, day
+
+
+def parse_income(user, item, added_at):
+    name, amount, day = _parse_common(item)
+    return Income(name=name, amount=amount, date=day, added_at=added_at, user=user)
+
+
+def parse_expense(user, item, added_at):
+    # Returns the expense and its tag names
+    name, amount, day = _parse_common(item)
+    repeat = item.get('repeat')
+    if item.get('repeat_interval') not in INTERVALS:
+        raise InvalidItemException('invalid_repeat_interval', 'Repeat interval should be daily, weekly, monthly or yearly')
+    tags = item.get('tags')
+    names = clean_tag_names(tags) if tags is None or isinstance(tags, list) else None
+    if names is None or any(len(name) > NAME_LENGTH for name in names):
+        raise InvalidItemException('invalid_tags', f'Tags should be a list of names of at most {NAME_LENGTH} characters')
+    expense = Expense(name=name, amount=amount, date=day, repeat=repeat if isinstance(repeat, bool) else False,
+                      repeat_interval=item['repeat_interval'], added_at=added_at, user=user)
+    return expense, names
+
+
+def add_batch(user, kind, items, atomic=False):
+    """Validate and insert incomes or expenses, returns (results, written).
+
+    Results are per item, in the order of `items`: the created record with
+    status 201, or status 400 with an error code. With `atomic`, nothing is
+    written when any item is invalid and only the invalid items are returned.
+    Without it, nothing is written only when every item is invalid.
+    """
+    added_at = now()
+    parse = parse_income if kind == 'incomes' else parse_expense
+    results, parsed = [None] * len(items), []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index, parse(user, item, added_at)))
+        except InvalidItemException as e:
+            results[index] = dict(index=index, status=400, code=e.code, detail=e.detail)
+    if len(parsed) == 0 or atomic and len(parsed) < len(items):
+        return [result for result in results if result is not None], False
+    with transaction.atomic():
+        if kind == 'incomes':
+            incomes = Income.objects.bulk_create([income for _, income in parsed])
+            record_bulk(user.id, incomes, [])
+            stamp(Income, incomes)
+        else:
+            expenses = [expense for _, expense in parsed]
+            Expense.objects.bulk_create([expense for expense, _ in expenses])
+            # Tags of the whole batch are resolved at once
+            tags = resolve_tags(user, clean_tag_names(name for _, names in expenses for name in names))
+            TaggedExpense.objects.bulk_create([
+                TaggedExpense(expense=expense, tag=tags[name], user=user)
+                for expense, names in expenses for name in names
+            ])
+            record_bulk(user.id, [], expenses)
+            stamp(Expense, [expense for expense, _ in expenses])
+    if kind == 'expenses' and parsed:
+        projection_cache.invalidate(user.id)
+    # Read back the way the list endpoints return them
+    ids = [(record[0] if kind == 'expenses' else record).id for _, record in parsed]
+    if kind == 'incomes':
+        rows = INCOME_ROWS(Income.objects.filter(id__in=ids).values(*INCOME_ROWS.sources))
+    else:
+        rows = expense_rows(Expense.objects.filter(id__in=ids))
+    rows = {row['id']: row for row in rows}
+    for (index, _), record_id in zip(parsed, ids):
+        results[index] = dict(index=index, status=201, **rows[str(record_id)])
+    return results, True
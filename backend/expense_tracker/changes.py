@@ -0,0 +1,100 @@
+import uuid
+import base64
+from datetime import timedelta
+from django.db.models import Q
+from django.utils.timezone import now
+from django.utils.dateparse import parse_datetime
+
+from .models import Income, Expense, Tombstone
+from .serializers import INCOME_ROWS, expense_rows
+from .utils import get_setting
+
+# The change feed lists incomes and expenses by updated_at and deletions by
+# deleted_at, merged into one order on (timestamp, id). The cursor is the
+# last (timestamp, id) a client has seen. Changes younger than
+# CHANGES_SETTLE_SECONDS are held back, so a write that took its timestamp
+# before a read but committed after it is not skipped. Transactions that may
+# run longer than that, imports and batches, stamp() their rows last.
+FIRST = uuid.UUID(int=0)
+
+
+class InvalidCursorException(Exception):
+    pass
+
+
+class CursorExpiredException(Exception):
+    # Tombstones after the cursor may have been purged already
+    pass
+
+
+def encode_cursor(timestamp, record_id):
+    raw = f"{timestamp.isoformat()}|{record_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        timestamp, record_id = raw.split('|', 1)
+        timestamp, record_id = parse_datetime(timestamp), uuid.UUID(record_id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursorException
+    if timestamp is None or timestamp.tzinfo is None:
+        raise InvalidCursorException
+    return timestamp, record_id
+
+
+def stamp(model, records):
+    # auto_now took the time of the insert, move it to just before the commit
+    model.objects.filter(id__in=[record.id for record in records]).update(updated_at=now())
+
+
+def _after(queryset, field, since, until, limit):
+    # (timestamp, id, source) after the cursor, oldest first
+    if since is not None:
+        queryset = queryset.filter(Q(**{f'{field}__gt': since[0]}) | Q(**{field: since[0], 'id__gt': since[1]}))
+    return queryset.filter(**{f'{field}__lte': until}).order_by(field, 'id').values_list(field, 'id')[:limit]
+
+
+def changes(user, since=None, limit=500):
+    """Upserts and deletes of `user` after the cursor `since`, at most `limit`.
+
+    A record can be in both lists of one page when it was changed and then
+    deleted, deletes should be applied last.
+    """
+    if since is not None and since[0] < now() - timedelta(days=get_setting('TOMBSTONE_RETENTION_DAYS', 90)):
+        raise CursorExpiredException
+    until = now() - timedelta(seconds=get_setting('CHANGES_SETTLE_SECONDS', 2))
+    # Each source is read up to the page size plus one, the merge picks the page
+    page = sorted(
+        [(timestamp, record_id, 'incomes') for timestamp, record_id in
+         _after(Income.objects.filter(user=user), 'updated_at', since, until, limit + 1)] +
+        [(timestamp, record_id, 'expenses') for timestamp, record_id in
+         _after(Expense.objects.filter(user=user), 'updated_at', since, until, limit + 1)] +
+        [(timestamp, record_id, 'deletes') for timestamp, record_id in
+         _after(Tombstone.objects.filter(user=user), 'deleted_at', since, until, limit + 1)]
+    )
+    has_more = len(page) > limit
+    page = page[:limit]
+    ids = {source: [record_id for _, record_id, kind in page if kind == source]
+           for source in ('incomes', 'expenses', 'deletes')}
+    deletes = dict(incomes=[], expenses=[])
+    for kind, record_id in Tombstone.objects.filter(id__in=ids['deletes']).order_by('deleted_at', 'id') \
+            .values_list('kind', 'record_id'):
+        deletes[kind + 's'].append(record_id)
+    incomes = Income.objects.filter(id__in=ids['incomes']).order_by('updated_at', 'id')
+    expenses = Expense.objects.filter(id__in=ids['expenses']).order_by('updated_at', 'id')
+    if has_more:
+        cursor = page[-1][:2]
+    else:
+        # Caught up to `until`, later changes are after it
+        cursor = max(([page[-1][:2]] if page else []) + [(until, FIRST)])
+    return dict(
+        upserts=dict(
+            incomes=INCOME_ROWS(incomes.values(*INCOME_ROWS.sources)) if ids['incomes'] else [],
+            expenses=expense_rows(expenses) if ids['expenses'] else [],
+        ),
+        deletes=deletes,
+        next=encode_cursor(*cursor),
+        has_more=has_more,
+    )
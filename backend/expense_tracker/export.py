@@ -0,0 +1,66 @@
+import csv
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Income, Expense
+
+# Rows are read with .iterator() and written one at a time, tags are
+# prefetched per chunk, so memory does not grow with the size of the export.
+CHUNK_SIZE = 2000
+COLUMNS = ['kind', 'id', 'date', 'name', 'amount', 'repeat', 'repeat_interval', 'tags', 'added_at']
+KINDS = ('incomes', 'expenses')
+
+
+class Echo:
+    # csv.writer needs a file, this one hands each line back
+    def write(self, value):
+        return value
+
+
+def iter_rows(user, date_start, date_end, kinds=KINDS):
+    if 'incomes' in kinds:
+        incomes = Income.objects.filter(user=user, date__range=(date_start, date_end)).order_by('date', 'id')
+        for income in incomes.iterator(chunk_size=CHUNK_SIZE):
+            yield dict(kind='income', id=income.id, date=income.date, name=income.name, amount=income.amount,
+                       repeat=None, repeat_interval=None, tags=[], added_at=income.added_at)
+    if 'expenses' in kinds:
+        expenses = Expense.objects.prefetch_related('tags__tag').filter(
+            user=user, date__range=(date_start, date_end)).order_by('date', 'id')
+        for expense in expenses.iterator(chunk_size=CHUNK_SIZE):
+            yield dict(kind='expense', id=expense.id, date=expense.date, name=expense.name, amount=expense.amount,
+                       repeat=expense.repeat, repeat_interval=expense.repeat_interval,
+                       tags=[row.tag.name for row in expense.tags.all()], added_at=expense.added_at)
+
+
+def iter_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        row['tags'] = ';'.join(row['tags'])
+        row['date'] = row['date'].isoformat()
+        row['added_at'] = row['added_at'].isoformat()
+        yield writer.writerow([row[column] for column in COLUMNS])
+
+
+def iter_ndjson(rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+def buffered(lines, size=64 * 1024):
+    # Fewer, larger writes to the server than one per row
+    buffer, length = [], 0
+    for line in lines:
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+FORMATS = dict(
+    csv=(iter_csv, 'text/csv'),
+    ndjson=(iter_ndjson, 'application/x-ndjson'),
+)
@@ -0,0 +1,230 @@
+import io
+import re
+import csv
+import html
+from datetime import datetime
+from collections import Counter
+from django.db import transaction
+from django.utils.timezone import now
+
+from .models import Income, Expense, TaggedExpense
+from .rollups import record_bulk
+from .changes import stamp
+from .tags import clean_tag_names, resolve_tags
+from .recurrence import projection_cache
+
+# Bank statements are read as a stream of records and written in chunks,
+# so memory depends on the chunk size and not on the size of the file.
+# Negative amounts are expenses, positive amounts are incomes.
+
+DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y', '%d.%m.%Y', '%Y%m%d')
+MAX_ERRORS = 20
+NAME_LENGTH = 255
+
+CSV_COLUMNS = dict(
+    date=('date', 'transaction date', 'posted date', 'posting date', 'booking date'),
+    amount=('amount', 'transaction amount'),
+    debit=('debit', 'withdrawal', 'money out'),
+    credit=('credit', 'deposit', 'money in'),
+    name=('name', 'description', 'payee', 'details', 'narrative', 'memo'),
+    tags=('tags', 'category'),
+)
+
+
+class InvalidStatementException(Exception):
+    pass
+
+
+def parse_date(value, date_format=None):
+    value = value.strip()
+    for fmt in (date_format,) if date_format else DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Unknown date '{value}'")
+
+
+def parse_amount(value):
+    value = re.sub(r'[\s$€£,]', '', value or '')
+    if value.startswith('(') and value.endswith(')'):
+        value = '-' + value[1:-1]
+    return float(value) if value else 0.0
+
+
+# Readers, yield (date, signed amount, name, tags)
+# -----------------------------------------------
+def read_csv(stream, date_format=None):
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    header = [column.strip().lower() for column in next(reader, [])]
+    columns = {
+        field: next((header.index(name) for name in names if name in header), None)
+        for field, names in CSV_COLUMNS.items()
+    }
+    if columns['date'] is None or (columns['amount'] is None and columns['debit'] is None):
+        raise InvalidStatementException("The CSV needs a date column and an amount or debit/credit columns.")
+
+    def cell(row, field):
+        index = columns[field]
+        return row[index] if index is not None and index < len(row) else ''
+
+    for line, row in enumerate(reader, start=2):
+        if not any(row):
+            continue
+        try:
+            if columns['amount'] is not None:
+                amount = parse_amount(cell(row, 'amount'))
+            else:
+                amount = parse_amount(cell(row, 'credit')) - abs(parse_amount(cell(row, 'debit')))
+            tags = [tag.strip() for tag in re.split(r'[;|]', cell(row, 'tags')) if tag.strip()]
+            yield parse_date(cell(row, 'date'), date_format), amount, cell(row, 'name').strip(), tags
+        except ValueError as e:
+            yield InvalidStatementException(f"Line {line}: {e}")
+
+
+OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+
+def read_ofx(stream, chunk_size=64 * 1024):
+    # SGML and XML flavours, closing tags of leaves are optional
+    text = io.TextIOWrapper(stream, encoding='utf-8', errors='replace')
+    buffer, transaction_fields, count = '', None, 0
+    while True:
+        chunk = text.read(chunk_size)
+        buffer += chunk
+        # Keep an unfinished tag for the next chunk
+        cut = len(buffer) if not chunk else max(buffer.rfind('<'), 0)
+        for closing, tag, value in OFX_TAG.findall(buffer[:cut]):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if not closing:
+                    transaction_fields = {}
+                    continue
+                count += 1
+                try:
+                    fields, transaction_fields = transaction_fields or {}, None
+                    name = fields.get('NAME') or fields.get('MEMO') or fields.get('PAYEE') or ''
+                    yield parse_date(fields.get('DTPOSTED', '')[:8], '%Y%m%d'), \
+                        parse_amount(fields.get('TRNAMT')), name, []
+                except ValueError as e:
+                    yield InvalidStatementException(f"Transaction {count}: {e}")
+            elif transaction_fields is not None and not closing and value.strip():
+                transaction_fields[tag] = html.unescape(value.strip())
+        buffer = buffer[cut:]
+        if not chunk:
+            return
+
+
+READERS = dict(csv=read_csv, ofx=read_ofx)
+
+
+def statement_format(filename, default='csv'):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return {'qfx': 'ofx'}.get(extension, extension) if extension in ('csv', 'ofx', 'qfx') else default
+
+
+# Import
+# -----------------------------------------------
+def _key(kind, day, amount, name):
+    return kind, day, round(amount, 2), name
+
+
+def _existing(user, started, days):
+    # Rows that were there before the import, as a multiset, so that a
+    # statement imported twice adds nothing while repeated purchases on
+    # the same day inside one statement are all kept
+    existing = Counter()
+    days = sorted(days)
+    for i in range(0, len(days), 500):
+        batch = days[i:i + 500]
+        for model, kind in ((Income, 'income'), (Expense, 'expense')):
+            rows = model.objects.filter(user=user, date__in=batch, added_at__lt=started)
+            existing.update(_key(kind, *row) for row in rows.values_list('date', 'amount', 'name'))
+    return existing
+
+
+def _write_chunk(user, records, extra_tags, started, loaded_days, duplicates):
+    duplicates.update(_existing(user, started, {day for day, *_ in records} - loaded_days))
+    loaded_days.update(day for day, *_ in records)
+    incomes, expenses, skipped = [], [], 0
+    added_at = now()
+    for day, amount, name, row_tags in records:
+        kind = 'income' if amount > 0 else 'expense'
+        key = _key(kind, day, abs(amount), name)
+        if duplicates[key] > 0:
+            duplicates[key] -= 1
+            skipped += 1
+            continue
+        if kind == 'income':
+            incomes.append(Income(user=user, name=name, amount=amount, date=day, added_at=added_at))
+            continue
+        expense = Expense(user=user, name=name, amount=-amount, date=day, added_at=added_at)
+        expenses.append((expense, clean_tag_names(row_tags + extra_tags)))
+    with transaction.atomic():
+        Income.objects.bulk_create(incomes)
+        Expense.objects.bulk_create([expense for expense, _ in expenses])
+        # Tags of the whole chunk are resolved at once
+        tags = resolve_tags(user, clean_tag_names(name for _, names in expenses for name in names))
+        TaggedExpense.objects.bulk_create([
+            TaggedExpense(expense=expense, tag=tags[name], user=user)
+            for expense, names in expenses for name in names
+        ])
+        record_bulk(user.id, incomes, expenses)
+        stamp(Income, incomes)
+        stamp(Expense, [expense for expense, _ in expenses])
+    return len(incomes), len(expenses), skipped
+
+
+def iter_import(user, stream, fmt='csv', tags=None, date_format=None, chunk_size=1000):
+    """Import a bank statement for `user`, yielding the running report after every chunk.
+
+    The last report yielded has `done` set. Raises InvalidStatementException
+    when the file cannot be read at all.
+    """
+    if fmt not in READERS:
+        raise InvalidStatementException(f"Unknown format '{fmt}'.")
+    reader = READERS[fmt](stream, date_format) if fmt == 'csv' else READERS[fmt](stream)
+    extra_tags = clean_tag_names(tags)
+    report = dict(read=0, incomes=0, expenses=0, duplicates=0, errors=0, messages=[], done=False)
+    started = now()
+    loaded_days, duplicates = set(), Counter()
+
+    def flush(records):
+        incomes, expenses, skipped = _write_chunk(user, records, extra_tags, started, loaded_days, duplicates)
+        report['incomes'] += incomes
+        report['expenses'] += expenses
+        report['duplicates'] += skipped
+
+    records = []
+    try:
+        for record in reader:
+            if isinstance(record, InvalidStatementException):
+                report['errors'] += 1
+                if len(report['messages']) < MAX_ERRORS:
+                    report['messages'].append(str(record))
+                continue
+            day, amount, name, row_tags = record
+            if amount == 0:
+                continue
+            report['read'] += 1
+            records.append((day, amount, name[:NAME_LENGTH], [tag[:NAME_LENGTH] for tag in row_tags]))
+            if len(records) >= chunk_size:
+                flush(records)
+                records = []
+                yield report
+        if records:
+            flush(records)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise InvalidStatementException(str(e))
+    finally:
+        projection_cache.invalidate(user.id)
+    report['done'] = True
+    yield report
+
+
+def import_statement(user, stream, progress=None, **options):
+    # `progress` is called with the running report after every chunk
+    for report in iter_import(user, stream, **options):
+        if progress and not report['done']:
+            progress(report)
+    return report
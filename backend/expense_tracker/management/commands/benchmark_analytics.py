@@ -0,0 +1,131 @@
+import time
+import uuid
+import random
+from datetime import date, timedelta
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django_axor_auth.users.models import User
+from expense_tracker.models import Income, Expense, Tag, TaggedExpense
+from expense_tracker.analytics import fetch, breakdown, PERCENTILES
+
+
+def naive_fetch(user, start, end):
+    # Every row, as the list endpoints hand them to the client
+    return dict(
+        incomes=list(Income.objects.filter(user=user, date__range=(start, end)).values_list('date', 'amount')),
+        expenses=list(Expense.objects.filter(user=user, date__range=(start, end)).values_list('date', 'amount')),
+        tagged=list(TaggedExpense.objects.filter(user=user, expense__date__range=(start, end))
+                    .values_list('expense__date', 'expense__amount', 'tag__name')),
+    )
+
+
+def naive_breakdown(rows, start, end, window=7):
+    # What the client used to do, one row at a time
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    income, expense = defaultdict(float), defaultdict(float)
+    for day, amount in rows['incomes']:
+        income[day] += amount
+    for day, amount in rows['expenses']:
+        expense[day] += amount
+    weekly, monthly = {}, {}
+    for day in days:
+        for groups, key in ((weekly, day - timedelta(days=day.weekday())), (monthly, day.strftime('%Y-%m'))):
+            totals = groups.setdefault(key, [0.0, 0.0])
+            totals[0] += income[day]
+            totals[1] += expense[day]
+    rolling = []
+    for i in range(len(days)):
+        values = [expense[day] for day in days[max(0, i - window + 1):i + 1]]
+        rolling.append(sum(values) / len(values))
+    tags = {}
+    for _, amount, name in rows['tagged']:
+        totals = tags.setdefault(name, [0.0, 0])
+        totals[0] += amount
+        totals[1] += 1
+    amounts = sorted(amount for _, amount in rows['expenses'])
+    percentiles = []
+    for p in PERCENTILES:
+        position = (len(amounts) - 1) * p / 100
+        lower = int(position)
+        upper = min(lower + 1, len(amounts) - 1)
+        percentiles.append(amounts[lower] + (amounts[upper] - amounts[lower]) * (position - lower))
+    return dict(
+        daily=[expense[day] for day in days],
+        rolling_expense=rolling,
+        weekly=[totals[0] - totals[1] for totals in weekly.values()],
+        monthly=[totals[0] - totals[1] for totals in monthly.values()],
+        tags=sorted(tags.items(), key=lambda item: (-item[1][0], item[0])),
+        percentiles=percentiles,
+    )
+
+
+def close(a, b):
+    return len(a) == len(b) and all(abs(x - y) < 0.01 for x, y in zip(a, b))
+
+
+class Command(BaseCommand):
+    help = "Time the vectorized analytics breakdown against a per-row Python version on synthetic data."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=50000, help="Incomes plus expenses.")
+        parser.add_argument('--days', type=int, default=730, help="Length of the range.")
+        parser.add_argument('--tags', type=int, default=30)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--keep', action='store_true', help="Keep the synthetic data.")
+
+    def handle(self, *args, **options):
+        user = User.objects.create(email=f'benchmark-{uuid.uuid4().hex[:8]}@example.com', password='!',
+                                   first_name='Benchmark', last_name='Analytics')
+        try:
+            start, end = date(2022, 1, 1), date(2022, 1, 1) + timedelta(days=options['days'] - 1)
+            self.seed(user, start, options['days'], options['rows'], options['tags'])
+            rows = dict(vectorized=fetch(user, start, end), naive=naive_fetch(user, start, end))
+            self.stdout.write(f"{len(rows['naive']['incomes']) + len(rows['naive']['expenses'])} rows, "
+                              f"{len(rows['naive']['tagged'])} tags, {options['days']} days")
+            timings = {}
+            for name, load, compute in (('vectorized', fetch, breakdown), ('per-row', naive_fetch, naive_breakdown)):
+                loads, computes = [], []
+                for _ in range(options['repeat']):
+                    began = time.perf_counter()
+                    loaded = load(user, start, end)
+                    loads.append(time.perf_counter() - began)
+                    began = time.perf_counter()
+                    compute(loaded, start, end)
+                    computes.append(time.perf_counter() - began)
+                timings[name] = min(loads) + min(computes)
+                self.stdout.write(f"{name:>10}: fetch {min(loads) * 1000:8.1f} ms  compute {min(computes) * 1000:8.1f} ms"
+                                  f"  (best of {options['repeat']})")
+            self.stdout.write(f"speedup: {timings['per-row'] / timings['vectorized']:.1f}x")
+            self.check_same(breakdown(rows['vectorized'], start, end), naive_breakdown(rows['naive'], start, end))
+        finally:
+            if not options['keep']:
+                user.delete()
+
+    def seed(self, user, start, days, count, tag_count, batch_size=5000):
+        tags = Tag.objects.bulk_create([Tag(user=user, name=f'tag-{i}') for i in range(tag_count)])
+        incomes = [Income(user=user, name='Income', amount=random.randint(100, 500000) / 100,
+                          date=start + timedelta(days=random.randrange(days))) for _ in range(count // 5)]
+        expenses = [Expense(user=user, name='Expense', amount=random.randint(100, 50000) / 100,
+                            date=start + timedelta(days=random.randrange(days))) for _ in range(count - len(incomes))]
+        Income.objects.bulk_create(incomes, batch_size=batch_size)
+        Expense.objects.bulk_create(expenses, batch_size=batch_size)
+        TaggedExpense.objects.bulk_create([
+            TaggedExpense(user=user, expense=expense, tag=tag)
+            for expense in expenses for tag in random.sample(tags, random.randint(0, 2))
+        ], batch_size=batch_size)
+
+    def check_same(self, vectorized, naive):
+        checks = dict(
+            daily=close(vectorized['daily']['expense'], naive['daily']),
+            rolling=close(vectorized['daily']['rolling_expense'], naive['rolling_expense']),
+            weekly=close(vectorized['weekly']['net'], naive['weekly']),
+            monthly=close(vectorized['monthly']['net'], naive['monthly']),
+            tags=vectorized['tags']['name'] == [name for name, _ in naive['tags']]
+            and close(vectorized['tags']['total'], [totals[0] for _, totals in naive['tags']]),
+            percentiles=close(list(vectorized['expense_percentiles'].values()), naive['percentiles']),
+        )
+        failed = [name for name, ok in checks.items() if not ok]
+        if failed:
+            self.stderr.write(f"Results differ: {', '.join(failed)}")
+        else:
+            self.stdout.write(self.style.SUCCESS("Results match"))
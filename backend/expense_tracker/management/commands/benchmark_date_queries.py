@@ -0,0 +1,144 @@
+import time
+import uuid
+import random
+import shutil
+import tempfile
+from datetime import date, timedelta
+import jwt
+from django.conf import settings
+from django.db import connection
+from django.test import Client, RequestFactory
+from django.core.management.base import BaseCommand
+from django_axor_auth.users.models import User
+from django_axor_auth.users.users_app_tokens.models import AppToken
+from core.middleware import writer
+from expense_tracker.models import Income, Expense
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ("Seed a synthetic dataset and time get_incomes/get_expenses with and without the "
+            "(user, date) indexes, with their query plans. Runs on a temporary database created "
+            "like a test database next to the configured one, point DB_* at a Postgres server to "
+            "benchmark Postgres.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--rows', type=int, default=1000, help="Incomes plus expenses per user.")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint and run.")
+        parser.add_argument('--sample-users', type=int, default=20, help="Users the requests are spread over.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Database: {connection.vendor}")
+        # Indexes are dropped on the way, never on the configured database
+        directory = tempfile.mkdtemp(prefix='benchmark_dates_')
+        test_settings = connection.settings_dict['TEST']
+        old_test_name = test_settings['NAME']
+        test_settings['NAME'] = f'{directory}/benchmark.sqlite3' if connection.vendor == 'sqlite' \
+            else f'benchmark_{uuid.uuid4().hex[:8]}'
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.benchmark(options)
+        finally:
+            # The API log of the requests goes to the temporary database too
+            writer.stop()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings['NAME'] = old_test_name
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def benchmark(self, options):
+        prefix = f"benchmark-{uuid.uuid4().hex[:8]}"
+        started = time.perf_counter()
+        users = self.seed(prefix, options['users'], options['rows'])
+        self.stdout.write(f"Seeded {options['users'] * options['rows']} rows in {time.perf_counter() - started:.1f}s")
+        indexes = [(model, index) for model in (Income, Expense) for index in model._meta.indexes
+                   if index.fields == ['user', 'date']]
+        clients = [self.client_for(user) for user in random.sample(users, min(len(users), options['sample_users']))]
+        self.set_indexes(indexes, add=False)
+        self.analyze()
+        self.run('without (user, date) indexes', clients, options['requests'])
+        self.set_indexes(indexes, add=True)
+        self.analyze()
+        self.run('with (user, date) indexes', clients, options['requests'])
+
+    def seed(self, prefix, count, rows, batch_size=5000):
+        users = [User(email=f'{prefix}-{i}@example.com', password='!', first_name='Benchmark', last_name=str(i))
+                 for i in range(count)]
+        User.objects.bulk_create(users, batch_size=batch_size)
+        first, days = date(2020, 1, 1), 5 * 365
+        batch = []
+
+        def flush(model):
+            model.objects.bulk_create(batch, batch_size=batch_size)
+            batch.clear()
+
+        for model in (Income, Expense):
+            for user in users:
+                for i in range(rows // 2):
+                    batch.append(model(user=user, name=f'Row {i}', amount=random.randint(100, 100000) / 100,
+                                       date=first + timedelta(days=random.randrange(days))))
+                    if len(batch) >= batch_size:
+                        flush(model)
+            flush(model)
+        return users
+
+    def client_for(self, user):
+        request = RequestFactory().get('/', HTTP_USER_AGENT='benchmark', REMOTE_ADDR='127.0.0.1')
+        key, _ = AppToken.objects.create_app_token(user, request)
+        return user, Client(headers={
+            'X-Requested-By': 'mobile',
+            'Authorization': 'Bearer ' + jwt.encode({'app_token': key}, settings.SECRET_KEY, algorithm='HS256'),
+            'User-Agent': 'benchmark',
+        })
+
+    def set_indexes(self, indexes, add):
+        with connection.schema_editor() as editor:
+            for model, index in indexes:
+                (editor.add_index if add else editor.remove_index)(model, index)
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def run(self, name, clients, requests):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{name}"))
+        user = clients[0][0]
+        for model in (Income, Expense):
+            plan = model.objects.filter(user=user, date__range=(date(2021, 1, 1), date(2021, 3, 31))).order_by('-date')
+            self.stdout.write(f"{model.__name__} plan:\n{plan.explain()}")
+        # The query alone, then the whole view
+        for model in (Income, Expense):
+            latencies = []
+            for i in range(requests):
+                start = self.random_start()
+                began = time.perf_counter()
+                list(model.objects.filter(user=clients[i % len(clients)][0],
+                                          date__range=(start, start + timedelta(days=90))).order_by('-date'))
+                latencies.append(time.perf_counter() - began)
+            self.report(f"{model.__name__} query", latencies)
+        for endpoint in ('get_incomes', 'get_expenses'):
+            latencies = []
+            for i in range(requests):
+                _, client = clients[i % len(clients)]
+                start = self.random_start()
+                path = f'/api/expense_tracker/{endpoint}/{start}/{start + timedelta(days=90)}/'
+                began = time.perf_counter()
+                response = client.get(path)
+                latencies.append(time.perf_counter() - began)
+                if response.status_code != 200:
+                    self.stderr.write(f"{path} returned {response.status_code}")
+            self.report(endpoint, latencies)
+
+    def random_start(self):
+        return date(2020, 1, 1) + timedelta(days=random.randrange(4 * 365))
+
+    def report(self, name, latencies):
+        self.stdout.write(
+            f"{name:>14}: p50 {percentile(latencies, 0.50) * 1000:7.2f} ms  "
+            f"p95 {percentile(latencies, 0.95) * 1000:7.2f} ms  "
+            f"p99 {percentile(latencies, 0.99) * 1000:7.2f} ms"
+        )
@@ -0,0 +1,75 @@
+import time
+import uuid
+import random
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from django_axor_auth.users.models import User
+from core.renderers import ORJSONRenderer
+from expense_tracker.models import Income, Expense, Tag, TaggedExpense
+from expense_tracker.serializers import IncomeSerializer, ExpenseSerializer, INCOME_ROWS, expense_rows
+
+
+class Command(BaseCommand):
+    help = ("Time get_incomes/get_expenses responses built with serializers and JSONRenderer against "
+            "the .values() row mappers and the orjson renderer, and check both give the same bytes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help="Rows per list.")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        user = User.objects.create(email=f'benchmark-{uuid.uuid4().hex[:8]}@example.com', password='!',
+                                   first_name='Benchmark', last_name='Rendering')
+        try:
+            self.seed(user, options['rows'])
+            incomes = Income.objects.filter(user=user).order_by('-date')
+            expenses = Expense.objects.filter(user=user).order_by('-date')
+            paths = dict(
+                get_incomes=(
+                    lambda: JSONRenderer().render(IncomeSerializer(incomes.all(), many=True).data),
+                    lambda: ORJSONRenderer().render(INCOME_ROWS(incomes.values(*INCOME_ROWS.sources))),
+                ),
+                get_expenses=(
+                    lambda: JSONRenderer().render(
+                        ExpenseSerializer(expenses.prefetch_related('tags__tag'), many=True).data),
+                    lambda: ORJSONRenderer().render(expense_rows(expenses.all())),
+                ),
+            )
+            for endpoint, (serialized, mapped) in paths.items():
+                self.stdout.write(self.style.MIGRATE_HEADING(f"\n{endpoint}, {options['rows']} rows"))
+                best = {}
+                for name, render in (('serializers', serialized), ('row mappers', mapped)):
+                    timings = []
+                    for _ in range(options['repeat']):
+                        began = time.perf_counter()
+                        body = render()
+                        timings.append(time.perf_counter() - began)
+                    best[name] = (min(timings), body)
+                    self.stdout.write(f"{name:>12}: {min(timings) * 1000:8.1f} ms  {len(body)} bytes")
+                self.stdout.write(f"speedup: {best['serializers'][0] / best['row mappers'][0]:.1f}x")
+                if best['serializers'][1] == best['row mappers'][1]:
+                    self.stdout.write(self.style.SUCCESS("Same output"))
+                else:
+                    self.stderr.write("Output differs")
+        finally:
+            user.delete()
+
+    def seed(self, user, count):
+        first = date(2022, 1, 1)
+        tags = Tag.objects.bulk_create([Tag(user=user, name=f'tag-{i}') for i in range(20)])
+        Income.objects.bulk_create([
+            Income(user=user, name=f'Income {i}', amount=random.randint(100, 500000) / 100,
+                   date=first + timedelta(days=random.randrange(730)))
+            for i in range(count)
+        ])
+        expenses = Expense.objects.bulk_create([
+            Expense(user=user, name=f'Expense {i}', amount=random.randint(100, 50000) / 100,
+                    date=first + timedelta(days=random.randrange(730)), repeat=i % 10 == 0,
+                    repeat_interval=random.choice(('daily', 'weekly', 'monthly', 'yearly')))
+            for i in range(count)
+        ])
+        TaggedExpense.objects.bulk_create([
+            TaggedExpense(user=user, expense=expense, tag=tag)
+            for expense in expenses for tag in random.sample(tags, random.randint(0, 3))
+        ])
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django_axor_auth.users.models import User
+from expense_tracker.importer import import_statement, statement_format, InvalidStatementException
+
+
+class Command(BaseCommand):
+    help = "Import a bank statement (CSV or OFX) as incomes and expenses of a user."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Statement file.")
+        parser.add_argument('--user', required=True, help="Id of the user to import for.")
+        parser.add_argument('--format', choices=['csv', 'ofx'], help="Defaults to the file extension.")
+        parser.add_argument('--tags', default='', help="Comma separated tags added to every expense.")
+        parser.add_argument('--date-format', help="strptime format of CSV dates, detected by default.")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(id=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist.")
+
+        def progress(report):
+            self.stdout.write(
+                f"{report['read']} read, {report['incomes']} incomes, {report['expenses']} expenses, "
+                f"{report['duplicates']} duplicates, {report['errors']} errors"
+            )
+
+        with open(options['path'], 'rb') as stream:
+            try:
+                report = import_statement(
+                    user, stream,
+                    fmt=options['format'] or statement_format(options['path']),
+                    tags=[tag.strip() for tag in options['tags'].split(',')],
+                    date_format=options['date_format'],
+                    chunk_size=options['chunk_size'],
+                    progress=progress,
+                )
+            except InvalidStatementException as e:
+                raise CommandError(str(e))
+        for message in report['messages']:
+            self.stderr.write(message)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report['incomes']} income(s) and {report['expenses']} expense(s), "
+            f"skipped {report['duplicates']} duplicate(s) and {report['errors']} invalid row(s)."
+        ))
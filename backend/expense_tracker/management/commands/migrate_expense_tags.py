@@ -0,0 +1,45 @@
+from collections import defaultdict
+from django.db import transaction
+from django.utils.timezone import now
+from django.core.management.base import BaseCommand
+from expense_tracker.models import Expense, ExpenseTags, TaggedExpense
+from expense_tracker.tags import clean_tag_names, resolve_tags
+from expense_tracker.rollups import rebuild_user
+
+
+class Command(BaseCommand):
+    help = ("Move the per-expense tag rows of the old schema into the tag dictionary "
+            "and the expense to tag join table. Safe to run again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        moved, users = 0, set()
+        while True:
+            with transaction.atomic():
+                rows = list(ExpenseTags.objects.select_for_update().order_by('id')[:options['batch_size']])
+                if not rows:
+                    break
+                by_user = defaultdict(list)
+                for row in rows:
+                    by_user[row.user_id].append(row)
+                links = []
+                for user_id, user_rows in by_user.items():
+                    tags = resolve_tags(user_rows[0].user, clean_tag_names(row.name for row in user_rows))
+                    links.extend(
+                        TaggedExpense(expense_id=row.expense_id_id, tag=tags[row.name], user_id=user_id)
+                        for row in user_rows if row.name
+                    )
+                # The old schema allowed the same name twice on an expense
+                TaggedExpense.objects.bulk_create(links, ignore_conflicts=True)
+                # Tags of these expenses changed, for the change feed
+                Expense.objects.filter(id__in={row.expense_id_id for row in rows}).update(updated_at=now())
+                ExpenseTags.objects.filter(id__in=[row.id for row in rows]).delete()
+            moved += len(rows)
+            users.update(by_user)
+            self.stdout.write(f"{moved} tag row(s) moved")
+        # Tag rollups counted the duplicates that were dropped
+        for user_id in users:
+            rebuild_user(user_id)
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} tag row(s) of {len(users)} user(s)."))
@@ -0,0 +1,15 @@
+from datetime import timedelta
+from django.utils.timezone import now
+from django.core.management.base import BaseCommand
+from expense_tracker.models import Tombstone
+from expense_tracker.utils import get_setting
+
+
+class Command(BaseCommand):
+    help = ("Delete tombstones older than TOMBSTONE_RETENTION_DAYS. Change feed cursors "
+            "older than that are answered with 410 and clients download everything again.")
+
+    def handle(self, *args, **options):
+        days = get_setting('TOMBSTONE_RETENTION_DAYS', 90)
+        deleted, _ = Tombstone.objects.filter(deleted_at__lt=now() - timedelta(days=days)).delete()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} tombstone(s) older than {days} days."))
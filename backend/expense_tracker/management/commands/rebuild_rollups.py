@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from expense_tracker.models import Income, Expense, MonthlyRollup
+from expense_tracker.rollups import rebuild_user
+
+
+class Command(BaseCommand):
+    help = "Rebuild the monthly income and expense rollups from the rows, for backfill or repair."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only rebuild the rollups of the user with this id.")
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user_ids = [options['user']]
+        else:
+            user_ids = set(Income.objects.values_list('user_id', flat=True).distinct())
+            user_ids |= set(Expense.objects.values_list('user_id', flat=True).distinct())
+            # Users whose rows are all gone still have rollups to clear
+            user_ids |= set(MonthlyRollup.objects.values_list('user_id', flat=True).distinct())
+        rows = 0
+        for user_id in user_ids:
+            rows += rebuild_user(user_id)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} rollup(s) for {len(user_ids)} user(s)."))
@@ -10,8 +10,17 @@ class Income(models.Model):
     amount = models.FloatField()
     date = models.DateField()
     added_at = models.DateTimeField(default=now)
+    updated_at = models.DateTimeField(auto_now=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # Date range queries of a user, ordered by date
+            models.Index(fields=['user', 'date']),
+            # Change feed of a user, ordered by modification
+            models.Index(fields=['user', 'updated_at', 'id']),
+        ]
+
 
 class Expense(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -27,12 +36,88 @@ class Expense(models.Model):
     date = models.DateField()
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     added_at = models.DateTimeField(default=now)
+    # Also bumped when only the tags change
+    updated_at = models.DateTimeField(auto_now=True)
     repeat = models.BooleanField(default=False)
     repeat_interval = models.CharField(max_length=255, choices=repeat_choices, default='monthly')
 
+    class Meta:
+        indexes = [
+            # Date range queries of a user, ordered by date
+            models.Index(fields=['user', 'date']),
+            # Change feed of a user, ordered by modification
+            models.Index(fields=['user', 'updated_at', 'id']),
+        ]
+
+
+class Tag(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=255)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='unique_user_tag'),
+        ]
+
+
+class TaggedExpense(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='tags')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='expenses')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['expense', 'tag'], name='unique_expense_tag'),
+        ]
+
 
+# Tag names used to be stored per expense. Rows left here are moved into
+# Tag and TaggedExpense by `manage.py migrate_expense_tags`.
 class ExpenseTags(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
-    expense_id = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='tags')
+    expense_id = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='legacy_tags')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+
+class MonthlyRollup(models.Model):
+    kind_choices = [
+        ('income', 'Income'),
+        ('expense', 'Expense'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=7, choices=kind_choices)
+    # First day of the month
+    month = models.DateField()
+    # Empty for the totals of all rows of the month, else a tag name
+    tag = models.CharField(max_length=255, default='', blank=True)
+    total = models.FloatField(default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'kind', 'month', 'tag'], name='unique_monthly_rollup'),
+        ]
+
+
+# Deleted incomes and expenses, so the change feed can report them. Purged
+# after TOMBSTONE_RETENTION_DAYS by `manage.py purge_tombstones`.
+class Tombstone(models.Model):
+    kind_choices = [
+        ('income', 'Income'),
+        ('expense', 'Expense'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=7, choices=kind_choices)
+    record_id = models.UUIDField()
+    deleted_at = models.DateTimeField(default=now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at', 'id']),
+        ]
@@ -0,0 +1,168 @@
+import time
+import calendar
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from .models import Expense
+from .serializers import ExpenseSerializer
+from .utils import get_setting
+
+# Occurrence k of a recurring expense first dated d0 falls on d0 + k steps.
+# The window bounds give the first and last k in closed form, so totals never
+# look at single occurrences and listings only build the dates they return.
+# Monthly and yearly steps keep the original day of month, clamped to the
+# length of each month (Jan 31 -> Feb 28 -> Mar 31).
+STEP_DAYS = {'daily': 1, 'weekly': 7}
+STEP_MONTHS = {'monthly': 1, 'yearly': 12}
+
+
+class ProjectionTooLargeException(Exception):
+    pass
+
+
+def _month_index(day):
+    return day.year * 12 + day.month - 1
+
+
+def _month_date(index, day):
+    year, month = divmod(index, 12)
+    return date(year, month + 1, min(day, calendar.monthrange(year, month + 1)[1]))
+
+
+def occurrence_bounds(first, interval, start, end):
+    """First and last k >= 1 with occurrence k inside [start, end], empty when last < first."""
+    if interval in STEP_DAYS:
+        step = STEP_DAYS[interval]
+        return max(1, -((first - start).days // step)), (end - first).days // step
+    step = STEP_MONTHS[interval]
+    base = _month_index(first)
+    low = max(1, -((base - _month_index(start)) // step))
+    if _month_date(base + low * step, first.day) < start:
+        low += 1
+    high = (_month_index(end) - base) // step
+    if high >= low and _month_date(base + high * step, first.day) > end:
+        high -= 1
+    return low, high
+
+
+def occurrence_dates(first, interval, low, high):
+    if interval in STEP_DAYS:
+        step, ordinal = STEP_DAYS[interval], first.toordinal()
+        return [date.fromordinal(ordinal + k * step) for k in range(low, high + 1)]
+    step, base = STEP_MONTHS[interval], _month_index(first)
+    return [_month_date(base + k * step, first.day) for k in range(low, high + 1)]
+
+
+class ProjectionCache:
+    """Recurring expenses of a user plus the windows expanded from them.
+
+    Bounded LRU over users, each keeping a few windows. Writes in this
+    process invalidate the user, the TTL bounds staleness across processes.
+    """
+
+    def __init__(self, max_users, max_windows, ttl):
+        self.max_users = max_users
+        self.max_windows = max_windows
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is not None and entry['expires'] < time.monotonic():
+            del self._entries[user_id]
+            entry = None
+        return entry
+
+    def schedule(self, user):
+        with self._lock:
+            entry = self._entry(user.id)
+            if entry is not None:
+                self._entries.move_to_end(user.id)
+                return entry['schedule']
+        rows = Expense.objects.prefetch_related('tags__tag').filter(user=user, repeat=True).order_by('date')
+        schedule = [(row.date, row.repeat_interval, row.amount, data)
+                    for row, data in zip(rows, ExpenseSerializer(rows, many=True).data)]
+        with self._lock:
+            self._entries[user.id] = dict(expires=time.monotonic() + self.ttl, schedule=schedule,
+                                          windows=OrderedDict())
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return schedule
+
+    def get(self, user_id, key):
+        with self._lock:
+            entry = self._entry(user_id)
+            if entry is None or key not in entry['windows']:
+                return None
+            entry['windows'].move_to_end(key)
+            return entry['windows'][key]
+
+    def set(self, user_id, key, value):
+        with self._lock:
+            entry = self._entry(user_id)
+            if entry is None:
+                return
+            entry['windows'][key] = value
+            while len(entry['windows']) > self.max_windows:
+                entry['windows'].popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+projection_cache = ProjectionCache(
+    max_users=get_setting('PROJECTION_CACHE_USERS', 1000),
+    max_windows=get_setting('PROJECTION_CACHE_WINDOWS', 16),
+    ttl=get_setting('PROJECTION_CACHE_TTL', 60),
+)
+
+
+def _bounds(user, start, end):
+    # Occurrences after the stored row, which itself is an actual
+    return [
+        (first, interval, amount, data, *occurrence_bounds(first, interval, start, end))
+        for first, interval, amount, data in projection_cache.schedule(user) if first < end
+    ]
+
+
+def projected_totals(user, start, end):
+    key = ('totals', start, end)
+    totals = projection_cache.get(user.id, key)
+    if totals is None:
+        items = []
+        for first, interval, amount, data, low, high in _bounds(user, start, end):
+            if high >= low:
+                count = high - low + 1
+                items.append(dict(id=data['id'], name=data['name'], amount=amount,
+                                  repeat_interval=interval, count=count, total=amount * count))
+        totals = dict(
+            total=sum(item['total'] for item in items),
+            count=sum(item['count'] for item in items),
+            items=items,
+        )
+        projection_cache.set(user.id, key, totals)
+    return totals
+
+
+def projected_occurrences(user, start, end):
+    key = ('occurrences', start, end)
+    occurrences = projection_cache.get(user.id, key)
+    if occurrences is None:
+        bounds = [row for row in _bounds(user, start, end) if row[5] >= row[4]]
+        if sum(high - low + 1 for *_, low, high in bounds) > get_setting('PROJECTION_MAX_OCCURRENCES', 20000):
+            raise ProjectionTooLargeException
+        occurrences = [
+            {**data, 'date': day.isoformat(), 'projected': True}
+            for first, interval, amount, data, low, high in bounds
+            for day in occurrence_dates(first, interval, low, high)
+        ]
+        occurrences.sort(key=lambda occurrence: occurrence['date'], reverse=True)
+        projection_cache.set(user.id, key, occurrences)
+    return occurrences
@@ -0,0 +1,155 @@
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F, Sum, Count
+from django.db.models.functions import TruncMonth
+
+from .models import Income, Expense, TaggedExpense, MonthlyRollup
+
+# Monthly totals per user. For each kind and month there is one row with an
+# empty tag holding the totals of all rows, and for expenses one row per tag
+# name holding the totals of the expenses carrying that tag.
+
+
+def month_of(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+# Incremental updates
+# -----------------------------------------------
+# Called inside the transaction that changes the rows, sign=-1 removes
+def _apply_deltas(user_id, deltas):
+    # deltas maps (kind, month, tag) to [total, count]
+    for (kind, month, tag), (total, count) in deltas.items():
+        lookup = dict(user_id=user_id, kind=kind, month=month, tag=tag)
+        updated = MonthlyRollup.objects.filter(**lookup).update(
+            total=F('total') + total, count=F('count') + count
+        )
+        if updated == 0:
+            row, created = MonthlyRollup.objects.get_or_create(
+                **lookup, defaults=dict(total=total, count=count)
+            )
+            if not created:
+                MonthlyRollup.objects.filter(id=row.id).update(
+                    total=F('total') + total, count=F('count') + count
+                )
+        if count < 0:
+            MonthlyRollup.objects.filter(**lookup, count__lte=0).delete()
+
+
+def _add_delta(deltas, kind, day, amount, tags, sign):
+    month = month_of(day)
+    for tag in [''] + list(tags):
+        delta = deltas.setdefault((kind, month, tag), [0, 0])
+        delta[0] += amount * sign
+        delta[1] += sign
+
+
+def record_income(income, sign=1):
+    deltas = {}
+    _add_delta(deltas, 'income', income.date, income.amount, [], sign)
+    _apply_deltas(income.user_id, deltas)
+
+
+def record_expense(expense, tags, sign=1):
+    deltas = {}
+    _add_delta(deltas, 'expense', expense.date, expense.amount, tags, sign)
+    _apply_deltas(expense.user_id, deltas)
+
+
+def record_expense_tag(expense, tag, sign=1):
+    # Only the row of the tag, the month's totals already count the expense
+    _apply_deltas(expense.user_id, {('expense', month_of(expense.date), tag): [expense.amount * sign, sign]})
+
+
+def record_bulk(user_id, incomes, expenses):
+    # One update per touched rollup row, expenses are (expense, tag names)
+    deltas = {}
+    for income in incomes:
+        _add_delta(deltas, 'income', income.date, income.amount, [], 1)
+    for expense, tags in expenses:
+        _add_delta(deltas, 'expense', expense.date, expense.amount, tags, 1)
+    _apply_deltas(user_id, deltas)
+
+
+def expense_tag_names(expense):
+    return list(TaggedExpense.objects.filter(expense=expense).values_list('tag__name', flat=True))
+
+
+# Rebuild
+# -----------------------------------------------
+def _totals(queryset, date_field, amount_field, tag_field=None):
+    group = ['month'] + ([tag_field] if tag_field else [])
+    return queryset.annotate(month=TruncMonth(date_field)).values(*group).annotate(
+        total=Sum(amount_field), count=Count('id')
+    ).order_by()
+
+
+def rebuild_user(user_id):
+    rows = []
+    for row in _totals(Income.objects.filter(user_id=user_id), 'date', 'amount'):
+        rows.append(MonthlyRollup(user_id=user_id, kind='income', month=row['month'],
+                                  total=row['total'], count=row['count']))
+    for row in _totals(Expense.objects.filter(user_id=user_id), 'date', 'amount'):
+        rows.append(MonthlyRollup(user_id=user_id, kind='expense', month=row['month'],
+                                  total=row['total'], count=row['count']))
+    tags = TaggedExpense.objects.filter(expense__user_id=user_id)
+    for row in _totals(tags, 'expense__date', 'expense__amount', 'tag__name'):
+        rows.append(MonthlyRollup(user_id=user_id, kind='expense', month=row['month'], tag=row['tag__name'],
+                                  total=row['total'], count=row['count']))
+    with transaction.atomic():
+        MonthlyRollup.objects.filter(user_id=user_id).delete()
+        MonthlyRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+# Range totals
+# -----------------------------------------------
+def _add(months, tags, kind, month, tag, total, count):
+    if tag:
+        entry = tags.setdefault(tag, dict(name=tag, total=0, count=0))
+        entry['total'] += total
+        entry['count'] += count
+    else:
+        months.setdefault(month, dict(month=month.strftime('%Y-%m'), income=0, expense=0))[kind] += total
+
+
+def _add_rows(months, tags, user, kind, start, end):
+    # Straight from the rows, for months the range only partly covers
+    model = Income if kind == 'income' else Expense
+    for row in _totals(model.objects.filter(user=user, date__range=(start, end)), 'date', 'amount'):
+        _add(months, tags, kind, row['month'], '', row['total'], row['count'])
+    if kind == 'expense':
+        rows = TaggedExpense.objects.filter(expense__user=user, expense__date__range=(start, end))
+        for row in _totals(rows, 'expense__date', 'expense__amount', 'tag__name'):
+            _add(months, tags, kind, row['month'], row['tag__name'], row['total'], row['count'])
+
+
+def summarize(user, date_start, date_end):
+    months, tags = {}, {}
+    # Whole months come from the rollups, the partial months at the edges from the rows
+    first = date_start if date_start.day == 1 else next_month(date_start)
+    last = month_of(date_end + timedelta(days=1)) - timedelta(days=1)
+    if first <= last:
+        rollups = MonthlyRollup.objects.filter(user=user, month__range=(first, month_of(last)))
+        for row in rollups.values_list('kind', 'month', 'tag', 'total', 'count'):
+            _add(months, tags, *row)
+        edges = [(date_start, first - timedelta(days=1)), (last + timedelta(days=1), date_end)]
+    else:
+        edges = [(date_start, date_end)]
+    for start, end in edges:
+        if start <= end:
+            for kind in ('income', 'expense'):
+                _add_rows(months, tags, user, kind, start, end)
+    income = sum(month['income'] for month in months.values())
+    expense = sum(month['expense'] for month in months.values())
+    return dict(
+        income=income,
+        expense=expense,
+        balance=income - expense,
+        months=[months[month] for month in sorted(months)],
+        tags=sorted(tags.values(), key=lambda tag: -tag['total']),
+    )
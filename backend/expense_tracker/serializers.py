@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Income, Expense, ExpenseTags
+from core.rows import RowMapper
+from .models import Income, Expense, Tag, TaggedExpense
 
 
 class IncomeSerializer(serializers.ModelSerializer):
@@ -9,9 +10,13 @@ class IncomeSerializer(serializers.ModelSerializer):
 
 
 class ExpenseTagsSerializer(serializers.ModelSerializer):
+    # Same shape as the per-expense tag rows had
+    name = serializers.CharField(source='tag.name', read_only=True)
+    expense_id = serializers.UUIDField(read_only=True)
+
     class Meta:
-        model = ExpenseTags
-        fields = '__all__'
+        model = TaggedExpense
+        fields = ['id', 'name', 'expense_id', 'user']
 
 
 class ExpenseSerializer(serializers.ModelSerializer):
@@ -19,4 +24,40 @@ class ExpenseSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Expense
-        fields = ['id', 'name', 'amount', 'date', 'repeat', 'repeat_interval', 'added_at', 'tags', 'user']
+        fields = ['id', 'name', 'amount', 'date', 'repeat', 'repeat_interval', 'added_at', 'updated_at', 'tags',
+                  'user']
+
+
+# Same output as the serializers above, from .values() rows
+# -----------------------------------------------
+INCOME_ROWS = RowMapper(IncomeSerializer)
+EXPENSE_ROWS = RowMapper(ExpenseSerializer)
+EXPENSE_TAG_ROWS = RowMapper(ExpenseTagsSerializer)
+# The queries prefetch_related('tags__tag') would run, so tags keep their order
+TAG_LINK_FIELDS = ['id', 'tag_id', 'expense_id', 'user']
+
+
+def _expense_rows(rows, links, names):
+    for link in links:
+        link['tag__name'] = names[link['tag_id']]
+    tags = {}
+    for link, item in zip(links, EXPENSE_TAG_ROWS(links)):
+        tags.setdefault(link['expense_id'], []).append(item)
+    return EXPENSE_ROWS(rows, tags=tags)
+
+
+def expense_rows(expenses):
+    """ExpenseSerializer(expenses, many=True).data, without the serializers."""
+    rows = list(expenses.values(*EXPENSE_ROWS.sources))
+    links = list(TaggedExpense.objects.filter(expense_id__in=[row['id'] for row in rows]).values(*TAG_LINK_FIELDS))
+    names = dict(Tag.objects.filter(id__in={link['tag_id'] for link in links}).values_list('id', 'name'))
+    return _expense_rows(rows, links, names)
+
+
+async def aexpense_rows(expenses):
+    rows = [row async for row in expenses.values(*EXPENSE_ROWS.sources)]
+    links = [link async for link in TaggedExpense.objects.filter(
+        expense_id__in=[row['id'] for row in rows]).values(*TAG_LINK_FIELDS)]
+    names = {tag_id: name async for tag_id, name in Tag.objects.filter(
+        id__in={link['tag_id'] for link in links}).values_list('id', 'name')}
+    return _expense_rows(rows, links, names)
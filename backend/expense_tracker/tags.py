@@ -0,0 +1,67 @@
+from django.db import transaction, IntegrityError
+from django.db.models import Count
+
+from .models import Tag, TaggedExpense
+
+
+def clean_tag_names(tags):
+    # Valid names in first-seen order, without repeats
+    return list(dict.fromkeys(tag for tag in tags or [] if isinstance(tag, str) and len(tag) > 0))
+
+
+def resolve_tags(user, names):
+    """Map tag names to the user's Tag rows, creating the missing ones.
+
+    One IN query plus one bulk_create. If another request creates one of
+    the same tags meanwhile, the unique constraint fails and the lookup is
+    repeated once.
+    """
+    if not names:
+        return {}
+    for attempt in range(2):
+        tags = {tag.name: tag for tag in Tag.objects.filter(user=user, name__in=names)}
+        missing = [Tag(user=user, name=name) for name in names if name not in tags]
+        if not missing:
+            return tags
+        try:
+            with transaction.atomic():
+                Tag.objects.bulk_create(missing)
+        except IntegrityError:
+            if attempt == 0:
+                continue
+            raise
+        tags.update((tag.name, tag) for tag in missing)
+        return tags
+
+
+def tag_expense(user, expense, names):
+    # Tags of a new expense
+    tags = resolve_tags(user, names)
+    return TaggedExpense.objects.bulk_create([
+        TaggedExpense(expense=expense, tag=tags[name], user=user) for name in names
+    ])
+
+
+def retag_expense(user, expense, names):
+    """Make `names` the tags of an existing expense, returns its tag rows in that order."""
+    tags = resolve_tags(user, names)
+    current = {row.tag_id: row for row in TaggedExpense.objects.select_related('tag').filter(expense=expense)}
+    wanted = {tags[name].id for name in names}
+    removed = [row.id for tag_id, row in current.items() if tag_id not in wanted]
+    if removed:
+        TaggedExpense.objects.filter(id__in=removed).delete()
+    added = TaggedExpense.objects.bulk_create([
+        TaggedExpense(expense=expense, tag=tags[name], user=user)
+        for name in names if tags[name].id not in current
+    ])
+    rows = {row.tag_id: row for row in added}
+    rows.update((tag_id, row) for tag_id, row in current.items() if tag_id in wanted)
+    return [rows[tags[name].id] for name in names]
+
+
+def tag_usage(user):
+    # The user's tags with how many expenses carry each, one grouped query
+    return list(
+        Tag.objects.filter(user=user).annotate(count=Count('expenses')).order_by('-count', 'name')
+        .values('id', 'name', 'count')
+    )
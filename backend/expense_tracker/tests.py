@@ -1,3 +1,251 @@
-from django.test import TestCase
+import uuid
+import base64
+import random
+from unittest import mock
+from datetime import date, datetime, timedelta
+import pytz
+from django.test import SimpleTestCase, TestCase, RequestFactory
+from django.utils.timezone import now
+from django_axor_auth.users.models import User
+from django_axor_auth.users.users_app_tokens.models import AppToken
 
-# Create your tests here.
+from .batch import add_batch
+from .changes import changes, stamp, encode_cursor, decode_cursor, InvalidCursorException, CursorExpiredException
+from .models import Income, Expense, MonthlyRollup, Tombstone
+from .recurrence import occurrence_bounds, occurrence_dates, projection_cache
+from .rollups import record_income, record_expense, expense_tag_names, rebuild_user, summarize
+from .views import add_expense_tag, add_expenses
+
+
+def create_user(email='user@example.com'):
+    return User.objects.create_user(email=email, password='Pass1234!x', first_name='Test', last_name='User')
+
+
+def post(view, user, data):
+    # Calls the view as the holder of an app token of `user`
+    request = RequestFactory().post('/', data, content_type='application/json',
+                                    headers={'X-Requested-By': 'mobile', 'User-Agent': 'tests'})
+    request.active_token = AppToken.objects.create_app_token(user, request)[1]
+    request.active_session, request.requested_by = None, 'mobile'
+    return view(request)
+
+
+def rollups(user):
+    return sorted(
+        (kind, month, tag, round(total, 2), count)
+        for kind, month, tag, total, count in
+        MonthlyRollup.objects.filter(user=user).values_list('kind', 'month', 'tag', 'total', 'count')
+    )
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        add_batch(self.user, 'incomes', [
+            dict(name='Salary', amount=3000, date='2024-01-31'),
+            dict(name='Salary', amount=3000, date='2024-02-29'),
+            dict(name='Refund', amount=12.5, date='2024-02-03'),
+        ])
+        add_batch(self.user, 'expenses', [
+            dict(name='Rent', amount=1200, date='2024-01-01', repeat_interval='monthly', tags=['home']),
+            dict(name='Lunch', amount=9.9, date='2024-01-15', repeat_interval='monthly', tags=['food', 'work']),
+            dict(name='Dinner', amount=24.1, date='2024-02-15', repeat_interval='monthly', tags=['food']),
+            dict(name='Bus', amount=2.5, date='2024-02-16', repeat_interval='monthly'),
+        ])
+
+    def test_record_bulk_matches_rebuild(self):
+        recorded = rollups(self.user)
+        rebuild_user(self.user.id)
+        self.assertEqual(recorded, rollups(self.user))
+        self.assertIn(('expense', date(2024, 1, 1), 'food', 9.9, 1), recorded)
+        self.assertIn(('expense', date(2024, 2, 1), '', 26.6, 2), recorded)
+
+    def test_incremental_updates_match_rebuild(self):
+        income = Income.objects.create(user=self.user, name='Gift', amount=50, date=date(2024, 3, 2))
+        record_income(income)
+        expense = Expense.objects.get(user=self.user, name='Lunch')
+        # Moved to another month, the way update_expense does it
+        record_expense(expense, expense_tag_names(expense), sign=-1)
+        expense.date = date(2024, 3, 5)
+        expense.save()
+        record_expense(expense, expense_tag_names(expense))
+        recorded = rollups(self.user)
+        rebuild_user(self.user.id)
+        self.assertEqual(recorded, rollups(self.user))
+        # Emptied rows are removed, not kept at zero
+        self.assertFalse(MonthlyRollup.objects.filter(user=self.user, tag='work', month=date(2024, 1, 1)).exists())
+
+    def test_added_tag_matches_rebuild(self):
+        expense = Expense.objects.get(user=self.user, name='Bus')
+        with mock.patch.object(projection_cache, 'invalidate') as invalidate:
+            for name in ('transport', 'work', 'transport'):
+                self.assertEqual(post(add_expense_tag, self.user, dict(expense_id=str(expense.id), name=name))
+                                 .status_code, 201)
+        invalidate.assert_called_with(self.user.id)
+        recorded = rollups(self.user)
+        rebuild_user(self.user.id)
+        self.assertEqual(recorded, rollups(self.user))
+        self.assertIn(('expense', date(2024, 2, 1), '', 26.6, 2), recorded)
+        self.assertIn(('expense', date(2024, 2, 1), 'transport', 2.5, 1), recorded)
+
+    def test_rollups_are_per_user(self):
+        other = create_user('other@example.com')
+        add_batch(other, 'incomes', [dict(name='Salary', amount=1, date='2024-01-31')])
+        recorded = rollups(self.user)
+        rebuild_user(self.user.id)
+        self.assertEqual(recorded, rollups(self.user))
+        self.assertEqual(rollups(other), [('income', date(2024, 1, 1), '', 1, 1)])
+
+    def test_summarize_partial_months(self):
+        # Whole February from the rollups, the edges of January and March from the rows
+        summary = summarize(self.user, date(2024, 1, 10), date(2024, 3, 10))
+        self.assertEqual(round(summary['income'], 2), 6012.5)
+        self.assertEqual(round(summary['expense'], 2), 36.5)
+        self.assertEqual([month['month'] for month in summary['months']], ['2024-01', '2024-02'])
+        self.assertEqual({tag['name']: round(tag['total'], 2) for tag in summary['tags']},
+                         {'food': 34.0, 'work': 9.9})
+
+
+class BatchTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+
+    def test_nothing_valid_writes_nothing(self):
+        items = [dict(name='Rent', amount='x', date='2024-01-01', repeat_interval='monthly'),
+                 dict(name='Lunch', amount=9.9, date='2024-13-01', repeat_interval='monthly')]
+        with mock.patch('expense_tracker.batch.record_bulk') as record, \
+                mock.patch.object(projection_cache, 'invalidate') as invalidate:
+            response = post(add_expenses, self.user, dict(items=items))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result['code'] for result in response.data['results']], ['invalid_amount', 'invalid_date'])
+        record.assert_not_called()
+        invalidate.assert_not_called()
+        self.assertFalse(Expense.objects.filter(user=self.user).exists())
+
+    def test_mixed_batch_writes_the_valid_items(self):
+        items = [dict(name='Rent', amount='x', date='2024-01-01', repeat_interval='monthly'),
+                 dict(name='Lunch', amount=9.9, date='2024-01-15', repeat_interval='monthly', tags=['food'])]
+        response = post(add_expenses, self.user, dict(items=items))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']], [400, 201])
+        self.assertEqual(list(Expense.objects.filter(user=self.user).values_list('name', flat=True)), ['Lunch'])
+
+
+class OccurrenceBoundsTests(SimpleTestCase):
+    def occurrences(self, first, interval, start, end):
+        # Occurrence numbers in [start, end], one by one
+        shortest = dict(daily=1, weekly=7, monthly=28, yearly=365)[interval]
+        dates = occurrence_dates(first, interval, 1, (end - first).days // shortest + 1)
+        return [k for k, day in enumerate(dates, 1) if start <= day <= end]
+
+    def test_matches_enumeration(self):
+        rng = random.Random(7)
+        for _ in range(2000):
+            interval = rng.choice(['daily', 'weekly', 'monthly', 'yearly'])
+            first = date(2020, 1, 1) + timedelta(days=rng.randrange(3 * 365))
+            start = first + timedelta(days=rng.randrange(-400, 1500))
+            end = start + timedelta(days=rng.randrange(0, 1500 if interval != 'yearly' else 9000))
+            expected = self.occurrences(first, interval, start, end)
+            low, high = occurrence_bounds(first, interval, start, end)
+            with self.subTest(first=first, interval=interval, start=start, end=end):
+                self.assertEqual(list(range(low, high + 1)), expected)
+
+    def test_month_end_is_clamped(self):
+        first = date(2024, 1, 31)
+        self.assertEqual(occurrence_dates(first, 'monthly', 1, 3), [date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30)])
+        # Feb 29 falls inside a window ending Feb 29, Mar 31 does not start before Mar 31
+        self.assertEqual(occurrence_bounds(first, 'monthly', date(2024, 2, 29), date(2024, 3, 30)), (1, 1))
+        self.assertEqual(occurrence_bounds(date(2024, 2, 29), 'yearly', date(2025, 2, 28), date(2025, 2, 28)), (1, 1))
+
+    def test_first_date_is_not_an_occurrence(self):
+        first = date(2024, 1, 1)
+        self.assertEqual(occurrence_bounds(first, 'daily', first, first), (1, 0))
+        self.assertEqual(occurrence_bounds(first, 'weekly', date(2023, 1, 1), date(2024, 1, 8)), (1, 1))
+
+    def test_empty_windows(self):
+        first = date(2024, 1, 15)
+        for start, end in [(date(2023, 1, 1), date(2024, 1, 14)), (date(2024, 1, 16), date(2024, 2, 14))]:
+            low, high = occurrence_bounds(first, 'monthly', start, end)
+            self.assertLess(high, low)
+
+
+class CursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        timestamp, record_id = datetime(2024, 3, 1, 12, 0, 0, 123456, tzinfo=pytz.utc), uuid.uuid4()
+        cursor = encode_cursor(timestamp, record_id)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), (timestamp, record_id))
+
+    def test_invalid(self):
+        def encode(raw):
+            return base64.urlsafe_b64encode(raw).decode('ascii')
+
+        for cursor in ['garbage', '', encode(b'\xff\xfe'), encode(b'2024-03-01T12:00:00+00:00'),
+                       encode(b'2024-03-01T12:00:00+00:00|not-a-uuid'),
+                       encode(f'2024-03-01T12:00:00|{uuid.uuid4()}'.encode()),
+                       encode(f'yesterday|{uuid.uuid4()}'.encode())]:
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursorException):
+                decode_cursor(cursor)
+
+
+class ChangesTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        base = now() - timedelta(hours=1)
+        self.incomes = [Income.objects.create(user=self.user, name=f'Income {i}', amount=i, date=date(2024, 1, 1))
+                        for i in range(5)]
+        self.expenses = [Expense.objects.create(user=self.user, name=f'Expense {i}', amount=i, date=date(2024, 1, 1))
+                         for i in range(4)]
+        # Two rows share a timestamp, the id orders them
+        for i, record in enumerate(self.incomes + self.expenses):
+            type(record).objects.filter(id=record.id).update(updated_at=base + timedelta(seconds=i // 2))
+        self.deleted = self.expenses.pop().id
+        Expense.objects.filter(id=self.deleted).delete()
+        Tombstone.objects.create(user=self.user, kind='expense', record_id=self.deleted,
+                                 deleted_at=base + timedelta(seconds=30))
+        create_user('other@example.com').income_set.create(name='Other', amount=1, date=date(2024, 1, 1))
+
+    def pages(self, limit, since=None):
+        while True:
+            page = changes(self.user, since, limit)
+            yield page
+            if not page['has_more']:
+                return
+            since = decode_cursor(page['next'])
+
+    def test_pages_list_every_change_once(self):
+        for limit in (1, 2, 3, 100):
+            pages = list(self.pages(limit))
+            incomes = [row['id'] for page in pages for row in page['upserts']['incomes']]
+            expenses = [row['id'] for page in pages for row in page['upserts']['expenses']]
+            deletes = [record_id for page in pages for record_id in page['deletes']['expenses']]
+            with self.subTest(limit=limit):
+                self.assertEqual(incomes, [str(record_id) for record_id in Income.objects.filter(user=self.user)
+                                           .order_by('updated_at', 'id').values_list('id', flat=True)])
+                self.assertEqual(sorted(expenses), sorted(str(expense.id) for expense in self.expenses))
+                self.assertEqual(deletes, [self.deleted])
+                self.assertTrue(all(sum(map(len, (*page['upserts'].values(), *page['deletes'].values()))) <= limit
+                                    for page in pages))
+
+    def test_caught_up_cursor(self):
+        page = changes(self.user)
+        self.assertFalse(page['has_more'])
+        since = decode_cursor(page['next'])
+        self.assertEqual(changes(self.user, since)['upserts'], dict(incomes=[], expenses=[]))
+        income = Income.objects.create(user=self.user, name='New', amount=1, date=date(2024, 1, 1))
+        # Held back until CHANGES_SETTLE_SECONDS passed
+        self.assertEqual(changes(self.user, since)['upserts']['incomes'], [])
+        with mock.patch('expense_tracker.changes.now', return_value=now() + timedelta(seconds=5)):
+            later = changes(self.user, since)
+        self.assertEqual([row['id'] for row in later['upserts']['incomes']], [str(income.id)])
+        self.assertEqual(later['deletes'], dict(incomes=[], expenses=[]))
+
+    def test_stamp(self):
+        started = now()
+        stamp(Income, self.incomes[:2])
+        stamped = Income.objects.filter(updated_at__gte=started).values_list('id', flat=True)
+        self.assertEqual(set(stamped), {income.id for income in self.incomes[:2]})
+
+    def test_expired_cursor(self):
+        with self.assertRaises(CursorExpiredException):
+            changes(self.user, (now() - timedelta(days=365), uuid.uuid4()))
@@ -1,15 +1,30 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import views, async_views
 
 router = DefaultRouter()
 router.register(r'expenses', views.ExpenseItemViewSet, basename='expense')
 
-urlpatterns = [
-	path('add_income/', views.add_income),
-	path('get_incomes/<str:date_start>/<str:date_end>/', views.get_incomes),
-	path('add_expense/', views.add_expense),
-	path('get_expenses/<str:date_start>/<str:date_end>/', views.get_expenses),
-	path('get_expense_tags/', views.get_expense_tags),
-	path('', include(router.urls)),
-]
\ No newline at end of file
+
+def get_urlpatterns(use_async=False):
+	# Range queries have native async versions for ASGI deployments
+	ranges = async_views if use_async else views
+	return [
+		path('add_income/', views.add_income),
+		path('get_incomes/<str:date_start>/<str:date_end>/', ranges.get_incomes),
+		path('add_expense/', views.add_expense),
+		path('get_expenses/<str:date_start>/<str:date_end>/', ranges.get_expenses),
+		path('add_incomes/', views.add_incomes),
+		path('add_expenses/', views.add_expenses),
+		path('get_expense_tags/', views.get_expense_tags),
+		path('changes/', views.get_changes),
+		path('import/', views.import_statement_file),
+		path('export/<str:date_start>/<str:date_end>/', views.export_data),
+		path('get_summary/<str:date_start>/<str:date_end>/', views.get_summary),
+		path('get_analytics/<str:date_start>/<str:date_end>/', views.get_analytics),
+		path('', include(router.urls)),
+	]
+
+
+urlpatterns = get_urlpatterns(settings.ASYNC_VIEWS)
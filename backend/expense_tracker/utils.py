@@ -0,0 +1,5 @@
+from django.conf import settings
+
+
+def get_setting(name, default=None):
+    return getattr(settings, 'EXPENSE_TRACKER', {}).get(name, default)
@@ -1,14 +1,30 @@
+import json
 from datetime import datetime
 from rest_framework import viewsets
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.response import Response
+from django.http import StreamingHttpResponse
+from django.db import transaction
+from django.core.exceptions import ValidationError
+from django.db.models import Sum, Count
 from django.utils.encoding import force_str
+from django.utils.timezone import now
 from django_axor_auth.users.permissions import IsAuthenticated
 from django_axor_auth.users.api import get_request_user
 from django_axor_auth.utils.error_handling.error_message import ErrorMessage
 
-from .models import Income, Expense, ExpenseTags
+from .models import Income, Expense, TaggedExpense, Tombstone
 from .serializers import IncomeSerializer, ExpenseSerializer, ExpenseTagsSerializer
+from .serializers import INCOME_ROWS, expense_rows
+from .tags import clean_tag_names, resolve_tags, tag_expense, retag_expense, tag_usage
+from .rollups import record_income, record_expense, record_expense_tag, expense_tag_names, summarize
+from .batch import add_batch
+from .changes import changes, decode_cursor, InvalidCursorException, CursorExpiredException
+from .analytics import fetch, breakdown
+from .export import iter_rows, buffered, FORMATS, KINDS
+from .importer import import_statement, iter_import, statement_format, InvalidStatementException
+from .utils import get_setting
+from .recurrence import projected_totals, projected_occurrences, projection_cache, ProjectionTooLargeException
 
 
 @api_view(['POST'])
@@ -41,7 +57,9 @@ def add_income(request):
             instance=request.build_absolute_uri()
         ).to_response()
     # Save to database
-    income = Income.objects.create(name=name, amount=amount, date=date_obj.date(), user=user)
+    with transaction.atomic():
+        income = Income.objects.create(name=name, amount=amount, date=date_obj.date(), user=user)
+        record_income(income)
     # Serialize and return response
     serializer = IncomeSerializer(income)
     return Response(serializer.data, status=201)
@@ -64,8 +82,7 @@ def get_incomes(request, date_start=None, date_end=None):
             instance=request.build_absolute_uri()
         ).to_response()
     income = Income.objects.filter(user=user, date__range=(date_start, date_end)).order_by('-date')
-    serializer = IncomeSerializer(income, many=True)
-    return Response(serializer.data)
+    return Response(INCOME_ROWS(income.values(*INCOME_ROWS.sources)))
 
 
 @api_view(['POST'])
@@ -103,26 +120,55 @@ def add_expense(request):
             instance=request.build_absolute_uri()
         ).to_response()
     # Save to database
-    expense = Expense.objects.create(
-        amount=amount,
-        date=date_obj.date(),
-        name=name,
-        repeat=repeat,
-        repeat_interval=repeat_interval,
-        user=user
-    )
-    # Save tags
-    added_tags = []
-    if tags:
-        for tag in tags:
-            if isinstance(tag, str) and len(tag) > 0:
-                tag_obj = ExpenseTags.objects.create(name=force_str(tag), user=user, expense_id=expense)
-                added_tags.append(ExpenseTagsSerializer(tag_obj).data)
+    with transaction.atomic():
+        expense = Expense.objects.create(
+            amount=amount,
+            date=date_obj.date(),
+            name=name,
+            repeat=repeat,
+            repeat_interval=repeat_interval,
+            user=user
+        )
+        # Save tags
+        names = clean_tag_names(tags)
+        added_tags = ExpenseTagsSerializer(tag_expense(user, expense, names), many=True).data
+        record_expense(expense, names)
+    projection_cache.invalidate(user.id)
     # Serialize and return response
     serializer = ExpenseSerializer(expense)
     return Response({**serializer.data, 'tags': added_tags}, status=201)
 
 
+# Add many incomes or expenses in one request
+# -----------------------------------------------
+def _add_batch(request, kind):
+    items = request.data.get('items') if isinstance(request.data, dict) else None
+    max_items = get_setting('BATCH_MAX_ITEMS', 500)
+    if not isinstance(items, list) or len(items) == 0 or len(items) > max_items:
+        return ErrorMessage(
+            title='Invalid Items',
+            detail=f'Provide a list of 1 to {max_items} items',
+            status=400,
+            code='invalid_items',
+            instance=request.build_absolute_uri()
+        ).to_response()
+    # With atomic set, one invalid item rejects the whole batch
+    results, written = add_batch(get_request_user(request), kind, items, request.data.get('atomic') is True)
+    return Response({'results': results}, status=200 if written else 400)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def add_incomes(request):
+    return _add_batch(request, 'incomes')
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def add_expenses(request):
+    return _add_batch(request, 'expenses')
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_expenses(request, date_start=None, date_end=None):
@@ -139,10 +185,37 @@ def get_expenses(request, date_start=None, date_end=None):
             code='invalid_date',
             instance=request.build_absolute_uri()
         ).to_response()
-    expense = Expense.objects.prefetch_related('tags').filter(
-        user=user, date__range=(date_start, date_end)).order_by('-date')
-    serializer = ExpenseSerializer(expense, many=True)
-    return Response(serializer.data)
+    # Recurring expenses can be projected over the range
+    projection = request.GET.get('projection')
+    if projection not in (None, 'occurrences', 'totals'):
+        return ErrorMessage(
+            title='Invalid Projection',
+            detail='Projection should be occurrences or totals',
+            status=400,
+            code='invalid_projection',
+            instance=request.build_absolute_uri()
+        ).to_response()
+    if projection == 'totals':
+        actual = Expense.objects.filter(user=user, date__range=(date_start, date_end)).aggregate(
+            total=Sum('amount'), count=Count('id'))
+        return Response({
+            'actual': {'total': actual['total'] or 0, 'count': actual['count']},
+            'projected': projected_totals(user, date_start, date_end),
+        })
+    expense = expense_rows(Expense.objects.filter(user=user, date__range=(date_start, date_end)).order_by('-date'))
+    if projection == 'occurrences':
+        try:
+            occurrences = projected_occurrences(user, date_start, date_end)
+        except ProjectionTooLargeException:
+            return ErrorMessage(
+                title='Projection Too Large',
+                detail='Too many occurrences in this range, use a shorter range or projection=totals',
+                status=400,
+                code='projection_too_large',
+                instance=request.build_absolute_uri()
+            ).to_response()
+        return Response(sorted(expense + occurrences, key=lambda item: item['date'], reverse=True))
+    return Response(expense)
 
 
 @api_view(['POST'])
@@ -151,8 +224,34 @@ def add_expense_tag(request):
     user = get_request_user(request)
     name = force_str(request.data.get('name'))
     expense_id = request.data.get('expense_id')
+    try:
+        expense = Expense.objects.get(id=expense_id, user=user)
+    except (Expense.DoesNotExist, ValidationError):
+        return ErrorMessage(
+            title='Expense not found',
+            detail='The expense does not exist',
+            status=404,
+            code='expense_not_found',
+            instance=request.build_absolute_uri()
+        ).to_response()
+    if len(name) == 0:
+        return ErrorMessage(
+            title='Invalid Tag',
+            detail='Tag name should not be empty',
+            status=400,
+            code='invalid_tag',
+            instance=request.build_absolute_uri()
+        ).to_response()
     # Save to database
-    tag = ExpenseTags.objects.create(name=name, user=user, expense_id=expense_id)
+    with transaction.atomic():
+        tags = resolve_tags(user, [name])
+        tag, created = TaggedExpense.objects.get_or_create(expense=expense, tag=tags[name], user=user)
+        if created:
+            record_expense_tag(expense, name)
+            # For the change feed
+            Expense.objects.filter(id=expense.id).update(updated_at=now())
+    if created:
+        projection_cache.invalidate(user.id)
     # Serialize and return response
     serializer = ExpenseTagsSerializer(tag)
     return Response(serializer.data, status=201)
@@ -162,9 +261,168 @@ def add_expense_tag(request):
 @permission_classes([IsAuthenticated])
 def get_expense_tags(request):
     user = get_request_user(request)
-    tag = ExpenseTags.objects.filter(user=user)
-    serializer = ExpenseTagsSerializer(tag, many=True)
-    return Response(serializer.data)
+    return Response(tag_usage(user))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_changes(request):
+    # Upserts and deletes since ?since=<cursor>, everything without one
+    user = get_request_user(request)
+    try:
+        since = request.GET.get('since')
+        since = decode_cursor(since) if since else None
+        limit = int(request.GET.get('limit', get_setting('CHANGES_PAGE_SIZE', 500)))
+        limit = min(max(limit, 1), get_setting('CHANGES_MAX_PAGE_SIZE', 2000))
+    except (ValueError, InvalidCursorException):
+        return ErrorMessage(
+            title='Invalid Cursor',
+            detail='The cursor or page size is not valid',
+            status=400,
+            code='invalid_cursor',
+            instance=request.build_absolute_uri()
+        ).to_response()
+    try:
+        return Response(changes(user, since, limit))
+    except CursorExpiredException:
+        return ErrorMessage(
+            title='Cursor Expired',
+            detail='Deletions this old are no longer kept, download everything again without a cursor',
+            status=410,
+            code='cursor_expired',
+            instance=request.build_absolute_uri()
+        ).to_response()
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_data(request, date_start=None, date_end=None):
+    user = get_request_user(request)
+    # Check if date is valid
+    try:
+        date_start = datetime.strptime(date_start, '%Y-%m-%d').date()
+        date_end = datetime.strptime(date_end, '%Y-%m-%d').date()
+    except ValueError:
+        return ErrorMessage(
+            title='Invalid Date',
+            detail='Date should be in the format YYYY-MM-DD',
+            status=400,
+            code='invalid_date',
+            instance=request.build_absolute_uri()
+        ).to_response()
+    # ?format= is taken by DRF's format suffixes
+    fmt = request.GET.get('as', 'csv')
+    kinds = request.GET.get('kind', 'incomes,expenses').split(',')
+    if fmt not in FORMATS or any(kind not in KINDS for kind in kinds):
+        return ErrorMessage(
+            title='Invalid Export',
+            detail='Export as csv or ndjson, kind should be incomes, expenses or both',
+            status=400,
+            code='invalid_export',
+            instance=request.build_absolute_uri()
+        ).to_response()
+    writer, content_type = FORMATS[fmt]
+    response = StreamingHttpResponse(
+        buffered(writer(iter_rows(user, date_start, date_end, kinds))), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="export-{date_start}-{date_end}.{fmt}"'
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def import_statement_file(request):
+    user = get_request_user(request)
+    upload = request.FILES.get('file')
+    if upload is None:
+        return ErrorMessage(
+            title='No File',
+            detail='Upload the statement as the file field',
+            status=400,
+            code='missing_file',
+            instance=request.build_absolute_uri()
+        ).to_response()
+    fmt = force_str(request.data.get('format') or statement_format(upload.name))
+    tags = [tag.strip() for tag in force_str(request.data.get('tags') or '').split(',')]
+    date_format = request.data.get('date_format') or None
+
+    options = dict(fmt=fmt, tags=tags, date_format=date_format)
+    # With ?stream=1 the report is sent as a JSON line after every chunk
+    if request.GET.get('stream') == '1':
+        def lines():
+            try:
+                for report in iter_import(user, upload.file, **options):
+                    yield json.dumps(report) + '\n'
+            except InvalidStatementException as e:
+                yield json.dumps(dict(error=str(e), done=True)) + '\n'
+        return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    try:
+        report = import_statement(user, upload.file, **options)
+    except InvalidStatementException as e:
+        return ErrorMessage(
+            title='Invalid Statement',
+            detail=str(e),
+            status=400,
+            code='invalid_statement',
+            instance=request.build_absolute_uri()
+        ).to_response()
+    return Response(report, status=201)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_summary(request, date_start=None, date_end=None):
+    user = get_request_user(request)
+    # Check if date is valid
+    try:
+        date_start = datetime.strptime(date_start, '%Y-%m-%d').date()
+        date_end = datetime.strptime(date_end, '%Y-%m-%d').date()
+    except ValueError:
+        return ErrorMessage(
+            title='Invalid Date',
+            detail='Date should be in the format YYYY-MM-DD',
+            status=400,
+            code='invalid_date',
+            instance=request.build_absolute_uri()
+        ).to_response()
+    return Response(summarize(user, date_start, date_end))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_analytics(request, date_start=None, date_end=None):
+    user = get_request_user(request)
+    # Check if date is valid
+    try:
+        date_start = datetime.strptime(date_start, '%Y-%m-%d').date()
+        date_end = datetime.strptime(date_end, '%Y-%m-%d').date()
+    except ValueError:
+        return ErrorMessage(
+            title='Invalid Date',
+            detail='Date should be in the format YYYY-MM-DD',
+            status=400,
+            code='invalid_date',
+            instance=request.build_absolute_uri()
+        ).to_response()
+    # Days in the rolling averages
+    window = request.GET.get('window', '7')
+    if not window.isdigit() or not 1 <= int(window) <= 365 or date_end < date_start:
+        return ErrorMessage(
+            title='Invalid Analytics Range',
+            detail='The end date should not be before the start date, window should be 1 to 365 days',
+            status=400,
+            code='invalid_analytics_range',
+            instance=request.build_absolute_uri()
+        ).to_response()
+    # Before fetch(), which would load the whole range
+    if (date_end - date_start).days >= get_setting('ANALYTICS_MAX_DAYS', 3660):
+        return ErrorMessage(
+            title='Range Too Large',
+            detail='Analytics cover at most ' + str(get_setting('ANALYTICS_MAX_DAYS', 3660)) + ' days',
+            status=400,
+            code='range_too_large',
+            instance=request.build_absolute_uri()
+        ).to_response()
+    return Response(breakdown(fetch(user, date_start, date_end), date_start, date_end, int(window)))
 
 
 class ExpenseItemViewSet(viewsets.ViewSet):
@@ -174,8 +432,12 @@ class ExpenseItemViewSet(viewsets.ViewSet):
     def delete(self, request, pk):
         user = get_request_user(request)
         try:
-            expense = Expense.objects.get(id=pk, user=user)
-            expense.delete()
+            with transaction.atomic():
+                expense = Expense.objects.select_for_update().get(id=pk, user=user)
+                record_expense(expense, expense_tag_names(expense), sign=-1)
+                expense.delete()
+                Tombstone.objects.create(user=user, kind='expense', record_id=pk)
+            projection_cache.invalidate(user.id)
             return Response(status=204)
         except Expense.DoesNotExist:
             return ErrorMessage(
@@ -230,22 +492,21 @@ class ExpenseItemViewSet(viewsets.ViewSet):
                 instance=request.build_absolute_uri()
             ).to_response()
         # Save to database
-        expense.amount = amount
-        expense.date = date_obj.date()
-        expense.name = name
-        expense.repeat = repeat
-        expense.repeat_interval = repeat_interval
-        expense.save()
-        # Save tags
-        added_tags = []
-        if tags:
-            for tag in tags:
-                if isinstance(tag, str) and len(tag) > 0:
-                    try:
-                        added_tags.append(ExpenseTagsSerializer(ExpenseTags.objects.get(name=tag, user=user)).data)
-                    except ExpenseTags.DoesNotExist:
-                        tag_obj = ExpenseTags.objects.create(name=force_str(tag), user=user, expense_id=expense)
-                        added_tags.append(ExpenseTagsSerializer(tag_obj).data)
+        with transaction.atomic():
+            expense = Expense.objects.select_for_update().get(id=expense.id)
+            # Take the old values out of the rollups, add the new ones back
+            record_expense(expense, expense_tag_names(expense), sign=-1)
+            expense.amount = amount
+            expense.date = date_obj.date()
+            expense.name = name
+            expense.repeat = repeat
+            expense.repeat_interval = repeat_interval
+            expense.save()
+            # Save tags, the given list replaces the current tags
+            names = clean_tag_names(tags)
+            added_tags = ExpenseTagsSerializer(retag_expense(user, expense, names), many=True).data
+            record_expense(expense, names)
+        projection_cache.invalidate(user.id)
         # Serialize and return response
         serializer = ExpenseSerializer(expense)
         return Response({**serializer.data, 'tags': added_tags}, status=200)
@@ -1,6 +1,9 @@
 from django.contrib import admin
-from .models import Note, ShareExternal
+from .models import Note, NoteOperation, NoteRevision, NoteSearchToken, ShareExternal
 
 # Register your models here.
 admin.site.register(Note)
 admin.site.register(ShareExternal)
+admin.site.register(NoteOperation)
+admin.site.register(NoteSearchToken)
+admin.site.register(NoteRevision)
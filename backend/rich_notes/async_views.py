@@ -0,0 +1,227 @@
+import json
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.db.models import Q, Max, Count
+from django.core.exceptions import ValidationError
+from rest_framework import status
+# Session
+from django_axor_auth.users.api import get_request_user
+from django_axor_auth.security.hashing import hash_this
+from django_axor_auth.utils.error_handling.error_message import ErrorMessage
+from core.async_api import async_api_view, json_response, request_data, run_cpu
+# Models & Serializers
+from .models import Note, ShareExternal
+from .serializers import NoteListSerializer, NOTE_ROWS
+from .utils import encrypt_note, decrypt_note, InvalidKeyException
+from .utils import version_stamp, last_changed, make_etag, validator_headers, is_not_modified
+from .utils import get_setting, encode_cursor, decode_cursor, InvalidCursorException
+from .cache import content_cache, share_link_cache
+from .compaction import read_note_content
+from .operations import InvalidOperationException
+from . import views
+
+# Async versions of the hot note endpoints, routed instead of the views in
+# views.py when settings.ASYNC_VIEWS is on. Queries use the async ORM,
+# encryption runs on the bounded executor and anything that needs a
+# transaction is handed to the sync implementation.
+
+
+async def _note_content(note_id, updated):
+    content = content_cache.get(note_id, updated)
+    if content is not None:
+        return content
+    row = await Note.objects.filter(id=note_id).values_list('content', 'operations_pending').afirst()
+    if row is None:
+        raise Note.DoesNotExist
+    blob, operations_pending = row
+    if operations_pending > 0:
+        # Compaction writes in a transaction
+        note = await Note.objects.defer('content').aget(id=note_id)
+        return await sync_to_async(read_note_content)(note)
+    content = await run_cpu(decrypt_note, blob) if blob else ""
+    if content is not None:
+        content_cache.set(note_id, updated, content)
+    return content
+
+
+# Get all notes
+# -----------------------------------------------
+@async_api_view(['GET'])
+async def get_notes(request):
+    fields = request.GET.get('fields')
+    fields = [f for f in fields.split(',') if f in views.NOTE_LIST_FIELDS] if fields else views.NOTE_LIST_FIELDS
+    notes = Note.objects.filter(user=get_request_user(request))
+    if 'limit' in request.GET or 'cursor' in request.GET:
+        try:
+            limit = int(request.GET.get('limit', get_setting('NOTES_PAGE_SIZE', 50)))
+            limit = min(max(limit, 1), get_setting('NOTES_MAX_PAGE_SIZE', 200))
+            cursor = request.GET.get('cursor')
+            if cursor:
+                updated, note_id = decode_cursor(cursor)
+                notes = notes.filter(Q(updated__lt=updated) | Q(updated=updated, id__lt=note_id))
+            page = [note async for note in notes.order_by('-updated', '-id').values(*NOTE_ROWS.sources)[:limit + 1]]
+        except (ValueError, ValidationError, InvalidCursorException):
+            return ErrorMessage(
+                title="Invalid page",
+                status=status.HTTP_400_BAD_REQUEST,
+                instance=request.build_absolute_uri(),
+                code="N0415",
+                detail="The page size or cursor is not valid."
+            ).to_response()
+        has_more = len(page) > limit
+        page = page[:limit]
+        data = NOTE_ROWS(page)
+        if fields != views.NOTE_LIST_FIELDS:
+            data = [{f: note[f] for f in fields} for note in data]
+        return json_response({
+            "notes": data,
+            "next": encode_cursor(page[-1]['updated'], page[-1]['id']) if has_more else None,
+        })
+    version = await notes.aaggregate(latest=Max('updated'), renamed=Max('renamed'), count=Count('id'))
+    etag = make_etag('notes', version['count'], version_stamp(version['latest']),
+                     version_stamp(version['renamed']), *fields)
+    last_modified = last_changed(version['latest'], version['renamed'])
+    headers = validator_headers(etag, last_modified)
+    if is_not_modified(request, etag, last_modified):
+        return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    data = NOTE_ROWS([note async for note in notes.order_by('updated').values(*NOTE_ROWS.sources)])
+    if fields != views.NOTE_LIST_FIELDS:
+        data = [{f: note[f] for f in fields} for note in data]
+    return json_response({"notes": data}, headers=headers)
+
+
+# Read, update a note. Everything else goes to the sync view.
+# -----------------------------------------------
+@async_api_view(['GET', 'DELETE', 'PUT', 'PATCH', 'POST'])
+async def note_ops(request, note_id):
+    if request.method == 'GET' and request.GET.get('ops') != '1':
+        return await read_note(request, note_id)
+    elif request.method == 'PUT':
+        return await update_note_content(request, note_id)
+    return await sync_to_async(views.note_ops)(request, note_id)
+
+
+async def read_note(request, note_id):
+    try:
+        note = await Note.objects.defer('content').aget(id=note_id, user=get_request_user(request))
+        etag = make_etag(note.id, version_stamp(note.updated), version_stamp(note.renamed), 'doc')
+        last_modified = last_changed(note.updated, note.renamed)
+        headers = validator_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        data = NoteListSerializer(note).data
+        data['content'] = await _note_content(note.id, note.updated)
+        return json_response(data, headers=headers)
+    except (Note.DoesNotExist, ValidationError):
+        return ErrorMessage(
+            title="No note found",
+            status=status.HTTP_404_NOT_FOUND,
+            instance=request.build_absolute_uri(),
+            code="N0404",
+            detail="This note does not exist."
+        ).to_response()
+    except (InvalidKeyException, InvalidOperationException):
+        return ErrorMessage(
+            title="Failed reading note",
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            instance=request.build_absolute_uri(),
+            code="N0549",
+            detail="This note cannot be retrieved."
+        ).to_response()
+
+
+async def update_note_content(request, note_id):
+    try:
+        note = await Note.objects.defer('content').aget(id=note_id, user=get_request_user(request))
+    except (Note.DoesNotExist, ValidationError):
+        return ErrorMessage(
+            title="No note found",
+            status=status.HTTP_404_NOT_FOUND,
+            instance=request.build_absolute_uri(),
+            code="N0403",
+            detail="This note does not exist."
+        ).to_response()
+    document = request_data(request)['content']
+    encrypted = await run_cpu(encrypt_note, document)
+    await sync_to_async(views.store_note_content)(note, document, encrypted)
+    data = NoteListSerializer(note).data
+    # We send json string of the content
+    data['content'] = json.dumps(document)
+    return json_response(data)
+
+
+# Read a note via share link
+# -----------------------------------------------
+@async_api_view(['POST'], authenticated=False)
+async def read_note_via_share_link(request, perm_key):
+    try:
+        passkey = hash_this(perm_key)
+        share = share_link_cache.get(passkey)
+        if share is None:
+            try:
+                query = await ShareExternal.objects.select_related('note', 'user').aget(passkey=passkey, active=1)
+                share = views.cache_share_record(passkey, query)
+            except ShareExternal.DoesNotExist:
+                share_link_cache.set_not_found(passkey)
+                raise
+        if share == share_link_cache.NOT_FOUND:
+            raise ShareExternal.DoesNotExist
+
+        data = request_data(request)
+        # Password is required
+        if len(share['password']) > 0 and ('password' not in data or len(data['password']) < 1):
+            return ErrorMessage(
+                title="Access Denied",
+                status=status.HTTP_401_UNAUTHORIZED,
+                instance=request.build_absolute_uri(),
+                code="N1401",
+                detail="Password is required."
+            ).to_response()
+
+        # Check password
+        if len(share['password']) > 0 and share['password'] != hash_this(data['password']):
+            return ErrorMessage(
+                title="Incorrect Password",
+                status=status.HTTP_401_UNAUTHORIZED,
+                instance=request.build_absolute_uri(),
+                code="N1402",
+                detail="Provided password is incorrect."
+            ).to_response()
+
+        # Records cached before `note_renamed` existed have no rename
+        renamed = share.get('note_renamed')
+        etag = make_etag(share['id'], version_stamp(share['note_updated']), version_stamp(renamed))
+        last_modified = last_changed(share['note_updated'], renamed)
+        headers = validator_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        response = dict(
+            noteTitle=share['note_title'],
+            noteContent=await _note_content(share['note_id'], share['note_updated']),
+            noteCreated=share['note_created'],
+            noteUpdated=share['note_updated'],
+            noteSharedOn=share['created'],
+        )
+        # If person explicitly asked not to be anonymous
+        if share['anonymous'] is False:
+            response['noteSharedBy'] = share['shared_by']
+            response['noteSharedByUID'] = share['shared_by_uid']
+
+        return json_response(response, headers=headers)
+    except (ShareExternal.DoesNotExist, Note.DoesNotExist):
+        return ErrorMessage(
+            title="Failed reading note",
+            status=status.HTTP_404_NOT_FOUND,
+            instance=request.build_absolute_uri(),
+            code="N1404",
+            detail="This note cannot be retrieved."
+        ).to_response()
+    except (InvalidKeyException, InvalidOperationException):
+        return ErrorMessage(
+            title="Failed reading note",
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            instance=request.build_absolute_uri(),
+            code="N1549",
+            detail="This note cannot be retrieved."
+        ).to_response()
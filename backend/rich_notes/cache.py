@@ -0,0 +1,215 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+from django.core.cache import caches
+from .models import ShareExternal
+from .utils import get_setting
+
+
+class NoteContentCache:
+    """Bounded LRU of decrypted note content.
+
+    Entries are stored per note together with the `updated` timestamp they
+    were decrypted at. A lookup with a different timestamp is a miss, so a
+    stale copy is never served even if an invalidation was missed.
+
+    Optionally mirrors entries into a Django cache (`backend` is the alias)
+    so several worker processes can share decrypted content.
+    """
+
+    def __init__(self, max_bytes, backend=None, timeout=300):
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _shared_key(note_id):
+        return f"rich_notes:content:{note_id}"
+
+    def _shared(self):
+        return caches[self.backend] if self.backend else None
+
+    def get(self, note_id, updated):
+        key = str(note_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == updated:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._drop(key)
+        shared = self._shared()
+        if shared is not None:
+            entry = shared.get(self._shared_key(key))
+            if entry is not None and entry[0] == updated:
+                self._store(key, updated, entry[1])
+                with self._lock:
+                    self.hits += 1
+                return entry[1]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, note_id, updated, content):
+        key = str(note_id)
+        self._store(key, updated, content)
+        shared = self._shared()
+        if shared is not None:
+            shared.set(self._shared_key(key), (updated, content), self.timeout)
+
+    def invalidate(self, note_id):
+        key = str(note_id)
+        with self._lock:
+            self._drop(key)
+        shared = self._shared()
+        if shared is not None:
+            shared.delete(self._shared_key(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                entries=len(self._entries),
+                bytes=self._size,
+                max_bytes=self.max_bytes,
+            )
+
+    def _store(self, key, updated, content):
+        size = sys.getsizeof(content)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (updated, content, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def _drop(self, key):
+        # Caller holds the lock
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+
+content_cache = NoteContentCache(
+    max_bytes=get_setting('CONTENT_CACHE_MAX_BYTES', 32 * 1024 * 1024),
+    backend=get_setting('CONTENT_CACHE_BACKEND', None),
+    timeout=get_setting('CONTENT_CACHE_TIMEOUT', 300),
+)
+
+
+class ShareLinkCache:
+    """Maps a hashed share passkey to the resolved share record.
+
+    Unknown passkeys are remembered as `NOT_FOUND` for a shorter TTL so
+    repeated guesses do not reach the database. Like `NoteContentCache`,
+    entries can be mirrored into a Django cache shared by all workers.
+    """
+    NOT_FOUND = 'not_found'
+
+    def __init__(self, max_entries, ttl, negative_ttl, backend=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _shared_key(passkey):
+        return f"rich_notes:share:{passkey}"
+
+    def _shared(self):
+        return caches[self.backend] if self.backend else None
+
+    def get(self, passkey):
+        with self._lock:
+            entry = self._entries.get(passkey)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(passkey)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[passkey]
+        shared = self._shared()
+        if shared is not None:
+            record = shared.get(self._shared_key(passkey))
+            if record is not None:
+                self._store(passkey, record)
+                with self._lock:
+                    self.hits += 1
+                return record
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, passkey, record):
+        self._store(passkey, record)
+        shared = self._shared()
+        if shared is not None:
+            shared.set(self._shared_key(passkey), record, self._ttl_for(record))
+
+    def set_not_found(self, passkey):
+        self.set(passkey, self.NOT_FOUND)
+
+    def invalidate(self, *passkeys):
+        with self._lock:
+            for passkey in passkeys:
+                self._entries.pop(passkey, None)
+        shared = self._shared()
+        if shared is not None and len(passkeys) > 0:
+            shared.delete_many([self._shared_key(passkey) for passkey in passkeys])
+
+    def invalidate_note(self, note_id):
+        self.invalidate_notes([note_id])
+
+    def invalidate_notes(self, note_ids):
+        # Every link of the note carries its metadata
+        if len(note_ids) > 0:
+            self.invalidate(*ShareExternal.objects.filter(note_id__in=note_ids).values_list('passkey', flat=True))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, entries=len(self._entries))
+
+    def _ttl_for(self, record):
+        return self.negative_ttl if record == self.NOT_FOUND else self.ttl
+
+    def _store(self, passkey, record):
+        with self._lock:
+            self._entries.pop(passkey, None)
+            self._entries[passkey] = (time.monotonic() + self._ttl_for(record), record)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+share_link_cache = ShareLinkCache(
+    max_entries=get_setting('SHARE_CACHE_MAX_ENTRIES', 10000),
+    ttl=get_setting('SHARE_CACHE_TTL', 60),
+    negative_ttl=get_setting('SHARE_CACHE_NEGATIVE_TTL', 10),
+    backend=get_setting('SHARE_CACHE_BACKEND', None),
+)
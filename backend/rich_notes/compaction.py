@@ -0,0 +1,109 @@
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.db import transaction, close_old_connections
+from django.db.models import F
+# Models
+from .models import Note, NoteOperation
+from .operations import apply_operations, InvalidOperationException
+from .utils import encrypt_note, decrypt_note, get_setting
+from .cache import content_cache
+from .search import index_note_content
+from .revisions import record_revision
+
+logger = logging.getLogger(__name__)
+
+# Single worker so compactions never race each other
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rich_notes_compaction')
+_scheduled = set()
+_scheduled_lock = threading.Lock()
+
+
+def compact_threshold():
+    return get_setting('OPERATIONS_COMPACT_THRESHOLD', 50)
+
+
+# Document <-> encrypted content
+# -----------------------------------------------
+def load_document(note):
+    if not note.content:
+        return []
+    return json.loads(decrypt_note(note.content))
+
+
+def load_operations(row):
+    return json.loads(decrypt_note(row.operations))
+
+
+# Fold the pending operations into a new encrypted snapshot
+# -----------------------------------------------
+def compact_note(note_id):
+    with transaction.atomic():
+        note = Note.objects.select_for_update().get(id=note_id)
+        pending = list(NoteOperation.objects.filter(note=note).order_by('id'))
+        if len(pending) == 0:
+            return note
+        document = load_document(note)
+        for row in pending:
+            try:
+                document = apply_operations(document, load_operations(row))
+            except InvalidOperationException:
+                # Later batches were made on top of this one, skipping it would
+                # corrupt the note. The log is kept as it is to be looked at
+                raise InvalidOperationException(f"Operations {row.id} of note {note.id} cannot be applied")
+        note.content = encrypt_note(document)
+        Note.objects.filter(id=note.id).update(
+            content=note.content,
+            operations_pending=F('operations_pending') - len(pending)
+        )
+        NoteOperation.objects.filter(note=note, id__lte=pending[-1].id).delete()
+        # Patched words reach the search index once they are compacted
+        index_note_content(note, document)
+        record_revision(note, document)
+    return note
+
+
+def _run_compaction(note_id):
+    try:
+        compact_note(note_id)
+    except Note.DoesNotExist:
+        pass
+    except Exception:
+        logger.exception("Compaction failed for note %s", note_id)
+    finally:
+        with _scheduled_lock:
+            _scheduled.discard(note_id)
+        close_old_connections()
+
+
+def schedule_compaction(note_id):
+    with _scheduled_lock:
+        if note_id in _scheduled:
+            return
+        _scheduled.add(note_id)
+    _executor.submit(_run_compaction, note_id)
+
+
+# Content as returned by the read endpoints
+# -----------------------------------------------
+def current_document(note):
+    """The document of `note` with its pending operations, nothing is stored."""
+    content = content_cache.get(note.id, note.updated)
+    if content is not None:
+        return json.loads(content)
+    document = load_document(note)
+    for row in NoteOperation.objects.filter(note=note).order_by('id'):
+        document = apply_operations(document, load_operations(row))
+    return document
+
+
+def read_note_content(note):
+    content = content_cache.get(note.id, note.updated)
+    if content is not None:
+        return content
+    if note.operations_pending > 0:
+        note = compact_note(note.id)
+    content = decrypt_note(note.content) if note.content else ""
+    content_cache.set(note.id, note.updated, content)
+    return content
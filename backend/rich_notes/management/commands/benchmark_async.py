@@ -0,0 +1,132 @@
+import time
+import uuid
+import asyncio
+import threading
+from datetime import datetime
+from types import ModuleType
+import jwt
+import pytz
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.test import Client, AsyncClient, RequestFactory
+from django.test.utils import override_settings
+from django.core.management.base import BaseCommand
+from django_axor_auth.users.models import User
+from django_axor_auth.users.users_app_tokens.models import AppToken
+from core import urls
+from rich_notes.models import Note
+from rich_notes.utils import encrypt_note
+from rich_notes.cache import content_cache
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ("Compare the sync (WSGI) and async (ASGI) note endpoints under concurrent load. "
+            "Seeds a temporary user and notes, and removes them afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400, help="Requests per run.")
+        parser.add_argument('--concurrency', type=int, default=20, help="Requests in flight.")
+        parser.add_argument('--notes', type=int, default=50, help="Notes to seed.")
+        parser.add_argument('--paragraphs', type=int, default=50, help="Paragraphs per note.")
+
+    def handle(self, *args, **options):
+        user, headers = self.seed(options['notes'], options['paragraphs'])
+        try:
+            note_ids = [str(note_id) for note_id in Note.objects.filter(user=user).values_list('id', flat=True)]
+            paths = ['/api/rich_notes/all/?limit=50'] + [f'/api/rich_notes/{note_id}/' for note_id in note_ids]
+            paths = [paths[i % len(paths)] for i in range(options['requests'])]
+            for name, runner in (('sync', self.run_sync), ('async', self.run_async)):
+                # Both runs start with a cold content cache
+                content_cache.clear()
+                conf = ModuleType(f'benchmark_{name}_urls')
+                conf.urlpatterns = urls.get_urlpatterns(use_async=name == 'async')
+                with override_settings(ROOT_URLCONF=conf):
+                    elapsed, latencies, errors = runner(paths, headers, options['concurrency'])
+                self.report(name, elapsed, latencies, errors)
+        finally:
+            user.delete()
+
+    def seed(self, count, paragraphs):
+        user = User.objects.create_user(
+            email=f'benchmark-{uuid.uuid4().hex}@example.com',
+            password=uuid.uuid4().hex, first_name='Benchmark', last_name='User'
+        )
+        request = RequestFactory().get('/', HTTP_USER_AGENT='benchmark', REMOTE_ADDR='127.0.0.1')
+        key, _ = AppToken.objects.create_app_token(user, request)
+        document = [
+            {"type": "paragraph", "children": [{"text": f"Paragraph {i} of the benchmark note."}]}
+            for i in range(paragraphs)
+        ]
+        now = datetime.now(pytz.utc)
+        Note.objects.bulk_create([
+            Note(id=uuid.uuid4(), user=user, title=f'Benchmark {i}', content=encrypt_note(document),
+                 created=now, updated=now)
+            for i in range(count)
+        ])
+        headers = {
+            'X-Requested-By': 'mobile',
+            'Authorization': 'Bearer ' + jwt.encode({'app_token': key}, settings.SECRET_KEY, algorithm='HS256'),
+            'User-Agent': 'benchmark',
+        }
+        return user, headers
+
+    def run_sync(self, paths, headers, concurrency):
+        # Thread per connection, as a threaded WSGI server would run
+        latencies, errors, lock = [], [], threading.Lock()
+
+        def worker(share):
+            client = Client()
+            for path in share:
+                start = time.perf_counter()
+                response = client.get(path, headers=headers)
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+            connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(paths[i::concurrency],)) for i in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, latencies, errors
+
+    def run_async(self, paths, headers, concurrency):
+        # Coroutines on one event loop, as an ASGI server would run
+        latencies, errors = [], []
+
+        async def worker(share):
+            client = AsyncClient()
+            for path in share:
+                start = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+
+        async def main():
+            await asyncio.gather(*(worker(paths[i::concurrency]) for i in range(concurrency)))
+            await sync_to_async(connections.close_all)()
+
+        start = time.perf_counter()
+        asyncio.run(main())
+        return time.perf_counter() - start, latencies, errors
+
+    def report(self, name, elapsed, latencies, errors):
+        self.stdout.write(
+            f"{name:>5}: {len(latencies) / elapsed:8.1f} req/s  "
+            f"p50 {percentile(latencies, 0.50) * 1000:7.2f} ms  "
+            f"p95 {percentile(latencies, 0.95) * 1000:7.2f} ms  "
+            f"p99 {percentile(latencies, 0.99) * 1000:7.2f} ms  "
+            f"errors {len(errors)}"
+        )
+        if not errors:
+            self.stdout.write(self.style.SUCCESS(f"{name} run completed."))
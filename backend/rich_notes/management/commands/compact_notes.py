@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from rich_notes.models import Note
+from rich_notes.compaction import compact_note
+from rich_notes.operations import InvalidOperationException
+
+
+class Command(BaseCommand):
+    help = "Compact pending editor operations into the encrypted note snapshots."
+
+    def handle(self, *args, **options):
+        note_ids = Note.objects.filter(operations_pending__gt=0).values_list('id', flat=True)
+        count = 0
+        for note_id in note_ids.iterator():
+            try:
+                compact_note(note_id)
+            except InvalidOperationException as e:
+                self.stderr.write(str(e))
+                continue
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Compacted {count} note(s)."))
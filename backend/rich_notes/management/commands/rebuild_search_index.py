@@ -0,0 +1,24 @@
+import json
+from django.core.management.base import BaseCommand
+from rich_notes.models import Note
+from rich_notes.compaction import read_note_content
+from rich_notes.search import index_note
+from rich_notes.utils import InvalidKeyException
+
+
+class Command(BaseCommand):
+    help = "Build or repair the blind search index for every note."
+
+    def handle(self, *args, **options):
+        count = failed = 0
+        for note in Note.objects.order_by('id').iterator(chunk_size=200):
+            try:
+                content = read_note_content(note)
+                document = json.loads(content) if content else []
+            except (InvalidKeyException, TypeError, ValueError):
+                failed += 1
+                self.stderr.write(f"Cannot read note {note.id}, skipped.")
+                continue
+            index_note(note, document)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} note(s), {failed} failed."))
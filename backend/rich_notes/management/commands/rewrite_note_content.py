@@ -0,0 +1,58 @@
+import json
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rich_notes.models import Note
+from rich_notes.utils import encrypt_note, decrypt_note, is_current_format, InvalidKeyException
+
+
+class Command(BaseCommand):
+    help = "Rewrite note content stored in the legacy format into the compressed format."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--start-after', type=str, default=None,
+                            help="Resume after this note id (printed after every batch).")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = options['start_after']
+        rewritten = skipped = failed = 0
+        before_bytes = after_bytes = 0
+        while True:
+            notes = Note.objects.order_by('id').only('id', 'content', 'updated', 'operations_pending')
+            if last_id is not None:
+                notes = notes.filter(id__gt=last_id)
+            batch = list(notes[:batch_size])
+            if len(batch) == 0:
+                break
+            with transaction.atomic():
+                for note in batch:
+                    content = bytes(note.content)
+                    if len(content) == 0 or is_current_format(content):
+                        skipped += 1
+                        continue
+                    try:
+                        text = decrypt_note(content)
+                    except InvalidKeyException:
+                        text = None
+                    if text is None:
+                        failed += 1
+                        self.stderr.write(f"Cannot decrypt note {note.id}, left as is.")
+                        continue
+                    # decrypt_note gives back the JSON text of the document
+                    new_content = encrypt_note(json.loads(text))
+                    # Skip rows changed since they were read, they are already current
+                    changed = Note.objects.filter(
+                        id=note.id, updated=note.updated, operations_pending=note.operations_pending
+                    ).update(content=new_content)
+                    if changed:
+                        rewritten += 1
+                        before_bytes += len(content)
+                        after_bytes += len(new_content)
+                    else:
+                        skipped += 1
+            last_id = batch[-1].id
+            self.stdout.write(f"Processed up to {last_id} ({rewritten} rewritten, {skipped} skipped, {failed} failed)")
+        self.stdout.write(self.style.SUCCESS(
+            f"Rewrote {rewritten} note(s), {before_bytes} -> {after_bytes} bytes."
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from rich_notes.models import Note
+from rich_notes.revisions import thin_revisions
+
+
+class Command(BaseCommand):
+    help = "Apply the revision retention policy (RICH_NOTES['REVISION_RETENTION']) to every note."
+
+    def handle(self, *args, **options):
+        removed = 0
+        notes = Note.objects.filter(revisions__isnull=False).distinct().only('id')
+        for note in notes.iterator():
+            removed += thin_revisions(note)
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} revision(s)."))
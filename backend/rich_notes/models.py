@@ -8,7 +8,17 @@ class Note(models.Model):
     title = models.CharField(max_length=100, default="Untitled")
     created = models.DateTimeField()
     updated = models.DateTimeField()
+    # Last title change, apart from `updated` so renames keep the note order
+    renamed = models.DateTimeField(null=True)
     content = models.BinaryField()
+    # Number of NoteOperation rows waiting to be compacted into content
+    operations_pending = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a user's notes by (updated, id)
+            models.Index(fields=['user', 'updated', 'id']),
+        ]
 
     def __str__(self):
         return f"id:{self.id}, {self.user}, {self.title}, {self.created}"
@@ -26,4 +36,60 @@ class ShareExternal(models.Model):
     created = models.DateTimeField()
 
     def __str__(self):
-        return f"id:{self.id}, {self.user}, {self.note}, {self.created}, {self.active}"
\ No newline at end of file
+        return f"id:{self.id}, {self.user}, {self.note}, {self.created}, {self.active}"
+
+
+class NoteOperation(models.Model):
+    # Append-only log of editor operations not yet compacted into Note.content
+    id = models.BigAutoField(primary_key=True)
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='operations')
+    operations = models.BinaryField()
+    created = models.DateTimeField()
+
+    def __str__(self):
+        return f"id:{self.id}, {self.note_id}, {self.created}"
+
+
+class NoteSearchToken(models.Model):
+    # Blind index: keyed hashes of the words in a note, never the words
+    FIELD_CHOICES = [
+        ('title', 'Title'),
+        ('content', 'Content'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='search_tokens')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    field = models.CharField(max_length=7, choices=FIELD_CHOICES)
+    token = models.CharField(max_length=32)
+    count = models.IntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'token']),
+            models.Index(fields=['note', 'field']),
+        ]
+
+    def __str__(self):
+        return f"id:{self.id}, {self.note_id}, {self.field}, {self.token}"
+
+
+class NoteRevision(models.Model):
+    # Snapshots hold the full document, others a diff from the previous revision
+    id = models.BigAutoField(primary_key=True)
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='revisions')
+    created = models.DateTimeField()
+    is_snapshot = models.BooleanField(default=False)
+    # Diffs since the last snapshot, bounds the work to rebuild a revision
+    chain = models.IntegerField(default=0)
+    data = models.BinaryField()
+    # Full document of the two newest diffs, saves diff against it
+    document = models.BinaryField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['note', 'id']),
+        ]
+
+    def __str__(self):
+        return f"id:{self.id}, {self.note_id}, {self.created}, {'snapshot' if self.is_snapshot else 'diff'}"
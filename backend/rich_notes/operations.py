@@ -0,0 +1,163 @@
+import copy
+
+
+class InvalidOperationException(Exception):
+    """The editor operation cannot be applied to the document."""
+    pass
+
+
+# Python port of the Slate operation transforms used by the editor.
+# Document is the list of top level nodes, the same shape the editor
+# sends to `update_note_content`.
+# -----------------------------------------------
+def apply_operations(document, operations):
+    root = {'children': copy.deepcopy(document)}
+    try:
+        for op in operations:
+            _apply(root, op)
+    except (KeyError, IndexError, TypeError, ValueError, AttributeError):
+        raise InvalidOperationException
+    return root['children']
+
+
+def _apply(root, op):
+    op_type = op['type']
+    if op_type == 'set_selection':
+        # Selection is client state only
+        return
+    if op_type not in _HANDLERS:
+        raise InvalidOperationException
+    _HANDLERS[op_type](root, op)
+
+
+def _node(root, path):
+    node = root
+    for index in path:
+        if index < 0:
+            raise IndexError
+        node = node['children'][index]
+    return node
+
+
+def _parent(root, path):
+    if len(path) == 0 or path[-1] < 0:
+        raise IndexError
+    return _node(root, path[:-1])
+
+
+def _offset(text, offset):
+    if not 0 <= offset <= len(text):
+        raise IndexError
+    return offset
+
+
+def _ends_before(path, another):
+    i = len(path) - 1
+    return path[:i] == another[:i] and path[i] < another[i]
+
+
+def _insert_text(root, op):
+    node = _node(root, op['path'])
+    text = node['text']
+    offset = _offset(text, op['offset'])
+    node['text'] = text[:offset] + op['text'] + text[offset:]
+
+
+def _remove_text(root, op):
+    node = _node(root, op['path'])
+    text = node['text']
+    offset = _offset(text, op['offset'])
+    end = _offset(text, offset + len(op['text']))
+    node['text'] = text[:offset] + text[end:]
+
+
+def _insert_node(root, op):
+    path = op['path']
+    parent = _parent(root, path)
+    if path[-1] > len(parent['children']):
+        raise IndexError
+    parent['children'].insert(path[-1], copy.deepcopy(op['node']))
+
+
+def _remove_node(root, op):
+    path = op['path']
+    _parent(root, path)['children'].pop(path[-1])
+
+
+def _merge_node(root, op):
+    path = op['path']
+    if path[-1] < 1:
+        raise IndexError
+    node = _node(root, path)
+    prev = _node(root, path[:-1] + [path[-1] - 1])
+    if 'text' in node:
+        prev['text'] += node['text']
+    else:
+        prev['children'].extend(node['children'])
+    _parent(root, path)['children'].pop(path[-1])
+
+
+def _split_node(root, op):
+    path, position = op['path'], op['position']
+    node, parent = _node(root, path), _parent(root, path)
+    position = _offset(node['text'] if 'text' in node else node['children'], position)
+    properties = op.get('properties') or {}
+    if 'text' in node:
+        before, after = node['text'][:position], node['text'][position:]
+        node['text'] = before
+        new_node = {**{k: v for k, v in node.items() if k != 'text'}, **properties, 'text': after}
+    else:
+        before, after = node['children'][:position], node['children'][position:]
+        node['children'] = before
+        new_node = {**{k: v for k, v in node.items() if k != 'children'}, **properties, 'children': after}
+    parent['children'].insert(path[-1] + 1, new_node)
+
+
+def _move_node(root, op):
+    path, new_path = op['path'], op['newPath']
+    if path == new_path:
+        return
+    if new_path[:len(path)] == path:
+        # Cannot move a node into itself
+        raise InvalidOperationException
+    node = _node(root, path)
+    _parent(root, path)['children'].pop(path[-1])
+    # Same as Slate's Path.transform for the moved node
+    true_path = list(new_path)
+    if _ends_before(path, new_path) and len(path) < len(new_path):
+        true_path[len(path) - 1] -= 1
+    new_parent = _parent(root, true_path)
+    if true_path[-1] > len(new_parent['children']):
+        raise IndexError
+    new_parent['children'].insert(true_path[-1], node)
+
+
+def _set_node(root, op):
+    path = op['path']
+    if len(path) == 0:
+        raise InvalidOperationException
+    node = _node(root, path)
+    properties = op.get('properties') or {}
+    new_properties = op.get('newProperties') or {}
+    for key, value in new_properties.items():
+        if key in ('children', 'text'):
+            raise InvalidOperationException
+        if value is None:
+            node.pop(key, None)
+        else:
+            node[key] = value
+    for key in properties:
+        if key not in new_properties and key not in ('children', 'text'):
+            node.pop(key, None)
+
+
+_HANDLERS = {
+    'insert_text': _insert_text,
+    'remove_text': _remove_text,
+    'insert_node': _insert_node,
+    'remove_node': _remove_node,
+    'merge_node': _merge_node,
+    'split_node': _split_node,
+    'move_node': _move_node,
+    'set_node': _set_node,
+}
@@ -0,0 +1,188 @@
+import json
+from datetime import datetime
+from difflib import SequenceMatcher
+import pytz
+from django.db import transaction
+# Models
+from .models import NoteRevision
+from .utils import encrypt_note, decrypt_note, get_setting
+
+
+def max_chain():
+    return get_setting('REVISION_MAX_CHAIN', 20)
+
+
+def min_interval():
+    return get_setting('REVISION_MIN_INTERVAL', 300)
+
+
+# Oldest bucket last: (max age in seconds or None, keep one revision per bucket seconds)
+def retention_policy():
+    return get_setting('REVISION_RETENTION', [
+        (60 * 60 * 24, 0),
+        (60 * 60 * 24 * 7, 60 * 60),
+        (60 * 60 * 24 * 30, 60 * 60 * 24),
+        (None, 60 * 60 * 24 * 7),
+    ])
+
+
+# Diffs between documents
+# -----------------------------------------------
+# Top level nodes are compared as whole lines. A diff is a list of
+# ['=', n] keep n nodes, ['-', n] drop n nodes, ['+', [nodes]] insert.
+def _lines(document):
+    return [json.dumps(node, sort_keys=True) for node in document]
+
+
+def diff_documents(old, new):
+    old_lines, new_lines = _lines(old), _lines(new)
+    diff = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            diff.append(['=', i2 - i1])
+            continue
+        if tag in ('delete', 'replace'):
+            diff.append(['-', i2 - i1])
+        if tag in ('insert', 'replace'):
+            diff.append(['+', new[j1:j2]])
+    return diff
+
+
+def patch_document(old, diff):
+    new, position = [], 0
+    for op, value in diff:
+        if op == '=':
+            new.extend(old[position:position + value])
+            position += value
+        elif op == '-':
+            position += value
+        else:
+            new.extend(value)
+    return new
+
+
+# Reading revisions
+# -----------------------------------------------
+def reconstruct(revision):
+    if revision.is_snapshot:
+        return json.loads(decrypt_note(revision.data))
+    if revision.document is not None:
+        return json.loads(decrypt_note(revision.document))
+    # Nearest snapshot at or before the revision, then its diffs in order
+    snapshot = NoteRevision.objects.filter(
+        note_id=revision.note_id, id__lte=revision.id, is_snapshot=True
+    ).latest('id')
+    document = json.loads(decrypt_note(snapshot.data))
+    chain = NoteRevision.objects.filter(
+        note_id=revision.note_id, id__gt=snapshot.id, id__lte=revision.id
+    ).order_by('id')
+    for row in chain:
+        document = patch_document(document, json.loads(decrypt_note(row.data)))
+    return document
+
+
+def latest_revision(note):
+    return NoteRevision.objects.filter(note=note).order_by('-id').first()
+
+
+# Recording revisions
+# -----------------------------------------------
+# Saves closer than min_interval() apart share a trailing revision: the
+# latest revision, made within the interval of the one before it, is
+# replaced by every such save, so the last saved state always has one.
+# The two newest revisions keep their full document, a save diffs against
+# one of them and never walks the chain (rows written before documents
+# were kept are rebuilt once).
+def record_revision(note, document, force=False):
+    timestamp = datetime.now(pytz.utc)
+    latest = latest_revision(note)
+    if latest is not None and not force and (timestamp - latest.created).total_seconds() < min_interval():
+        previous = NoteRevision.objects.filter(note=note, id__lt=latest.id).order_by('-id').first()
+        if previous is not None and (latest.created - previous.created).total_seconds() < min_interval():
+            return _replace_revision(latest, previous, document, timestamp)
+    if latest is None or latest.chain + 1 > max_chain():
+        revision = NoteRevision.objects.create(
+            note=note, created=timestamp, is_snapshot=True, chain=0, data=encrypt_note(document)
+        )
+    else:
+        diff = diff_documents(reconstruct(latest), document)
+        if all(op == '=' for op, _ in diff):
+            return None
+        revision = NoteRevision.objects.create(
+            note=note, created=timestamp, is_snapshot=False, chain=latest.chain + 1, data=encrypt_note(diff),
+            document=encrypt_note(document)
+        )
+    if latest is not None:
+        NoteRevision.objects.filter(note=note, id__lt=latest.id).exclude(document=None).update(document=None)
+    return revision
+
+
+def _replace_revision(revision, previous, document, timestamp):
+    if revision.is_snapshot:
+        revision.data = encrypt_note(document)
+    else:
+        diff = diff_documents(reconstruct(previous), document)
+        if all(op == '=' for op, _ in diff):
+            # Back to the previous revision's state
+            revision.delete()
+            return None
+        revision.data = encrypt_note(diff)
+        revision.document = encrypt_note(document)
+    revision.created = timestamp
+    revision.save(update_fields=['data', 'document', 'created'])
+    return revision
+
+
+def initial_revisions(notes_with_documents):
+    # First revision of freshly created notes, for bulk inserts
+    return NoteRevision.objects.bulk_create([
+        NoteRevision(note=note, created=note.created, is_snapshot=True, chain=0, data=encrypt_note(document))
+        for note, document in notes_with_documents
+    ])
+
+
+# Retention
+# -----------------------------------------------
+def _bucket(age, created):
+    for tier, (max_age, size) in enumerate(retention_policy()):
+        if max_age is None or age <= max_age:
+            return (tier, int(created.timestamp()) // size) if size else (tier, created)
+    return None
+
+
+def thin_revisions(note, now=None):
+    now = now or datetime.now(pytz.utc)
+    with transaction.atomic():
+        revisions = list(NoteRevision.objects.select_for_update().filter(note=note).order_by('id'))
+        if len(revisions) < 2:
+            return 0
+        # Newest revision of each bucket survives, and always the latest one
+        keep = {}
+        for revision in revisions:
+            keep[_bucket((now - revision.created).total_seconds(), revision.created)] = revision
+        kept_ids = {revision.id for revision in keep.values()} | {revisions[-1].id}
+        if len(kept_ids) == len(revisions):
+            return 0
+        # Rebuild the chain over the survivors
+        document, previous, chain, changed = None, None, 0, []
+        newest = sorted(kept_ids)[-2:]
+        for revision in revisions:
+            document = json.loads(decrypt_note(revision.data)) if revision.is_snapshot \
+                else patch_document(document, json.loads(decrypt_note(revision.data)))
+            if revision.id not in kept_ids:
+                continue
+            if previous is None or chain + 1 > max_chain():
+                revision.is_snapshot, revision.chain = True, 0
+                revision.data = encrypt_note(document)
+                revision.document = None
+            else:
+                revision.is_snapshot, revision.chain = False, chain + 1
+                revision.data = encrypt_note(diff_documents(previous, document))
+                revision.document = encrypt_note(document) if revision.id in newest else None
+            chain = revision.chain
+            previous = document
+            changed.append(revision)
+        NoteRevision.objects.bulk_update(changed, ['is_snapshot', 'chain', 'data', 'document'])
+        removed = [revision.id for revision in revisions if revision.id not in kept_ids]
+        NoteRevision.objects.filter(id__in=removed).delete()
+    return len(removed)
@@ -0,0 +1,146 @@
+import re
+import hmac
+import hashlib
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+# Models
+from .models import Note, NoteSearchToken
+
+WORD_RE = re.compile(r'\w+')
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 64
+
+
+def _index_key():
+    return hashlib.sha256(b'rich_notes.search:' + settings.SECRET_KEY.encode('utf-8')).digest()
+
+
+# Keyed per user so equal words in different accounts do not collide
+def token_hash(user_id, word):
+    message = f"{user_id}:{word}".encode('utf-8')
+    return hmac.new(_index_key(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def tokenize(text):
+    return [
+        word for word in WORD_RE.findall(text.casefold())
+        if MIN_TOKEN_LENGTH <= len(word) <= MAX_TOKEN_LENGTH
+    ]
+
+
+def document_text(document):
+    # Editor documents are nested nodes, text lives in the leaves
+    parts = []
+    stack = list(reversed(document)) if isinstance(document, list) else []
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        if isinstance(node.get('text'), str):
+            parts.append(node['text'])
+        if isinstance(node.get('children'), list):
+            stack.extend(reversed(node['children']))
+    return ' '.join(parts)
+
+
+# Index maintenance
+# -----------------------------------------------
+def _update_field(note, field, words):
+    counts = Counter(token_hash(note.user_id, word) for word in words)
+    existing = {row.token: row for row in NoteSearchToken.objects.filter(note=note, field=field)}
+    removed = [row.id for token, row in existing.items() if token not in counts]
+    added = [
+        NoteSearchToken(note=note, user_id=note.user_id, field=field, token=token, count=count)
+        for token, count in counts.items() if token not in existing
+    ]
+    changed = []
+    for token, row in existing.items():
+        if token in counts and row.count != counts[token]:
+            row.count = counts[token]
+            changed.append(row)
+    if removed:
+        NoteSearchToken.objects.filter(id__in=removed).delete()
+    if added:
+        NoteSearchToken.objects.bulk_create(added)
+    if changed:
+        NoteSearchToken.objects.bulk_update(changed, ['count'])
+
+
+# Batched variants for the bulk endpoint
+def index_new_notes(notes_with_documents):
+    rows = []
+    for note, document in notes_with_documents:
+        for field, words in (('title', tokenize(note.title)), ('content', tokenize(document_text(document)))):
+            counts = Counter(token_hash(note.user_id, word) for word in words)
+            rows.extend(
+                NoteSearchToken(note=note, user_id=note.user_id, field=field, token=token, count=count)
+                for token, count in counts.items()
+            )
+    NoteSearchToken.objects.bulk_create(rows, batch_size=1000)
+
+
+def index_note_titles(notes):
+    if len(notes) == 0:
+        return
+    existing = {}
+    for row in NoteSearchToken.objects.filter(note__in=notes, field='title'):
+        existing.setdefault(row.note_id, {})[row.token] = row
+    removed, added, changed = [], [], []
+    for note in notes:
+        counts = Counter(token_hash(note.user_id, word) for word in tokenize(note.title))
+        rows = existing.get(note.id, {})
+        removed.extend(row.id for token, row in rows.items() if token not in counts)
+        for token, count in counts.items():
+            if token not in rows:
+                added.append(NoteSearchToken(note=note, user_id=note.user_id, field='title', token=token, count=count))
+            elif rows[token].count != count:
+                rows[token].count = count
+                changed.append(rows[token])
+    if removed:
+        NoteSearchToken.objects.filter(id__in=removed).delete()
+    if added:
+        NoteSearchToken.objects.bulk_create(added)
+    if changed:
+        NoteSearchToken.objects.bulk_update(changed, ['count'])
+
+
+def index_note_title(note):
+    with transaction.atomic():
+        _update_field(note, 'title', tokenize(note.title))
+
+
+def index_note_content(note, document):
+    with transaction.atomic():
+        _update_field(note, 'content', tokenize(document_text(document)))
+
+
+def index_note(note, document):
+    with transaction.atomic():
+        _update_field(note, 'title', tokenize(note.title))
+        _update_field(note, 'content', tokenize(document_text(document)))
+
+
+# Query
+# -----------------------------------------------
+def search_notes(user, query, limit=20):
+    words = set(tokenize(query))
+    if len(words) == 0:
+        return []
+    tokens = [token_hash(user.id, word) for word in words]
+    rows = NoteSearchToken.objects.filter(user=user, token__in=tokens).values('note_id').annotate(
+        matched=Count('token', distinct=True),
+        hits=Sum('count'),
+    ).order_by('-matched', '-hits')[:limit]
+    rows = list(rows)
+    titles = dict(Note.objects.filter(id__in=[row['note_id'] for row in rows]).values_list('id', 'title'))
+    return [
+        dict(
+            id=row['note_id'],
+            title=titles.get(row['note_id']),
+            matched=row['matched'],
+            score=row['hits'],
+        )
+        for row in rows if row['note_id'] in titles
+    ]
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from core.rows import RowMapper
 from .models import Note, ShareExternal
 
 
@@ -12,3 +13,8 @@ class ShareExternalSerializer(serializers.ModelSerializer):
     class Meta:
         model = ShareExternal
         fields = ['id', 'title', 'created', 'anonymous', 'active']
+
+
+# Same output as the serializers above, from .values() rows
+NOTE_ROWS = RowMapper(NoteListSerializer)
+SHARE_LINK_ROWS = RowMapper(ShareExternalSerializer)
@@ -0,0 +1,276 @@
+import json
+import uuid
+from datetime import datetime, timedelta
+from unittest import mock, skipIf, skipUnless
+import pytz
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.utils.http import http_date
+from django_axor_auth.security.encryption import encrypt
+from django_axor_auth.users.models import User
+from django_axor_auth.users.users_app_tokens.models import AppToken
+
+from . import revisions, views
+from .models import Note, NoteRevision
+from .operations import apply_operations, InvalidOperationException
+from .revisions import record_revision, reconstruct, thin_revisions
+from .utils import encrypt_note, decrypt_note, is_current_format, zstandard, FORMAT_ZLIB, FORMAT_ZSTD, CONTENT_MAGIC, \
+    version_stamp, make_etag, validator_headers, is_not_modified, InvalidKeyException
+
+
+def paragraph(*texts):
+    return {'type': 'paragraph', 'children': [{'text': text} for text in texts]}
+
+
+class ApplyOperationsTests(SimpleTestCase):
+    def test_insert_and_remove_text(self):
+        document = [paragraph('Hello world')]
+        document = apply_operations(document, [
+            {'type': 'insert_text', 'path': [0, 0], 'offset': 5, 'text': ','},
+            {'type': 'remove_text', 'path': [0, 0], 'offset': 6, 'text': ' world'},
+        ])
+        self.assertEqual(document, [paragraph('Hello,')])
+
+    def test_input_is_not_changed(self):
+        document = [paragraph('a')]
+        apply_operations(document, [{'type': 'insert_text', 'path': [0, 0], 'offset': 1, 'text': 'b'}])
+        self.assertEqual(document, [paragraph('a')])
+
+    def test_insert_and_remove_node(self):
+        document = apply_operations([paragraph('a')], [
+            {'type': 'insert_node', 'path': [1], 'node': paragraph('b')},
+            {'type': 'insert_node', 'path': [0], 'node': paragraph('c')},
+            {'type': 'remove_node', 'path': [1], 'node': paragraph('a')},
+        ])
+        self.assertEqual(document, [paragraph('c'), paragraph('b')])
+
+    def test_split_and_merge_text(self):
+        document = [paragraph('Hello')]
+        split = apply_operations(document, [
+            {'type': 'split_node', 'path': [0, 0], 'position': 2, 'properties': {}},
+            {'type': 'split_node', 'path': [0], 'position': 1, 'properties': {'type': 'heading'}},
+        ])
+        self.assertEqual(split, [paragraph('He'), {'type': 'heading', 'children': [{'text': 'llo'}]}])
+        merged = apply_operations(split, [
+            {'type': 'merge_node', 'path': [1], 'position': 1, 'properties': {}},
+            {'type': 'merge_node', 'path': [0, 1], 'position': 2, 'properties': {}},
+        ])
+        self.assertEqual(merged, document)
+
+    def test_split_keeps_marks(self):
+        document = [{'type': 'paragraph', 'children': [{'text': 'bold', 'bold': True}]}]
+        document = apply_operations(document, [{'type': 'split_node', 'path': [0, 0], 'position': 2}])
+        self.assertEqual(document[0]['children'], [{'text': 'bo', 'bold': True}, {'text': 'ld', 'bold': True}])
+
+    def test_move_node(self):
+        document = [paragraph('a'), paragraph('b'), paragraph('c')]
+        self.assertEqual(
+            apply_operations(document, [{'type': 'move_node', 'path': [0], 'newPath': [2]}]),
+            [paragraph('b'), paragraph('c'), paragraph('a')]
+        )
+        self.assertEqual(
+            apply_operations(document, [{'type': 'move_node', 'path': [2], 'newPath': [0]}]),
+            [paragraph('c'), paragraph('a'), paragraph('b')]
+        )
+
+    def test_move_node_into_later_sibling(self):
+        # The target path is given before the node is taken out
+        document = [paragraph('a'), paragraph('b')]
+        document = apply_operations(document, [{'type': 'move_node', 'path': [0, 0], 'newPath': [1, 1]}])
+        self.assertEqual(document, [{'type': 'paragraph', 'children': []}, paragraph('b', 'a')])
+
+    def test_set_node(self):
+        document = [{'type': 'paragraph', 'align': 'left', 'children': [{'text': 'a'}]}]
+        document = apply_operations(document, [{
+            'type': 'set_node', 'path': [0],
+            'properties': {'type': 'paragraph', 'align': 'left'}, 'newProperties': {'type': 'heading'},
+        }])
+        self.assertEqual(document, [{'type': 'heading', 'children': [{'text': 'a'}]}])
+
+    def test_set_selection_is_ignored(self):
+        document = [paragraph('a')]
+        self.assertEqual(apply_operations(document, [{'type': 'set_selection', 'properties': {}}]), document)
+
+    def test_invalid_operations(self):
+        document = [paragraph('a'), paragraph('b')]
+        invalid = [
+            {'type': 'unknown', 'path': [0]},
+            {'type': 'insert_text', 'path': [5, 0], 'offset': 0, 'text': 'x'},
+            {'type': 'insert_text', 'path': [-1, 0], 'offset': 0, 'text': 'x'},
+            {'type': 'insert_text', 'path': [0, 0], 'offset': -1, 'text': 'x'},
+            {'type': 'insert_text', 'path': [0, 0], 'offset': 2, 'text': 'x'},
+            {'type': 'remove_text', 'path': [0, 0], 'offset': -1, 'text': 'a'},
+            {'type': 'remove_text', 'path': [0, 0], 'offset': 0, 'text': 'ab'},
+            {'type': 'insert_node', 'path': [3], 'node': paragraph('x')},
+            {'type': 'insert_node', 'path': [-1], 'node': paragraph('x')},
+            {'type': 'remove_node', 'path': []},
+            {'type': 'remove_node', 'path': [-1]},
+            {'type': 'split_node', 'path': [0, 0], 'position': -1},
+            {'type': 'split_node', 'path': [0], 'position': 2},
+            {'type': 'move_node', 'path': [0], 'newPath': [-1]},
+            {'type': 'merge_node', 'path': [0]},
+            {'type': 'move_node', 'path': [0], 'newPath': [0, 1]},
+            {'type': 'set_node', 'path': [], 'newProperties': {'type': 'x'}},
+            {'type': 'set_node', 'path': [0], 'newProperties': {'children': []}},
+            {'path': [0]},
+            'insert_text',
+        ]
+        for op in invalid:
+            with self.subTest(op=op), self.assertRaises(InvalidOperationException):
+                apply_operations(document, [op])
+
+
+class ContentEnvelopeTests(SimpleTestCase):
+    document = [paragraph('Groceries'), paragraph('Milk, eggs ' * 200)]
+
+    def test_round_trip(self):
+        blob = encrypt_note(self.document)
+        self.assertTrue(is_current_format(blob))
+        self.assertEqual(blob[len(CONTENT_MAGIC)], FORMAT_ZLIB)
+        self.assertEqual(json.loads(decrypt_note(blob)), self.document)
+
+    def test_round_trip_from_database_buffer(self):
+        self.assertEqual(json.loads(decrypt_note(memoryview(encrypt_note(self.document)))), self.document)
+
+    def test_compressed(self):
+        self.assertLess(len(encrypt_note(self.document)), len(json.dumps(self.document)) // 4)
+
+    def test_legacy_rows(self):
+        blob = encrypt(json.dumps(self.document))
+        self.assertFalse(is_current_format(blob))
+        self.assertEqual(json.loads(decrypt_note(blob)), self.document)
+
+    def test_tampered_legacy_rows(self):
+        blob = bytearray(encrypt(json.dumps(self.document)))
+        blob[-1] ^= 1
+        with self.assertRaises(InvalidKeyException):
+            decrypt_note(blob)
+
+    @skipUnless(zstandard, "zstandard is not installed")
+    @override_settings(RICH_NOTES={'CONTENT_COMPRESSION': 'zstd'})
+    def test_zstd_round_trip(self):
+        blob = encrypt_note(self.document)
+        self.assertEqual(blob[len(CONTENT_MAGIC)], FORMAT_ZSTD)
+        self.assertEqual(json.loads(decrypt_note(blob)), self.document)
+
+    @skipIf(zstandard, "zstandard is installed")
+    @override_settings(RICH_NOTES={'CONTENT_COMPRESSION': 'zstd'})
+    def test_zstd_falls_back_to_zlib(self):
+        blob = encrypt_note(self.document)
+        self.assertEqual(blob[len(CONTENT_MAGIC)], FORMAT_ZLIB)
+        self.assertEqual(json.loads(decrypt_note(blob)), self.document)
+
+
+class ConditionalRequestTests(SimpleTestCase):
+    updated = datetime(2024, 3, 1, 12, 30, 15, 250000, tzinfo=pytz.utc)
+
+    def request(self, **headers):
+        return RequestFactory().get('/', headers=headers)
+
+    def test_version_stamp(self):
+        self.assertEqual(version_stamp(None), 0)
+        self.assertEqual(version_stamp(self.updated), 1709296215250000)
+        self.assertNotEqual(version_stamp(self.updated), version_stamp(self.updated.replace(microsecond=250001)))
+
+    def test_round_trip(self):
+        etag = make_etag('note', version_stamp(self.updated))
+        headers = validator_headers(etag, self.updated)
+        self.assertEqual(headers['ETag'], '"note-1709296215250000"')
+        self.assertTrue(is_not_modified(self.request(**{'If-None-Match': headers['ETag']}), etag, self.updated))
+        self.assertTrue(is_not_modified(
+            self.request(**{'If-Modified-Since': headers['Last-Modified']}), etag, self.updated
+        ))
+
+    def test_if_none_match(self):
+        etag = make_etag('note', 1)
+        self.assertTrue(is_not_modified(self.request(**{'If-None-Match': 'W/' + etag}), etag))
+        self.assertTrue(is_not_modified(self.request(**{'If-None-Match': '"other", ' + etag}), etag))
+        self.assertTrue(is_not_modified(self.request(**{'If-None-Match': '*'}), etag))
+        self.assertFalse(is_not_modified(self.request(**{'If-None-Match': make_etag('note', 2)}), etag))
+        self.assertFalse(is_not_modified(self.request(), etag, self.updated))
+
+    def test_if_modified_since(self):
+        etag = make_etag('note', 1)
+        since = http_date(self.updated.timestamp())
+        earlier = http_date(self.updated.timestamp() - 1)
+        self.assertTrue(is_not_modified(self.request(**{'If-Modified-Since': since}), etag, self.updated))
+        self.assertFalse(is_not_modified(self.request(**{'If-Modified-Since': earlier}), etag, self.updated))
+        self.assertFalse(is_not_modified(self.request(**{'If-Modified-Since': 'garbage'}), etag, self.updated))
+        # Ignored when If-None-Match is sent
+        self.assertFalse(is_not_modified(
+            self.request(**{'If-Modified-Since': since, 'If-None-Match': make_etag('note', 2)}), etag, self.updated
+        ))
+
+
+class RenameTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='Pass1234!x', first_name='T',
+                                             last_name='U')
+        self.updated = datetime(2024, 3, 1, tzinfo=pytz.utc)
+        self.note = Note.objects.create(id=uuid.uuid4(), user=self.user, created=self.updated, updated=self.updated,
+                                        content=encrypt_note([paragraph('a')]))
+
+    def call(self, view, method, *args, data=None):
+        # Calls the view as the holder of an app token of the user
+        request = getattr(RequestFactory(), method)('/', data, content_type='application/json',
+                                                    headers={'X-Requested-By': 'mobile', 'User-Agent': 'tests'})
+        request.active_token = AppToken.objects.create_app_token(self.user, request)[1]
+        request.active_session, request.requested_by = None, 'mobile'
+        return view(request, *args)
+
+    def test_rename_changes_validators_not_updated(self):
+        before = (self.call(views.get_notes, 'get')['ETag'], self.call(views.note_ops, 'get', self.note.id)['ETag'])
+        response = self.call(views.update_note_title, 'put', self.note.id, data={'title': 'Renamed'})
+        self.assertEqual(response.status_code, 204)
+        self.note.refresh_from_db()
+        self.assertEqual((self.note.title, self.note.updated), ('Renamed', self.updated))
+        notes = self.call(views.get_notes, 'get')
+        note = self.call(views.note_ops, 'get', self.note.id)
+        self.assertNotEqual(notes['ETag'], before[0])
+        self.assertNotEqual(note['ETag'], before[1])
+        self.assertEqual(note['Last-Modified'], http_date(self.note.renamed.timestamp()))
+
+
+@override_settings(RICH_NOTES={'REVISION_MIN_INTERVAL': 0, 'REVISION_MAX_CHAIN': 3})
+class RevisionTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='user@example.com', password='Pass1234!x', first_name='T', last_name='U')
+        now = datetime.now(pytz.utc)
+        self.note = Note.objects.create(id=uuid.uuid4(), user=user, created=now, updated=now,
+                                        content=encrypt_note([]))
+        self.documents = [[paragraph(*'abcdefgh'[:i + 1])] for i in range(8)]
+
+    def test_chain_reconstructs_every_revision(self):
+        for document in self.documents:
+            record_revision(self.note, document)
+        rows = list(NoteRevision.objects.filter(note=self.note).order_by('id'))
+        self.assertEqual([row.is_snapshot for row in rows], [True, False, False, False] * 2)
+        self.assertEqual([reconstruct(row) for row in rows], self.documents)
+        # Only the two newest diffs keep their document
+        self.assertEqual([row.document is not None for row in rows], [False] * 6 + [True] * 2)
+
+    def test_save_does_not_walk_the_chain(self):
+        for document in self.documents[:3]:
+            record_revision(self.note, document)
+        with mock.patch.object(revisions, 'decrypt_note', wraps=revisions.decrypt_note) as decrypt:
+            record_revision(self.note, self.documents[3])
+        self.assertEqual(decrypt.call_count, 1)
+
+    def test_thinning_keeps_documents_of_the_newest(self):
+        for document in self.documents:
+            record_revision(self.note, document)
+        # Three days old, three to an hour, the newest of each hour is kept
+        base = datetime(2024, 1, 1, tzinfo=pytz.utc)
+        for i, row in enumerate(NoteRevision.objects.filter(note=self.note).order_by('id')):
+            NoteRevision.objects.filter(id=row.id).update(created=base + timedelta(hours=i // 3, minutes=i))
+        self.assertEqual(thin_revisions(self.note, now=base + timedelta(days=3)), 5)
+        rows = list(NoteRevision.objects.filter(note=self.note).order_by('id'))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(reconstruct(rows[-1]), self.documents[-1])
+        for row in rows:
+            # Rebuilt from the chain, the stored document agrees with it
+            document = row.document
+            row.document = None
+            expected = reconstruct(row)
+            if document is not None:
+                self.assertEqual(json.loads(decrypt_note(document)), expected)
+        self.assertTrue(all(row.document is None for row in rows[:-2]))
@@ -1,13 +1,25 @@
+from django.conf import settings
 from django.urls import path
-from . import views
-
-urlpatterns = [
-    path('all/', views.get_notes),
-    path('create/', views.create_note),
-    path('<note_id>/', views.note_ops),
-    path('share/<note_id>/', views.create_note_share_link),
-    path('share/links/disable/', views.disable_note_share_link),
-    path('share/links/<note_id>/', views.get_note_share_links),
-    path('shared/<perm_key>/', views.read_note_via_share_link),
-    path('<note_id>/edit/title/', views.update_note_title),
-]
+from . import views, async_views
+
+
+def get_urlpatterns(use_async=False):
+    # Hot endpoints have native async versions for ASGI deployments
+    hot = async_views if use_async else views
+    return [
+        path('all/', hot.get_notes),
+        path('create/', views.create_note),
+        path('search/', views.search),
+        path('bulk/', views.bulk_notes),
+        path('<note_id>/', hot.note_ops),
+        path('<note_id>/revisions/', views.get_note_revisions),
+        path('<note_id>/revisions/<int:revision_id>/', views.read_note_revision),
+        path('share/<note_id>/', views.create_note_share_link),
+        path('share/links/disable/', views.disable_note_share_link),
+        path('share/links/<note_id>/', views.get_note_share_links),
+        path('shared/<perm_key>/', hot.read_note_via_share_link),
+        path('<note_id>/edit/title/', views.update_note_title),
+    ]
+
+
+urlpatterns = get_urlpatterns(settings.ASYNC_VIEWS)
@@ -1,5 +1,17 @@
 import json
-from django_axor_auth.security.encryption import encrypt, decrypt
+import zlib
+import base64
+from Crypto.Cipher import AES
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django_axor_auth.security.encryption import decrypt, key_as_bytes
+from core.timing import timed
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 # define Python user-defined exceptions
@@ -8,12 +20,139 @@ class InvalidKeyException(Exception):
     pass
 
 
+# Settings for this app live in settings.RICH_NOTES
+def get_setting(name, default=None):
+    return getattr(settings, 'RICH_NOTES', {}).get(name, default)
+
+
+# Stored content format
+# -----------------------------------------------
+# Legacy rows are `nonce | tag | ciphertext` of the double JSON encoded
+# document as written by django_axor_auth's `encrypt`.
+# Current rows are `MAGIC | format | nonce | tag | ciphertext` where the
+# plaintext is the compressed JSON document.
+CONTENT_MAGIC = b'\x00RN'
+FORMAT_ZLIB = 1
+FORMAT_ZSTD = 2
+
+
+def _compress(data, fmt):
+    if fmt == FORMAT_ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+
+def _decompress(data, fmt):
+    if fmt == FORMAT_ZSTD:
+        if zstandard is None:
+            raise InvalidKeyException
+        return zstandard.ZstdDecompressor().decompress(data)
+    if fmt == FORMAT_ZLIB:
+        return zlib.decompress(data)
+    raise InvalidKeyException
+
+
+def content_format():
+    if get_setting('CONTENT_COMPRESSION', 'zlib') == 'zstd' and zstandard is not None:
+        return FORMAT_ZSTD
+    return FORMAT_ZLIB
+
+
+def is_current_format(blob):
+    return bytes(blob[:len(CONTENT_MAGIC)]) == CONTENT_MAGIC
+
+
 def encrypt_note(note):
-    return encrypt(json.dumps(note))
+    fmt = content_format()
+    with timed('crypto'):
+        cipher = AES.new(key_as_bytes(), AES.MODE_EAX)
+        ciphertext, tag = cipher.encrypt_and_digest(_compress(json.dumps(note).encode('utf-8'), fmt))
+    return b''.join((CONTENT_MAGIC, bytes([fmt]), cipher.nonce, tag, ciphertext))
 
 
+def _decrypt_current(blob):
+    offset = len(CONTENT_MAGIC)
+    fmt = blob[offset]
+    nonce, tag, ciphertext = blob[offset + 1:offset + 17], blob[offset + 17:offset + 33], blob[offset + 33:]
+    cipher = AES.new(key_as_bytes(), AES.MODE_EAX, nonce)
+    data = cipher.decrypt_and_verify(ciphertext, tag)
+    return _decompress(data, fmt).decode('utf-8')
+
+
+@timed('crypto')
 def decrypt_note(note):
+    blob = bytes(note)
+    if is_current_format(blob):
+        try:
+            return _decrypt_current(blob)
+        except (ValueError, IndexError, zlib.error):
+            # A legacy nonce can start with the magic bytes by chance
+            pass
     try:
-        return decrypt(note)
+        content = decrypt(blob)
     except:
         raise InvalidKeyException
+    # Legacy rows that fail the tag check come back as None
+    if content is None:
+        raise InvalidKeyException
+    return content
+
+
+# Conditional requests
+# -----------------------------------------------
+def version_stamp(timestamp):
+    if timestamp is None:
+        return 0
+    return int(timestamp.timestamp()) * 1000000 + timestamp.microsecond
+
+
+def last_changed(*timestamps):
+    timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+    return max(timestamps) if timestamps else None
+
+
+def make_etag(*parts):
+    return '"' + '-'.join(str(part) for part in parts) + '"'
+
+
+def validator_headers(etag, last_modified=None):
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified.timestamp())
+    return headers
+
+
+def is_not_modified(request, etag, last_modified=None):
+    # If-Modified-Since is only looked at when If-None-Match is absent
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        etags = [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+        return '*' in etags or etag in etags
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    if if_modified_since is not None and last_modified is not None:
+        return int(last_modified.timestamp()) <= if_modified_since
+    return False
+
+
+# Keyset pagination cursors
+# -----------------------------------------------
+class InvalidCursorException(Exception):
+    """The pagination cursor cannot be decoded."""
+    pass
+
+
+def encode_cursor(updated, note_id):
+    raw = f"{updated.isoformat()}|{note_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        updated, note_id = raw.split('|', 1)
+        updated = parse_datetime(updated)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursorException
+    if updated is None:
+        raise InvalidCursorException
+    return updated, note_id
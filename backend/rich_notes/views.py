@@ -4,6 +4,10 @@ import uuid
 import random
 import string
 from datetime import datetime
+from django.db import transaction
+from django.db.models import F, Q, Max, Count
+from django.core.exceptions import ValidationError
+from django.utils.dateparse import parse_datetime
 # RestFramework
 from rest_framework import status
 from rest_framework.response import Response
@@ -14,9 +18,18 @@ from django_axor_auth.users.permissions import IsAuthenticated
 from django_axor_auth.security.hashing import hash_this
 from django_axor_auth.utils.error_handling.error_message import ErrorMessage
 # Models & Serializers
-from .models import Note, ShareExternal
-from .serializers import NoteListSerializer, ShareExternalSerializer
+from .models import Note, NoteOperation, NoteRevision, ShareExternal
+from .serializers import NoteListSerializer, NOTE_ROWS, SHARE_LINK_ROWS
 from .utils import encrypt_note, decrypt_note, InvalidKeyException
+from .utils import version_stamp, last_changed, make_etag, validator_headers, is_not_modified
+from .utils import get_setting, encode_cursor, decode_cursor, InvalidCursorException
+from .cache import content_cache, share_link_cache
+from .search import index_note, index_note_content, index_note_title, search_notes
+from .search import index_new_notes, index_note_titles
+from .revisions import record_revision, initial_revisions, reconstruct
+from .compaction import read_note_content, schedule_compaction, compact_threshold, load_operations
+from .compaction import current_document
+from .operations import apply_operations, InvalidOperationException
 
 
 # Create a note
@@ -35,7 +48,8 @@ def create_note(request):
             created=timestamp,
             updated=timestamp
         )
-        note.save()
+        index_note(note, request.data['content'])
+        record_revision(note, request.data['content'], force=True)
         return Response(
             data = {"content": json.dumps(request.data['content']), **NoteListSerializer(note).data},
             status=status.HTTP_201_CREATED
@@ -52,15 +66,30 @@ def create_note(request):
 
 # Get all notes
 # -----------------------------------------------
+NOTE_LIST_FIELDS = NoteListSerializer.Meta.fields
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_notes(request):
+    fields = request.query_params.get('fields')
+    fields = [f for f in fields.split(',') if f in NOTE_LIST_FIELDS] if fields else NOTE_LIST_FIELDS
+    if 'limit' in request.query_params or 'cursor' in request.query_params:
+        return get_notes_page(request, fields)
     try:
-        notes = NoteListSerializer(
-            Note.objects.filter(user=get_request_user(request)).order_by('updated'),
-            many=True
-        )
-        return Response(data={"notes": notes.data}, status=status.HTTP_200_OK)
+        notes = Note.objects.filter(user=get_request_user(request))
+        # Any create, update, rename or delete moves the latest update, the latest rename or the count
+        version = notes.aggregate(latest=Max('updated'), renamed=Max('renamed'), count=Count('id'))
+        etag = make_etag('notes', version['count'], version_stamp(version['latest']),
+                         version_stamp(version['renamed']), *fields)
+        last_modified = last_changed(version['latest'], version['renamed'])
+        headers = validator_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        notes = NOTE_ROWS(notes.order_by('updated').values(*NOTE_ROWS.sources))
+        if fields != NOTE_LIST_FIELDS:
+            notes = [{f: note[f] for f in fields} for note in notes]
+        return Response(data={"notes": notes}, status=status.HTTP_200_OK, headers=headers)
     except Note.DoesNotExist:
         return ErrorMessage(
             title="Notes not found",
@@ -71,15 +100,69 @@ def get_notes(request):
         ).to_response()
 
 
+# Newest first, one page at a time, keyed on (updated, id)
+def get_notes_page(request, fields):
+    try:
+        limit = int(request.query_params.get('limit', get_setting('NOTES_PAGE_SIZE', 50)))
+        limit = min(max(limit, 1), get_setting('NOTES_MAX_PAGE_SIZE', 200))
+        notes = Note.objects.filter(user=get_request_user(request))
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            updated, note_id = decode_cursor(cursor)
+            notes = notes.filter(Q(updated__lt=updated) | Q(updated=updated, id__lt=note_id))
+        page = list(notes.order_by('-updated', '-id').values(*NOTE_ROWS.sources)[:limit + 1])
+    except (ValueError, ValidationError, InvalidCursorException):
+        return ErrorMessage(
+            title="Invalid page",
+            status=status.HTTP_400_BAD_REQUEST,
+            instance=request.build_absolute_uri(),
+            code="N0415",
+            detail="The page size or cursor is not valid."
+        ).to_response()
+    has_more = len(page) > limit
+    page = page[:limit]
+    data = NOTE_ROWS(page)
+    if fields != NOTE_LIST_FIELDS:
+        data = [{f: note[f] for f in fields} for note in data]
+    return Response(data={
+        "notes": data,
+        "next": encode_cursor(page[-1]['updated'], page[-1]['id']) if has_more else None,
+    }, status=status.HTTP_200_OK)
+
+
+# Search notes through the blind token index
+# -----------------------------------------------
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search(request):
+    query = request.query_params.get('q', '')
+    try:
+        limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+    except ValueError:
+        limit = 20
+    if len(query.strip()) == 0:
+        return ErrorMessage(
+            title="Invalid search",
+            status=status.HTTP_400_BAD_REQUEST,
+            instance=request.build_absolute_uri(),
+            code="N0414",
+            detail="Provide the words to search for."
+        ).to_response()
+    results = search_notes(get_request_user(request), query, limit)
+    return Response(data={"notes": results}, status=status.HTTP_200_OK)
+
+
 # Read, update, delete a note
 # -----------------------------------------------
-@api_view(['GET', 'DELETE', 'PUT', 'POST'])
+@api_view(['GET', 'DELETE', 'PUT', 'PATCH', 'POST'])
 @permission_classes([IsAuthenticated])
 def note_ops(request, note_id):
     if request.method == 'GET':
         return read_note(request, note_id)
     elif request.method == 'PUT':
         return update_note_content(request, note_id)
+    elif request.method == 'PATCH':
+        return patch_note_content(request, note_id)
     elif request.method == 'DELETE':
         return delete_note(request, note_id)
     return ErrorMessage(
@@ -93,15 +176,25 @@ def note_ops(request, note_id):
 # Read
 def read_note(request, note_id):
     try:
-        note = Note.objects.get(id=note_id, user=get_request_user(request))
-        # Decrypt the note
-        if note.content:
-            content = decrypt_note(note.content)
-        else:
-            content = ""
+        # Content is loaded only if the client copy is stale
+        note = Note.objects.defer('content').get(id=note_id, user=get_request_user(request))
+        with_ops = request.query_params.get('ops') == '1'
+        etag = make_etag(note.id, version_stamp(note.updated), version_stamp(note.renamed),
+                         'ops' if with_ops else 'doc')
+        last_modified = last_changed(note.updated, note.renamed)
+        headers = validator_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
         data = NoteListSerializer(note).data
-        data['content'] = content
-        return Response(data=data, status=status.HTTP_200_OK)
+        if with_ops:
+            # Snapshot plus the operations not yet compacted into it
+            data['content'] = decrypt_note(note.content) if note.content else ""
+            data['operations'] = [
+                op for row in note.operations.order_by('id') for op in load_operations(row)
+            ]
+        else:
+            data['content'] = read_note_content(note)
+        return Response(data=data, status=status.HTTP_200_OK, headers=headers)
     except Note.DoesNotExist:
         return ErrorMessage(
             title="No note found",
@@ -110,7 +203,7 @@ def read_note(request, note_id):
             code="N0404",
             detail="This note does not exist."
         ).to_response()
-    except InvalidKeyException:
+    except (InvalidKeyException, InvalidOperationException):
         return ErrorMessage(
             title="Failed reading note",
             status=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -122,7 +215,10 @@ def read_note(request, note_id):
 # Delete
 def delete_note(request, note_id):
     try:
-        Note.objects.get(id=note_id, user=get_request_user(request)).delete()
+        note = Note.objects.get(id=note_id, user=get_request_user(request))
+        content_cache.invalidate(note.id)
+        share_link_cache.invalidate_note(note.id)
+        note.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
     except Note.DoesNotExist:
         return ErrorMessage(
@@ -137,10 +233,8 @@ def delete_note(request, note_id):
 # Update
 def update_note_content(request, note_id):
     try:
-        note = Note.objects.get(id=note_id, user=get_request_user(request))
-        note.content = encrypt_note(request.data['content'])
-        note.updated = datetime.now(pytz.utc)
-        note.save()
+        note = Note.objects.defer('content').get(id=note_id, user=get_request_user(request))
+        store_note_content(note, request.data['content'], encrypt_note(request.data['content']))
 
         data = NoteListSerializer(note).data
         # We send json string of the content
@@ -157,6 +251,97 @@ def update_note_content(request, note_id):
         ).to_response()
 
 
+# Shared by the sync and async update views, `encrypted` is the
+# already encrypted document
+def store_note_content(note, document, encrypted):
+    note.content = encrypted
+    note.updated = datetime.now(pytz.utc)
+    note.operations_pending = 0
+    with transaction.atomic():
+        # Full content replaces anything still waiting in the operation log
+        note.operations.all().delete()
+        note.save()
+        index_note_content(note, document)
+        record_revision(note, document)
+    content_cache.invalidate(note.id)
+    share_link_cache.invalidate_note(note.id)
+
+
+# Patch with editor operations made on top of the `base` version
+def patch_note_content(request, note_id):
+    try:
+        note = Note.objects.get(id=note_id, user=get_request_user(request))
+    except Note.DoesNotExist:
+        return ErrorMessage(
+            title="No note found",
+            status=status.HTTP_404_NOT_FOUND,
+            instance=request.build_absolute_uri(),
+            code="N0405",
+            detail="This note does not exist."
+        ).to_response()
+    base = parse_datetime(str(request.data.get('base', '')))
+    operations = request.data.get('ops')
+    if base is None or not isinstance(operations, list) or not all(
+            isinstance(op, dict) and isinstance(op.get('type'), str) for op in operations):
+        return ErrorMessage(
+            title="Invalid operations",
+            status=status.HTTP_400_BAD_REQUEST,
+            instance=request.build_absolute_uri(),
+            code="N0413",
+            detail="Provide the base version and a list of editor operations."
+        ).to_response()
+    document = None
+    if note.updated == base:
+        # Checked against the version it was made on, other bases get a 409
+        try:
+            document = current_document(note)
+        except (InvalidKeyException, InvalidOperationException):
+            return ErrorMessage(
+                title="Failed patching note",
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                instance=request.build_absolute_uri(),
+                code="N0551",
+                detail="This note cannot be patched, its pending changes cannot be applied."
+            ).to_response()
+        try:
+            document = apply_operations(document, operations)
+        except InvalidOperationException:
+            return ErrorMessage(
+                title="Invalid operations",
+                status=status.HTTP_400_BAD_REQUEST,
+                instance=request.build_absolute_uri(),
+                code="N0419",
+                detail="The operations cannot be applied to this version of the note."
+            ).to_response()
+    timestamp = datetime.now(pytz.utc)
+    with transaction.atomic():
+        # Only move forward if nobody saved since the client's base version
+        updated = Note.objects.filter(id=note.id, updated=base).update(
+            updated=timestamp,
+            operations_pending=F('operations_pending') + 1
+        )
+        if updated == 0:
+            return ErrorMessage(
+                title="Note has changed",
+                status=status.HTTP_409_CONFLICT,
+                instance=request.build_absolute_uri(),
+                code="N0409",
+                detail="This note was updated elsewhere. Reload it before saving."
+            ).to_response()
+        NoteOperation.objects.create(
+            note=note,
+            operations=encrypt_note(operations),
+            created=timestamp
+        )
+    # The next patch is checked against this document without decrypting
+    content_cache.set(note.id, timestamp, json.dumps(document))
+    share_link_cache.invalidate_note(note.id)
+    if note.operations_pending + 1 >= compact_threshold():
+        transaction.on_commit(lambda: schedule_compaction(note.id))
+    note.updated = timestamp
+    return Response(data=NoteListSerializer(note).data, status=status.HTTP_200_OK)
+
+
 # Update
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
@@ -164,7 +349,11 @@ def update_note_title(request, note_id):
     try:
         note = Note.objects.get(id=note_id, user=get_request_user(request))
         note.title = request.data['title']
-        note.save()
+        # Moves the validators but not `updated`, the base of the next PATCH
+        note.renamed = datetime.now(pytz.utc)
+        note.save(update_fields=['title', 'renamed'])
+        index_note_title(note)
+        share_link_cache.invalidate_note(note.id)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
     except Note.DoesNotExist:
@@ -177,6 +366,140 @@ def update_note_title(request, note_id):
         ).to_response()
 
 
+# Note history
+# -----------------------------------------------
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_note_revisions(request, note_id):
+    try:
+        note = Note.objects.only('id').get(id=note_id, user=get_request_user(request))
+    except (Note.DoesNotExist, ValidationError):
+        return ErrorMessage(
+            title="No note found",
+            status=status.HTTP_404_NOT_FOUND,
+            instance=request.build_absolute_uri(),
+            code="N0417",
+            detail="This note does not exist."
+        ).to_response()
+    revisions = NoteRevision.objects.filter(note=note).order_by('-id').values('id', 'created')
+    return Response(data={"revisions": list(revisions)}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def read_note_revision(request, note_id, revision_id):
+    try:
+        revision = NoteRevision.objects.get(
+            id=revision_id, note_id=note_id, note__user=get_request_user(request))
+        document = reconstruct(revision)
+    except (NoteRevision.DoesNotExist, ValidationError):
+        return ErrorMessage(
+            title="No revision found",
+            status=status.HTTP_404_NOT_FOUND,
+            instance=request.build_absolute_uri(),
+            code="N0418",
+            detail="This revision does not exist."
+        ).to_response()
+    except InvalidKeyException:
+        return ErrorMessage(
+            title="Failed reading revision",
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            instance=request.build_absolute_uri(),
+            code="N0550",
+            detail="This revision cannot be retrieved."
+        ).to_response()
+    return Response(data=dict(
+        id=revision.id,
+        note=revision.note_id,
+        created=revision.created,
+        content=json.dumps(document),
+    ), status=status.HTTP_200_OK)
+
+
+# Create, delete and retitle many notes in one transaction
+# -----------------------------------------------
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_notes(request):
+    operations = request.data.get('operations') if isinstance(request.data, dict) else None
+    max_operations = get_setting('BULK_MAX_OPERATIONS', 500)
+    if not isinstance(operations, list) or len(operations) == 0 or len(operations) > max_operations:
+        return ErrorMessage(
+            title="Invalid operations",
+            status=status.HTTP_400_BAD_REQUEST,
+            instance=request.build_absolute_uri(),
+            code="N0416",
+            detail=f"Provide a list of 1 to {max_operations} operations."
+        ).to_response()
+    user = get_request_user(request)
+    timestamp = datetime.now(pytz.utc)
+    results = [None] * len(operations)
+    creates, retitles, deletes, seen = [], [], [], set()
+
+    # Validate every item before touching the database
+    max_title = Note._meta.get_field('title').max_length
+    for index, item in enumerate(operations):
+        op = item.get('op') if isinstance(item, dict) else None
+        if op in ('create', 'retitle') and isinstance(item.get('title'), str) and len(item['title']) > max_title:
+            results[index] = dict(index=index, status=status.HTTP_400_BAD_REQUEST,
+                                  detail=f"The title can be at most {max_title} characters.")
+            continue
+        if op == 'create' and isinstance(item.get('title'), str) and 'content' in item:
+            creates.append((index, item))
+            continue
+        if op in ('delete', 'retitle'):
+            try:
+                note_id = uuid.UUID(str(item.get('id')))
+            except ValueError:
+                note_id = None
+            if note_id is not None and note_id not in seen and (
+                    op == 'delete' or isinstance(item.get('title'), str)):
+                seen.add(note_id)
+                (deletes if op == 'delete' else retitles).append((index, note_id, item))
+                continue
+        results[index] = dict(index=index, status=status.HTTP_400_BAD_REQUEST, detail="Invalid operation.")
+
+    # Ownership of every referenced note in one query
+    owned = {note.id: note for note in Note.objects.filter(user=user, id__in=seen).only(*NOTE_LIST_FIELDS)}
+    for index, note_id, item in deletes + retitles:
+        if note_id not in owned:
+            results[index] = dict(index=index, id=note_id, status=status.HTTP_404_NOT_FOUND,
+                                  detail="This note does not exist.")
+
+    new_notes = [
+        (index, Note(id=uuid.uuid4(), title=item['title'], content=encrypt_note(item['content']),
+                     user=user, created=timestamp, updated=timestamp), item['content'])
+        for index, item in creates
+    ]
+    renamed = []
+    for index, note_id, item in retitles:
+        if note_id in owned:
+            note = owned[note_id]
+            note.title = item['title']
+            note.renamed = timestamp
+            renamed.append((index, note))
+    removed = [(index, note_id) for index, note_id, item in deletes if note_id in owned]
+
+    with transaction.atomic():
+        Note.objects.bulk_create([note for _, note, _ in new_notes])
+        index_new_notes([(note, document) for _, note, document in new_notes])
+        initial_revisions([(note, document) for _, note, document in new_notes])
+        Note.objects.bulk_update([note for _, note in renamed], ['title', 'renamed'])
+        index_note_titles([note for _, note in renamed])
+        share_link_cache.invalidate_notes([note.id for _, note in renamed] + [note_id for _, note_id in removed])
+        Note.objects.filter(user=user, id__in=[note_id for _, note_id in removed]).delete()
+
+    for index, note, _ in new_notes:
+        results[index] = dict(index=index, status=status.HTTP_201_CREATED, **NoteListSerializer(note).data)
+    for index, note in renamed:
+        content_cache.invalidate(note.id)
+        results[index] = dict(index=index, status=status.HTTP_200_OK, **NoteListSerializer(note).data)
+    for index, note_id in removed:
+        content_cache.invalidate(note_id)
+        results[index] = dict(index=index, id=note_id, status=status.HTTP_204_NO_CONTENT)
+    return Response(data={"results": results}, status=status.HTTP_200_OK)
+
+
 # Share a note via unique URL
 # -----------------------------------------------
 # Create a URL
@@ -211,6 +534,8 @@ def create_note_share_link(request, note_id):
                 anonymous=anon
             )
             row.save()
+            # Forget a cached miss for this key
+            share_link_cache.invalidate(row.passkey)
 
             data = dict(
                 title=title,
@@ -243,11 +568,15 @@ def create_note_share_link(request, note_id):
 @api_view(['POST'])
 def read_note_via_share_link(request, perm_key):
     try:
-        query = ShareExternal.objects.select_related('note', 'user').get(
-            passkey=hash_this(perm_key), active=1)
+        passkey = hash_this(perm_key)
+        share = share_link_cache.get(passkey)
+        if share is None:
+            share = resolve_share_link(passkey)
+        if share == share_link_cache.NOT_FOUND:
+            raise ShareExternal.DoesNotExist
 
         # Password is required
-        if len(query.password) > 0 and ('password' not in request.data or len(request.data['password']) < 1):
+        if len(share['password']) > 0 and ('password' not in request.data or len(request.data['password']) < 1):
             return ErrorMessage(
                 title="Access Denied",
                 status=status.HTTP_401_UNAUTHORIZED,
@@ -257,7 +586,7 @@ def read_note_via_share_link(request, perm_key):
             ).to_response()
 
         # Check password
-        if len(query.password) > 0 and query.password != hash_this(request.data['password']):
+        if len(share['password']) > 0 and share['password'] != hash_this(request.data['password']):
             return ErrorMessage(
                 title="Incorrect Password",
                 status=status.HTTP_401_UNAUTHORIZED,
@@ -266,20 +595,41 @@ def read_note_via_share_link(request, perm_key):
                 detail="Provided password is incorrect."
             ).to_response()
 
+        # Records cached before `note_renamed` existed have no rename
+        renamed = share.get('note_renamed')
+        etag = make_etag(share['id'], version_stamp(share['note_updated']), version_stamp(renamed))
+        last_modified = last_changed(share['note_updated'], renamed)
+        headers = validator_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        content = content_cache.get(share['note_id'], share['note_updated'])
+        if content is None:
+            try:
+                content = read_note_content(Note.objects.get(id=share['note_id']))
+            except (InvalidKeyException, InvalidOperationException):
+                return ErrorMessage(
+                    title="Failed reading note",
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    instance=request.build_absolute_uri(),
+                    code="N1549",
+                    detail="This note cannot be retrieved."
+                ).to_response()
+
         # We keep person who externally shared the note anonymous
         response = dict(
-            noteTitle=query.note.title,
-            noteContent=decrypt_note(query.note.content),
-            noteCreated=query.note.created,
-            noteUpdated=query.note.updated,
-            noteSharedOn=query.created,
+            noteTitle=share['note_title'],
+            noteContent=content,
+            noteCreated=share['note_created'],
+            noteUpdated=share['note_updated'],
+            noteSharedOn=share['created'],
         )
         # If person explicitly asked not to be anonymous
-        if query.anonymous is False:
-            response['noteSharedBy'] = query.user.first_name + " " + query.user.last_name
-            response['noteSharedByUID'] = query.user.id
+        if share['anonymous'] is False:
+            response['noteSharedBy'] = share['shared_by']
+            response['noteSharedByUID'] = share['shared_by_uid']
 
-        return Response(data=response, status=status.HTTP_200_OK)
+        return Response(data=response, status=status.HTTP_200_OK, headers=headers)
     except (ShareExternal.DoesNotExist, Note.DoesNotExist):
         return ErrorMessage(
             title="Failed reading note",
@@ -290,18 +640,43 @@ def read_note_via_share_link(request, perm_key):
         ).to_response()
 
 
+# Look up an active share link and remember the outcome
+def resolve_share_link(passkey):
+    try:
+        query = ShareExternal.objects.select_related('note', 'user').get(passkey=passkey, active=1)
+    except ShareExternal.DoesNotExist:
+        share_link_cache.set_not_found(passkey)
+        return share_link_cache.NOT_FOUND
+    return cache_share_record(passkey, query)
+
+
+def cache_share_record(passkey, query):
+    share = dict(
+        id=query.id,
+        password=query.password,
+        anonymous=query.anonymous,
+        created=query.created,
+        shared_by=query.user.first_name + " " + query.user.last_name,
+        shared_by_uid=query.user.id,
+        note_id=query.note.id,
+        note_title=query.note.title,
+        note_created=query.note.created,
+        note_updated=query.note.updated,
+        note_renamed=query.note.renamed,
+    )
+    share_link_cache.set(passkey, share)
+    return share
+
+
 # Read all share links for the note
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_note_share_links(request, note_id):
-    links = ShareExternal.objects.filter(note=note_id, user=get_request_user(request)).values(
-        'id', 'anonymous', 'created', 'title', 'active', 'password').order_by('-created')
-
-    result = []
+    links = list(ShareExternal.objects.filter(note=note_id, user=get_request_user(request)).values(
+        *SHARE_LINK_ROWS.sources, 'password').order_by('-created'))
 
-    for link in links:
-        result.append({**ShareExternalSerializer(link).data,
-                      'isPasswordProtected': True if len(link['password']) > 0 else False})
+    result = [{**item, 'isPasswordProtected': len(link['password']) > 0}
+              for link, item in zip(links, SHARE_LINK_ROWS(links))]
 
     return Response(data=result, status=status.HTTP_200_OK)
 
@@ -315,6 +690,7 @@ def disable_note_share_link(request):
             id=request.data['id'], user=get_request_user(request))
         query.active = False
         query.save()
+        share_link_cache.invalidate(query.passkey)
         return Response(status=status.HTTP_204_NO_CONTENT)
     except ShareExternal.DoesNotExist:
         return ErrorMessage(